@@ -0,0 +1,81 @@
+import heapq
+
+FIRST_FIT = "first_fit"  # lowest free address that can hold the block
+BEST_FIT = "best_fit"  # smallest free block that can hold the block, splitting as little as possible
+
+_MASKS = [(2 ** 32 - 1) ^ (2 ** (32 - length) - 1) for length in range(33)]
+MIN_COMPACTED_HEAP = 64  # heaps smaller than this are left alone, rebuilding them would not save anything
+
+
+class FreeSpace:  # Buddy allocator over the IPv4 space, tracking unallocated space as maximal aligned free blocks
+    def __init__(self, free_prefixes=None):  # (network address, subnet mask length) pairs that are free, disjoint; the whole space by default
+        self.free_blocks: list[set[int]] = [set() for _ in range(33)]  # network addresses of free blocks, by subnet mask length
+        self.heaps: list[list[int]] = [[] for _ in range(33)]  # the same addresses as min-heaps, may still hold stale addresses
+        self.free_addresses: int = 0
+        if free_prefixes is None:
+            self._add(0, 0)
+        else:
+            for network_address, subnet_mask_length in free_prefixes:
+                self.release(network_address, subnet_mask_length)
+
+    def _add(self, network_address: int, subnet_mask_length: int) -> None:
+        self.free_blocks[subnet_mask_length].add(network_address)
+        heapq.heappush(self.heaps[subnet_mask_length], network_address)
+        self.free_addresses += 2 ** (32 - subnet_mask_length)
+
+    def _discard(self, network_address: int, subnet_mask_length: int) -> None:  # the heap entry is dropped lazily
+        free_blocks = self.free_blocks[subnet_mask_length]
+        free_blocks.remove(network_address)
+        self.free_addresses -= 2 ** (32 - subnet_mask_length)
+        heap = self.heaps[subnet_mask_length]
+        if len(heap) >= MIN_COMPACTED_HEAP and len(heap) > 2 * len(free_blocks):  # stale entries outnumber live ones
+            heap[:] = free_blocks
+            heapq.heapify(heap)
+
+    def _lowest(self, subnet_mask_length: int) -> int:  # lowest free block of the given length, or None
+        heap = self.heaps[subnet_mask_length]
+        free_blocks = self.free_blocks[subnet_mask_length]
+        while heap and heap[0] not in free_blocks:
+            heapq.heappop(heap)
+        return heap[0] if heap else None
+
+    # Network address of an unallocated block with the given subnet mask length, or None if there is no room
+    def find(self, subnet_mask_length: int, policy: str = FIRST_FIT) -> int:
+        if not 0 <= subnet_mask_length <= 32:
+            raise ValueError("Invalid subnet mask length: must be between 0 and 32 (inclusive)")
+        if policy == BEST_FIT:
+            for length in range(subnet_mask_length, -1, -1):
+                network_address = self._lowest(length)
+                if network_address is not None:
+                    return network_address
+            return None
+        if policy == FIRST_FIT:
+            candidates = [self._lowest(length) for length in range(subnet_mask_length + 1)]
+            return min((candidate for candidate in candidates if candidate is not None), default=None)
+        raise ValueError("Invalid allocation policy: " + str(policy))
+
+    # Marks a fully unallocated prefix as allocated, splitting the free block that contains it
+    def carve(self, network_address: int, subnet_mask_length: int) -> None:
+        for length in range(subnet_mask_length, -1, -1):
+            free_network_address = network_address & _MASKS[length]
+            if free_network_address in self.free_blocks[length]:
+                self._discard(free_network_address, length)
+                for split_length in range(length + 1, subnet_mask_length + 1):  # free the halves not containing the prefix
+                    self._add((network_address & _MASKS[split_length]) ^ 1 << (32 - split_length), split_length)
+                return
+        raise ValueError("Prefix is not free")
+
+    # Marks a fully allocated prefix as free again, merging it with free buddies
+    def release(self, network_address: int, subnet_mask_length: int) -> None:
+        network_address &= _MASKS[subnet_mask_length]
+        while subnet_mask_length > 0:
+            buddy = network_address ^ 1 << (32 - subnet_mask_length)
+            if buddy not in self.free_blocks[subnet_mask_length]:
+                break
+            self._discard(buddy, subnet_mask_length)
+            subnet_mask_length -= 1
+            network_address &= _MASKS[subnet_mask_length]
+        self._add(network_address, subnet_mask_length)
+
+    def __len__(self) -> int:  # number of free blocks
+        return sum(len(free_blocks) for free_blocks in self.free_blocks)
@@ -1,6 +1,64 @@
-from tkinter import IntVar
+import bisect
+import os
+import time
+from itertools import accumulate
+from tkinter import IntVar, filedialog
 import customtkinter as ctk
+from cache import LookupCache
 from model import Database, IPAddress, IPAddressBlock, Organization
+from metrics import enable_from_environment, metrics
+from tasks import TaskRunner
+
+# Checkpoint loaded after the window is up, with its journal, and rewritten by the Save Database button
+# Same as snapshot.DEFAULT_SNAPSHOT_PATH, spelled out because importing snapshot (and NumPy) would slow down startup
+DATABASE_PATH = "ipv4db.snapshot"
+
+# Fixed card geometry for the virtualized organization list, in unscaled pixels
+ORGANIZATION_CARD_HEIGHT = 170  # name, actions and list title
+NETWORK_CARD_HEIGHT = 68  # one network card, or the "... and N more" label
+MAX_NETWORK_CARDS = 8  # network cards shown per organization card
+CARD_SPACING = 20
+SCROLL_STEP = 60  # per scrollbar unit or mouse wheel notch
+
+SEARCH_DELAY = 250  # milliseconds without typing before the search runs
+SEARCH_RESULT_LIMIT = 500  # organizations a search shows, so a one-letter query does not rank every name
+PROGRESS_DELAY = 300  # milliseconds a task has to run before the progress indicator is shown
+METRICS_REFRESH_INTERVAL = 1000  # milliseconds between updates of the metrics window
+
+# The journal, snapshot and importer modules pull in NumPy, so they are imported on the task thread at first use
+
+def open_saved_database() -> Database:  # every change is journaled from here on
+    from journal import open_database
+    return open_database(DATABASE_PATH)
+
+def import_file(database: Database, path: str, progress=None):
+    from importer import import_file
+    return import_file(database, path, progress=progress)
+
+def add_sample_data(database: Database):
+    # --------------------------- SAMPLE DATA ---------------------------
+    ip1 = IPAddress("155.153.45.23/24")
+    ip1Block = IPAddressBlock(ip1)
+    ip2 = IPAddress("00001111010101011110000110100101/24")
+    ip2Block = IPAddressBlock(ip2)
+    ip3 = IPAddress("96.85.162.16/22")
+    ip3Block = IPAddressBlock(ip3)
+    ip4 = IPAddress("18.1.0.0/20")
+    ip4Block = IPAddressBlock(ip4)
+
+    o1 = Organization("Google", (ip1Block, ip2Block))
+    o2 = Organization("Amazon", ip3Block)
+    o3 = Organization("SpaceX", (ip4Block,))
+    o4 = Organization("Bala's Chicken Store")
+    o5 = Organization("SpaceY")
+    
+    
+    database.add_organization(o1)
+    database.add_organization(o2)
+    database.add_organization(o3)
+    database.add_organization(o4)
+    database.add_organization(o5)
+    # --------------------------- SAMPLE DATA ---------------------------
 
 ctk.set_appearance_mode("System")  # Modes: "System" (standard), "Dark", "Light"
 ctk.set_default_color_theme("blue")  # Themes: "blue" (standard), "green", "dark-blue"
@@ -28,9 +86,31 @@ class LeftSideBarFrame(ctk.CTkFrame):  # Actions to modify database
                                                        command=self.show_allocation_details_input,
                                                        fg_color="gray30")
         self.allocation_details_button.grid(row=3, column=0, padx=20, pady=10)
+        self.save_database_button = ctk.CTkButton(self,
+                                                  text="Save Database",
+                                                  command=self.save_database_input,
+                                                  fg_color="gray30")
+        self.save_database_button.grid(row=4, column=0, padx=20, pady=10)
+        self.import_file_button = ctk.CTkButton(self,
+                                                text="Import File",
+                                                command=self.import_file_input,
+                                                fg_color="gray30")
+        self.import_file_button.grid(row=5, column=0, padx=20, pady=10)
+        self.sample_data_button = ctk.CTkButton(self,
+                                                text="Add Sample Data",
+                                                command=self.add_sample_data_input,
+                                                fg_color="gray30")
+        self.sample_data_button.grid(row=6, column=0, padx=20, pady=10)
+        self.metrics_button = ctk.CTkButton(self,
+                                            text="Debug Metrics",
+                                            command=self.show_metrics_input,
+                                            fg_color="gray30")
+        self.metrics_button.grid(row=7, column=0, padx=20, pady=10)
+        self.database_buttons = [self.add_organization_button, self.remove_organization_button, self.save_database_button,
+                                 self.import_file_button, self.sample_data_button]  # disabled until the database is loaded
         
         # Gap
-        gap_row = 4
+        gap_row = 8
         self.grid_rowconfigure(gap_row, weight=1)
         
         # Appearance Mode/Theme
@@ -51,18 +131,65 @@ class LeftSideBarFrame(ctk.CTkFrame):  # Actions to modify database
 
     def add_organiazation_input(self):
         dialog = ctk.CTkInputDialog(text="Organization Name to Add: ", title="Adding Organization")
-        self.app.database.add_organization(Organization(dialog.get_input()))
-        self.app.reset_search_results()
-        self.app.reset_info_display()
+        name = (dialog.get_input() or "").strip()
+        if not name:  # cancelled, or nothing entered
+            return
+        self.app.tasks.submit(self.app.database.add_organization, Organization(name),
+                              on_done=self.app.database_changed,
+                              on_error=lambda e: print("Error Adding Organization: ", e))
         
     def remove_organiazation_input(self):
         dialog = ctk.CTkInputDialog(text="Organization Name to Remove: ", title="Removing Organization")
-        self.app.database.remove_organization(self.app.database.get_organization_by_name(dialog.get_input()))
-        self.app.reset_search_results()
-        self.app.reset_info_display()
+        name = (dialog.get_input() or "").strip()
+        if not name:
+            return
+        database = self.app.database
+        self.app.tasks.submit(lambda: database.remove_organization(database.get_organization_by_name(name)),
+                              on_done=self.app.database_changed,
+                              on_error=lambda e: print("Error Removing Organization: ", e))
         
     def show_allocation_details_input(self):
         self.app.reset_info_display()
+        
+    def save_database_input(self):
+        self.app.tasks.submit(self.app.database.journal.checkpoint,
+                              on_error=lambda e: print("Error Saving Database: ", e))
+
+    def add_sample_data_input(self):
+        self.app.tasks.submit(add_sample_data, self.app.database,
+                              on_done=self.app.database_changed,
+                              on_error=lambda e: print("Error Adding Sample Data: ", e))
+
+    def set_database_actions_enabled(self, enabled: bool):
+        for button in self.database_buttons:
+            button.configure(state="normal" if enabled else "disabled")
+
+    def show_metrics_input(self):
+        if self.app.metrics_window is not None and self.app.metrics_window.winfo_exists():
+            self.app.metrics_window.focus()
+        else:
+            self.app.metrics_window = MetricsWindow(self.app)
+
+    def import_file_input(self):
+        path = filedialog.askopenfilename(title="Import Allocations",
+                                          filetypes=[("RIR delegated files", "*.txt"), ("CSV allocation dumps", "*.csv"), ("All files", "*")])
+        if not path:
+            return
+        self.app.bottom_frame.hide_message()
+        self.app.bottom_frame.set_status("Importing " + os.path.basename(path))
+        self.app.tasks.submit(import_file, self.app.database, path,
+                              on_done=lambda result: self.import_done(path, result),
+                              on_error=lambda e: self.import_failed(path, e),
+                              on_progress=lambda line_count: self.app.bottom_frame.set_status(f"Importing: {line_count} lines read"))
+
+    def import_done(self, path: str, result):
+        self.app.bottom_frame.show_message(f"{os.path.basename(path)}: imported {result.blocks} blocks "
+                                           f"({result.organizations} new organizations), skipped {result.error_count} invalid lines")
+        self.app.database_changed()
+
+    def import_failed(self, path: str, e: Exception):
+        print("Error Importing File: ", e)
+        self.app.bottom_frame.show_message(f"Could not import {os.path.basename(path)}: {e}")
 
     def change_appearance_mode_event(self, new_appearance_mode: str):
         ctk.set_appearance_mode(new_appearance_mode)
@@ -79,26 +206,35 @@ class RightSideBarFrame(ctk.CTkFrame):  # Shows information on selected item
         # create textbox
         self.textbox = ctk.CTkTextbox(self, 
                                       width=350)
-        self.update_textbox()
         self.textbox.configure(state="disabled")
+        self.update_textbox()
         self.grid_rowconfigure(0, weight=1)
         self.textbox.grid(row=0, column=0, padx=(20, 20), pady=(20, 20), sticky="nsew")
     
-    def update_textbox(self):
+    def update_textbox(self):  # the text is built on the task thread, a newer update supersedes a pending one
+        self.app.tasks.submit(self.describe, self.app.info_display, key="info", on_done=self.set_text)
+
+    def set_text(self, display_str: str):
         self.textbox.configure(state="normal")
         self.textbox.delete("0.0", "end")
-        if self.app.info_display is None:
+        self.textbox.insert("0.0", display_str)
+        self.textbox.configure(state="disabled")
+
+    def describe(self, info_display) -> str:
+        display_str = ""
+        if info_display is None:
             display_str = (
                 f"IP Address Space Allocation Information"
                 + f"\n\nTotal Organizations: {len(self.app.database.organizations)}\n"
                 + f"\n\nTotal IP Addresses in IPv4: 2^32, or {2**32}\n"
                 + f"\n\nTotal IP Addresses Allocated: {self.app.database.total_allocated_ip_addresses()}\n"
-                + f"\n\nTotal Unallocated IP Addresses: {2**32 - self.app.database.total_allocated_ip_addresses()}\n"
+                + f"\n\nTotal Unallocated IP Addresses: {self.app.database.total_unallocated_ip_addresses()}\n"
+                + f"\n\nNetworks by Subnet Mask Length:\n"
+                + "".join(f"\n/{length}: {count}" for length, count in enumerate(self.app.database.stats.blocks_by_subnet_mask_length) if count)
             )
-            self.textbox.insert("0.0", display_str)
         else:
-            if isinstance(self.app.info_display, IPAddress):
-                ip_address = self.app.info_display
+            if isinstance(info_display, IPAddress):
+                ip_address = info_display
                 ip_address_block = IPAddressBlock(ip_address.get_network_address())
                 display_str = (
                     f"IP Address\n\n{ip_address}\n"
@@ -112,9 +248,8 @@ class RightSideBarFrame(ctk.CTkFrame):  # Shows information on selected item
                         + f"\n\nBroadcast Address: {ip_address_block.get_broadcast_address()}"
                     )
                 )
-                self.textbox.insert("0.0", display_str)
-            elif isinstance(self.app.info_display, IPAddressBlock):
-                ip_address_block = self.app.info_display
+            elif isinstance(info_display, IPAddressBlock):
+                ip_address_block = info_display
                 display_str = (
                     f"IP Address Block (Network)\n\n{ip_address_block.get_identity_address()}\n"
                     + ("\n\nThis is not a network address, no information about a network can be inferred\n" 
@@ -127,15 +262,13 @@ class RightSideBarFrame(ctk.CTkFrame):  # Shows information on selected item
                         + f"\n\nBroadcast Address: {ip_address_block.get_broadcast_address()}"
                     )
                 )
-                self.textbox.insert("0.0", display_str)
-            elif isinstance(self.app.info_display, Organization):
-                organization: Organization = self.app.info_display
+            elif isinstance(info_display, Organization):
+                organization: Organization = info_display
                 display_str = (
                     f"Organization\n\n{organization.name}\n"
                     + f"\n\nTotal Owned IP Addresses: {organization.total_ip_addresses()}"
                 )
-                self.textbox.insert("0.0", display_str)
-        self.textbox.configure(state="disabled")
+        return display_str
         
 class BottomFrame(ctk.CTkFrame):  # Allows Searching
     def __init__(self, master, **kwargs):
@@ -147,6 +280,8 @@ class BottomFrame(ctk.CTkFrame):  # Allows Searching
                                   placeholder_text="Search IP Address, Network or Orgnization")
         self.grid_columnconfigure(0, weight=1)
         self.search_entry.grid(row=0, column=0, padx=(20, 0), pady=(20, 20), sticky="nsew")
+        self.search_entry.bind("<KeyRelease>", self.search_entry_changed)
+        self.pending_search = None  # after() id of the search scheduled while typing
 
         # Search button
         self.search_button = ctk.CTkButton(master=self,
@@ -155,14 +290,66 @@ class BottomFrame(ctk.CTkFrame):  # Allows Searching
                                            text="Search")
         self.search_button.grid(row=0, column=1, padx=(20, 20), pady=(20, 20), sticky="nsew")
 
-    def search_input(self):  # handles search input action
-        ip_address, owner, owner_block, organizations = self.app.database.search_all(self.search_entry.get())
+        # Progress indicator, shown while long tasks run
+        self.progress_bar = ctk.CTkProgressBar(self, mode="indeterminate")
+        self.status_label = ctk.CTkLabel(self, text="", anchor="w")
+
+        # Message left after a task, e.g. its result or error, with an optional action button
+        self.message_label = ctk.CTkLabel(self, text="", anchor="w")
+        self.message_button = ctk.CTkButton(master=self, text_color=("gray10", "#DCE4EE"))
+
+    def search_entry_changed(self, event):  # searches as the user types, once they pause
+        if event.char == "\r":  # Enter already searches
+            return
+        if self.pending_search is not None:
+            self.after_cancel(self.pending_search)
+        self.pending_search = self.after(SEARCH_DELAY, self.search_input)
+
+    def search_input(self):  # handles search input action, an older search still in flight is cancelled
+        if self.pending_search is not None:
+            self.after_cancel(self.pending_search)
+            self.pending_search = None
+        query = self.search_entry.get()
+        limit = SEARCH_RESULT_LIMIT if query else None  # an empty search lists every organization
+        self.app.tasks.submit(self.app.database.search_all, query, limit,
+                              key="search", on_done=self.show_search_results)
+
+    def show_search_results(self, results):
+        ip_address, owner, owner_block, organizations = results
         if ip_address is not None:
             self.app.set_info_display(ip_address)
         elif owner is not None:
             self.app.set_info_display(owner)
         self.app.set_search_results(organizations)
 
+    def show_progress(self):
+        self.progress_bar.grid(row=1, column=0, padx=(20, 0), pady=(0, 20), sticky="ew")
+        self.status_label.grid(row=1, column=1, padx=(20, 20), pady=(0, 20), sticky="ew")
+        self.progress_bar.start()
+
+    def hide_progress(self):
+        self.progress_bar.stop()
+        self.progress_bar.grid_forget()
+        self.status_label.grid_forget()
+        self.status_label.configure(text="")
+
+    def set_status(self, text: str):
+        self.status_label.configure(text=text)
+
+    def show_message(self, text: str, action_text: str = None, command=None):  # stays until replaced or hidden
+        self.message_label.configure(text=text)
+        self.message_label.grid(row=2, column=0, padx=(20, 0), pady=(0, 20), sticky="ew")
+        if command is not None:
+            self.message_button.configure(text=action_text, command=command)
+            self.message_button.grid(row=2, column=1, padx=(20, 20), pady=(0, 20), sticky="ew")
+        else:
+            self.message_button.grid_forget()
+
+    def hide_message(self):
+        self.message_label.grid_forget()
+        self.message_button.grid_forget()
+        self.message_label.configure(text="")
+
 class NetworkCardFrame(ctk.CTkFrame):  # Acts as a card displaying information on a network
     def __init__(self, master, app, network, **kwargs):
         super().__init__(master, **kwargs)
@@ -184,6 +371,10 @@ class NetworkCardFrame(ctk.CTkFrame):  # Acts as a card displaying information o
                                            fg_color="gray30")
         self.select_button.grid(row=0, column=1, padx=(10, 10), pady=(10, 10), sticky="nse")
     
+    def set_network(self, network):  # rebinds the card to another network instead of building a new one
+        self.network = network
+        self.label.configure(text=network.get_identity_address())
+    
     def select_input(self):
         self.app.set_info_display(self.network)
 
@@ -194,6 +385,7 @@ class OrganizationCardFrame(ctk.CTkFrame):  # Acts as a card displaying informat
         self.master = master
         self.organization: Organization = organization
         self.grid_columnconfigure(1, weight=1)
+        self.grid_propagate(False)  # the height is fixed by CenterFrame, which lays the cards out itself
         
         # Organization Name
         self.label = ctk.CTkLabel(self,
@@ -220,15 +412,27 @@ class OrganizationCardFrame(ctk.CTkFrame):  # Acts as a card displaying informat
                                                    command=self.remove_network_input,
                                                    text="Remove Network")
         self.remove_network_button.grid(row=1, column=1, padx=(10, 10), pady=(10, 10), sticky="nsw")
+        self.allocate_network_button = ctk.CTkButton(master=self,
+                                                     text_color=("gray10", "#DCE4EE"),
+                                                     command=self.allocate_network_input,
+                                                     text="Allocate Network")
+        self.allocate_network_button.grid(row=1, column=2, padx=(10, 10), pady=(10, 10), sticky="nse")
         
         # List title
-        self.label = ctk.CTkLabel(self,
-                                  text="Networks (Allocated IP Address Blocks)",
-                                  font=ctk.CTkFont(size=16))
-        self.label.grid(row=2, column=0, columnspan=2, padx=(10, 10), pady=(10, 0), sticky="nsw")
+        self.list_title_label = ctk.CTkLabel(self,
+                                             text="Networks (Allocated IP Address Blocks)",
+                                             font=ctk.CTkFont(size=16))
+        self.list_title_label.grid(row=2, column=0, columnspan=2, padx=(10, 10), pady=(10, 0), sticky="nsw")
         
-        # Network Cards
+        # Network Cards, at most MAX_NETWORK_CARDS, the rest are only counted
         self.network_card_frames: list[NetworkCardFrame] = []
+        self.more_networks_label = ctk.CTkLabel(self, text="")
+        self.update_network_frames()
+    
+    def set_organization(self, organization: Organization):  # rebinds a recycled card to another organization
+        if organization is not self.organization:
+            self.organization = organization
+            self.label.configure(text=organization.name)
         self.update_network_frames()
     
     def select_input(self):
@@ -241,9 +445,10 @@ class OrganizationCardFrame(ctk.CTkFrame):  # Acts as a card displaying informat
         except ValueError as e:
             print("Error Creating Network: ", e)
             return
-        self.organization.add_ip_address_block(IPAddressBlock(ip_address))
-        self.update_network_frames()
-        self.app.reset_info_display()
+        organization = self.organization  # the card may be recycled before the task finishes
+        self.app.tasks.submit(organization.add_ip_address_block, IPAddressBlock(ip_address),
+                              on_done=lambda _: self.app.organization_changed(organization),
+                              on_error=lambda e: print("Error Adding Network: ", e))
     
     def remove_network_input(self):
         dialog = ctk.CTkInputDialog(text="Network IP Address to Remove: ", title="Removing Network")
@@ -252,75 +457,230 @@ class OrganizationCardFrame(ctk.CTkFrame):  # Acts as a card displaying informat
         except ValueError as e:
             print("Error Creating Network: ", e)
             return
-        self.organization.remove_ip_address_block(IPAddressBlock(ip_address))
-        self.update_network_frames()
-        self.app.reset_info_display()
+        organization = self.organization
+        self.app.tasks.submit(organization.remove_ip_address_block, IPAddressBlock(ip_address),
+                              on_done=lambda _: self.app.organization_changed(organization),
+                              on_error=lambda e: print("Error Removing Network: ", e))
 
-    def update_network_frames(self):
-        for frame in self.network_card_frames:
+    def allocate_network_input(self):
+        dialog = ctk.CTkInputDialog(text="Subnet Mask Length of the Network to Allocate: ", title="Allocating Network")
+        subnet_mask_length = (dialog.get_input() or "").strip().lstrip("/")
+        if not subnet_mask_length.isdigit():
+            print("Error Allocating Network: Subnet mask length must be an integer")
+            return
+        organization = self.organization
+        self.app.tasks.submit(self.app.database.allocate, organization, int(subnet_mask_length),
+                              on_done=lambda _: self.app.organization_changed(organization),
+                              on_error=lambda e: print("Error Allocating Network: ", e))
+
+    def update_network_frames(self):  # only touches the network cards that changed
+        ip_address_blocks = self.organization.ip_address_blocks[:MAX_NETWORK_CARDS]
+        for index, ip_address_block in enumerate(ip_address_blocks):
+            if index < len(self.network_card_frames):
+                frame = self.network_card_frames[index]
+                if frame.network is not ip_address_block:
+                    frame.set_network(ip_address_block)
+            else:
+                frame = NetworkCardFrame(self, self.app, ip_address_block)
+                frame.grid(row=3 + index, column=0, columnspan=3, padx=(10, 10), pady=(10, 10), sticky="nsew")
+                self.network_card_frames.append(frame)
+        
+        for frame in self.network_card_frames[len(ip_address_blocks):]:
             frame.grid_forget()
             frame.destroy()
-        self.network_card_frames.clear()
-        
-        for ip_address_block in self.organization.ip_address_blocks:
-            frame = NetworkCardFrame(self, self.app, ip_address_block)
-            self.network_card_frames.append(frame)
+        del self.network_card_frames[len(ip_address_blocks):]
         
-        for index, frame in enumerate(self.network_card_frames):
-            frame.grid(row=3 + index, column=0, columnspan=3, padx=(10, 10), pady=(10, 10), sticky="nsew")
+        hidden_count = len(self.organization.ip_address_blocks) - len(ip_address_blocks)
+        if hidden_count > 0:
+            self.more_networks_label.configure(text=f"... and {hidden_count} more (select the organization to see all)")
+            self.more_networks_label.grid(row=3 + len(ip_address_blocks), column=0, columnspan=3, padx=(10, 10), pady=(10, 10), sticky="nsw")
+        else:
+            self.more_networks_label.grid_forget()
+
+def organization_card_height(organization: Organization) -> int:  # height of a card including CARD_SPACING, fixed so rows can be laid out without rendering them
+    network_rows = min(len(organization.ip_address_blocks), MAX_NETWORK_CARDS)
+    if len(organization.ip_address_blocks) > MAX_NETWORK_CARDS:
+        network_rows += 1  # the "... and N more" label
+    return ORGANIZATION_CARD_HEIGHT + network_rows * NETWORK_CARD_HEIGHT + CARD_SPACING
 
-class CenterFrame(ctk.CTkScrollableFrame):  # Shows database
+class CenterFrame(ctk.CTkFrame):  # Shows database, as a virtualized list: only the visible cards exist and they are recycled while scrolling
     def __init__(self, master, **kwargs):
         super().__init__(master, fg_color="transparent", corner_radius=0, **kwargs)
         self.app: App = master
-        self.organization_card_frames = []
+        self.organizations: list[Organization] = []
+        self.row_offsets: list[int] = [0]  # top of each row, and the total height last, unscaled pixels
+        self.scroll_offset = 0  # unscaled pixels from the top of the list to the top of the viewport
+        self.organization_card_frames: dict[int, OrganizationCardFrame] = {}  # id(organization) -> card on screen
+        self.spare_card_frames: list[OrganizationCardFrame] = []  # hidden cards ready to be reused
         self.grid_columnconfigure(0, weight=1)
+        self.grid_rowconfigure(0, weight=1)
+        
+        self.viewport = ctk.CTkFrame(self, fg_color="transparent", corner_radius=0)
+        self.viewport.grid(row=0, column=0, sticky="nsew")
+        self.viewport.bind("<Configure>", lambda event: self.render())
+        self.scrollbar = ctk.CTkScrollbar(self, command=self.scrollbar_input)
+        self.scrollbar.grid(row=0, column=1, sticky="ns")
+        self.bind_all("<MouseWheel>", self.mouse_wheel_input, add="+")
+        self.bind_all("<Button-4>", self.mouse_wheel_input, add="+")
+        self.bind_all("<Button-5>", self.mouse_wheel_input, add="+")
         self.update_all()
 
-    def update_all(self, organizations=None):
-        for frame in self.organization_card_frames:
-            frame.grid_forget()
-            frame.destroy()
-        self.organization_card_frames.clear()
+    def update_all(self, organizations=None):  # cards of organizations still on screen are kept
+        organizations = self.app.database.organizations if organizations is None else organizations
+        self.organizations = list(organizations)  # an atomic copy, the worker may be changing the list, see TaskRunner
+        self.update_row_offsets()
+        self.render(refresh=True)
+
+    def update_organization(self, organization: Organization):  # after the blocks of one organization changed
+        self.update_row_offsets()
+        card = self.organization_card_frames.get(id(organization))
+        if card is not None:
+            card.update_network_frames()
+        self.render()
+
+    def update_row_offsets(self):
+        self.row_offsets = [0]
+        self.row_offsets.extend(accumulate(organization_card_height(organization) for organization in self.organizations))
+
+    def viewport_height(self) -> int:  # unscaled pixels
+        return max(1, round(self.viewport.winfo_height() / self._get_widget_scaling()))
+
+    def render(self, refresh: bool = False):  # places cards for the visible rows, refresh rebinds the ones kept on screen
+        height = self.viewport_height()
+        total_height = self.row_offsets[-1]
+        self.scroll_offset = max(0, min(self.scroll_offset, total_height - height))
+        first = max(0, bisect.bisect_right(self.row_offsets, self.scroll_offset) - 1)
+        last = min(len(self.organizations), bisect.bisect_left(self.row_offsets, self.scroll_offset + height))
+        visible = self.organizations[first:last]
+        
+        visible_ids = {id(organization) for organization in visible}
+        for key in [key for key in self.organization_card_frames if key not in visible_ids]:
+            card = self.organization_card_frames.pop(key)
+            card.place_forget()
+            self.spare_card_frames.append(card)
         
-        organizations = self.app.database.organizations if organizations is None else organizations 
-        for organization in organizations:
-            frame = OrganizationCardFrame(self, self.app, organization)
-            self.organization_card_frames.append(frame)
+        width = max(1, round(self.viewport.winfo_width() / self._get_widget_scaling()) - 2 * CARD_SPACING)
+        for index, organization in enumerate(visible, start=first):
+            card = self.organization_card_frames.get(id(organization))
+            if card is None:
+                if self.spare_card_frames:
+                    card = self.spare_card_frames.pop()
+                    card.set_organization(organization)
+                else:
+                    card = OrganizationCardFrame(self.viewport, self.app, organization)
+                self.organization_card_frames[id(organization)] = card
+            elif refresh:
+                card.set_organization(organization)
+            size = (width, organization_card_height(organization) - CARD_SPACING)
+            if getattr(card, "placed_size", None) != size:
+                card.configure(width=size[0], height=size[1])
+                card.placed_size = size
+            card.place(x=CARD_SPACING, y=self.row_offsets[index] - self.scroll_offset + CARD_SPACING // 2)
         
-        for index, frame in enumerate(self.organization_card_frames):
-            frame.grid(row=index, column=0, padx=(20, 20), pady=(20, 20), sticky="nsew")
+        if total_height > height:
+            self.scrollbar.set(self.scroll_offset / total_height, (self.scroll_offset + height) / total_height)
+        else:
+            self.scrollbar.set(0, 1)
+
+    def scroll_to(self, offset: int):
+        self.scroll_offset = offset
+        self.render()
+
+    def scrollbar_input(self, action, value, unit=None):
+        if action == "moveto":
+            self.scroll_to(round(float(value) * self.row_offsets[-1]))
+        elif action == "scroll":
+            self.scroll_to(self.scroll_offset + int(value) * SCROLL_STEP)
+
+    def mouse_wheel_input(self, event):
+        widget = self.winfo_containing(event.x_root, event.y_root)
+        if widget is None or not str(widget).startswith(str(self.viewport)):  # bound globally, so ignore wheels over other frames
+            return
+        if event.num == 4 or getattr(event, "delta", 0) > 0:
+            self.scroll_to(self.scroll_offset - SCROLL_STEP)
+        elif event.num == 5 or getattr(event, "delta", 0) < 0:
+            self.scroll_to(self.scroll_offset + SCROLL_STEP)
+
+class MetricsWindow(ctk.CTkToplevel):  # Debug panel with live operation rates, metrics are recorded while it is open
+    def __init__(self, master, **kwargs):
+        super().__init__(master, **kwargs)
+        self.app: App = master
+        self.title("IPv4DB Metrics")
+        self.geometry(f"{820}x{460}")
+        self.enabled_here = not metrics.enabled  # metrics switched on by this window are switched off again when it closes
+        metrics.enable()
+        self.previous_counts = metrics.counts()
+        self.previous_time = time.perf_counter()
+        self.refresh_id = None
+        self.grid_columnconfigure(0, weight=1)
+        self.grid_rowconfigure(0, weight=1)
+
+        self.textbox = ctk.CTkTextbox(self, font=ctk.CTkFont(family="Courier", size=13), wrap="none")
+        self.textbox.grid(row=0, column=0, columnspan=3, padx=20, pady=(20, 10), sticky="nsew")
+        self.reset_button = ctk.CTkButton(self, text="Reset", command=self.reset_input, fg_color="gray30")
+        self.reset_button.grid(row=1, column=1, padx=(0, 10), pady=(0, 20))
+        self.save_button = ctk.CTkButton(self, text="Save Metrics", command=self.save_input)
+        self.save_button.grid(row=1, column=2, padx=(0, 20), pady=(0, 20))
+        self.protocol("WM_DELETE_WINDOW", self.close)
+        self.refresh()
+
+    def refresh(self):
+        counts = metrics.counts()
+        now = time.perf_counter()
+        elapsed = max(now - self.previous_time, 1e-9)
+        operations = metrics.to_dict()["operations"]
+        lines = [f"{'Operation':<44}{'Rate/s':>10}{'Calls':>10}{'Mean ms':>10}{'p95 ms':>10}"]
+        for name, operation in operations.items():
+            rate = (counts.get(name, 0) - self.previous_counts.get(name, 0)) / elapsed
+            lines.append(f"{name:<44}{rate:>10.1f}{operation['count']:>10}"
+                         f"{operation['mean_seconds'] * 1000:>10.3f}{operation['p95_seconds'] * 1000:>10.3f}")
+        if self.app.database.lookup_cache is not None:
+            lines.append(f"\n{self.app.database.lookup_cache}")
+        self.previous_counts, self.previous_time = counts, now
+        self.textbox.configure(state="normal")
+        self.textbox.delete("0.0", "end")
+        self.textbox.insert("0.0", "\n".join(lines))
+        self.textbox.configure(state="disabled")
+        self.refresh_id = self.after(METRICS_REFRESH_INTERVAL, self.refresh)
+
+    def reset_input(self):
+        metrics.reset()
+        self.previous_counts = {}
+
+    def save_input(self):
+        path = filedialog.asksaveasfilename(title="Save Metrics", defaultextension=".json",
+                                            filetypes=[("JSON", "*.json"), ("Prometheus text", "*.prom")])
+        if not path:
+            return
+        try:
+            metrics.dump(path)
+        except OSError as e:
+            print("Error Saving Metrics: ", e)
+
+    def close(self):
+        if self.refresh_id is not None:
+            self.after_cancel(self.refresh_id)
+        if self.enabled_here:
+            metrics.disable()
+        self.app.metrics_window = None
+        self.destroy()
+
+# GUI entry points instrumented while metrics are enabled, next to the model ones registered in metrics.py
+metrics.register(CenterFrame, "update_all", "gui.center_frame.update_all")
+metrics.register(CenterFrame, "render", "gui.center_frame.render")
+metrics.register(RightSideBarFrame, "describe", "gui.describe")
 
 class App(ctk.CTk):
     def __init__(self):
         super().__init__()
         
-        self.database = Database()
         self.info_display = None  # value holding the object whose info is to be shown
-        
-        # --------------------------- SAMPLE DATA ---------------------------
-        ip1 = IPAddress("155.153.45.23/24")
-        ip1Block = IPAddressBlock(ip1)
-        ip2 = IPAddress("00001111010101011110000110100101/24")
-        ip2Block = IPAddressBlock(ip2)
-        ip3 = IPAddress("96.85.162.16/22")
-        ip3Block = IPAddressBlock(ip3)
-        ip4 = IPAddress("18.1.0.0/20")
-        ip4Block = IPAddressBlock(ip4)
-
-        o1 = Organization("Google", (ip1Block, ip2Block))
-        o2 = Organization("Amazon", ip3Block)
-        o3 = Organization("SpaceX", (ip4Block,))
-        o4 = Organization("Bala's Chicken Store")
-        o5 = Organization("SpaceY")
-        
-        
-        self.database.add_organization(o1)
-        self.database.add_organization(o2)
-        self.database.add_organization(o3)
-        self.database.add_organization(o4)
-        self.database.add_organization(o5)
-        # --------------------------- SAMPLE DATA ---------------------------
+        self.tasks = TaskRunner(self, on_busy_changed=self.set_busy)  # all database work goes through here
+        self.progress_indicator_id = None  # after() id that shows the progress indicator
+        self.metrics_window = None  # MetricsWindow while open
+        self.database = Database()  # empty stand-in until the saved database is loaded, see load_database
+        self.database_loaded = False
+        self.database_load_error = None  # why the last load failed, until it is retried
         
         # configure window
         self.title("IPv4DB")
@@ -346,6 +706,30 @@ class App(ctk.CTk):
         self.bottom_frame = BottomFrame(self)
         self.bottom_frame.grid(row=1, column=1, sticky="nsew")
         self.bind("<KeyPress>", lambda event: self.bottom_frame.search_input() if event.char == "\r" else None)
+        self.protocol("WM_DELETE_WINDOW", self.close)
+
+        # the window is shown first, the database is loaded on the task thread once the event loop runs
+        self.left_sidebar_frame.set_database_actions_enabled(False)
+        self.after_idle(self.load_database)
+
+    def load_database(self):
+        self.database_load_error = None
+        self.bottom_frame.hide_message()
+        self.bottom_frame.set_status("Loading database")
+        self.tasks.submit(open_saved_database, on_done=self.set_database, on_error=self.database_load_failed)
+
+    def database_load_failed(self, e: Exception):  # the buttons stay disabled, the journal must not be started over the saved files
+        print("Error Loading Database: ", e)
+        self.database_load_error = e
+        self.bottom_frame.show_message(f"Could not load database: {e}", "Retry", self.load_database)
+
+    def set_database(self, database: Database):
+        self.database = database
+        self.database.lookup_cache = LookupCache()  # searches for the same addresses repeat a lot
+        metrics.collectors["lookup_cache"] = self.database.lookup_cache.counters
+        self.database_loaded = True
+        self.left_sidebar_frame.set_database_actions_enabled(True)
+        self.database_changed()
 
     def set_info_display(self, item):
         self.info_display = item
@@ -355,6 +739,29 @@ class App(ctk.CTk):
         self.info_display = None
         self.right_sidebar_frame.update_textbox()
     
+    def database_changed(self, _=None):  # after organizations were added or removed
+        self.reset_search_results()
+        self.reset_info_display()
+
+    def organization_changed(self, organization: Organization):  # after the blocks of one organization changed
+        self.center_frame.update_organization(organization)
+        self.reset_info_display()
+
+    def set_busy(self, busy: bool):
+        if busy:
+            self.progress_indicator_id = self.after(PROGRESS_DELAY, lambda: self.bottom_frame.show_progress())
+        else:
+            if self.progress_indicator_id is not None:
+                self.after_cancel(self.progress_indicator_id)
+                self.progress_indicator_id = None
+            self.bottom_frame.hide_progress()
+
+    def close(self):
+        self.tasks.shutdown(wait=True)  # a running task may still be changing the database
+        if self.database.journal is not None:
+            self.database.journal.close()
+        self.destroy()
+
     def set_search_results(self, organizations):
         self.center_frame.update_all(organizations)
         
@@ -362,5 +769,6 @@ class App(ctk.CTk):
         self.center_frame.update_all()
 
 if __name__ == "__main__":
+    enable_from_environment()
     app = App()
     app.mainloop()
\ No newline at end of file
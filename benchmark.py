@@ -0,0 +1,330 @@
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from model import ALLOW_OVERLAPS, REJECT_OVERLAPS, Database, IPAddress, IPAddressBlock, Organization, parse_many
+
+# Share of blocks of each subnet mask length, roughly shaped like a routing table / registry dump: mostly /24s,
+# a long tail of larger allocations and a few more specifics
+PREFIX_LENGTH_WEIGHTS = {8: 0.01, 10: 0.02, 12: 0.05, 13: 0.1, 14: 0.3, 15: 0.5, 16: 2.0, 17: 1.0, 18: 1.5, 19: 3.0,
+                         20: 4.0, 21: 5.0, 22: 10.0, 23: 8.0, 24: 55.0, 25: 1.0, 26: 1.0, 27: 0.8, 28: 0.8, 29: 1.0,
+                         30: 0.5, 31: 0.1, 32: 0.3}
+ORGANIZATION_NAME_WORDS = ["Telecom", "Networks", "Cloud", "Data", "Hosting", "Internet", "Cable", "Mobile",
+                           "University", "Bank", "Energy", "Media", "Systems", "Global", "Digital", "Services"]
+SUITE_FORMAT_VERSION = 1  # of the JSON written by the suite benchmark
+
+
+def random_ip_address_strings(count: int, seed: int = 0) -> list[str]:  # mix of plain and CIDR dotted decimal strings
+    generator = random.Random(seed)
+    ip_address_strings = []
+    for _ in range(count):
+        ip_address = ".".join(str(generator.randrange(256)) for _ in range(4))
+        if generator.random() < 0.5:
+            ip_address += "/" + str(generator.randint(8, 32))
+        ip_address_strings.append(ip_address)
+    return ip_address_strings
+
+
+def report(name: str, count: int, seconds: float) -> None:
+    print(f"{name:<40} {seconds:8.3f} s  {count / seconds:14,.0f} /s")
+
+
+def time_call(function, *args) -> float:
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
+
+
+def benchmark_parse(count: int) -> None:
+    ip_address_strings = random_ip_address_strings(count)
+
+    def slow_constructor(strings):  # the validating constructor used for every string before the fast path
+        for string in strings:
+            IPAddress()._parse_str(string)
+
+    def fast_constructor(strings):
+        for string in strings:
+            IPAddress(string)
+
+    report("IPAddress._parse_str (previous constructor)", count, time_call(slow_constructor, ip_address_strings))
+    report("IPAddress(str) (fast path)", count, time_call(fast_constructor, ip_address_strings))
+    report("parse_many", count, time_call(parse_many, ip_address_strings))
+
+
+def random_prefixes(count: int, seed: int = 0) -> list[tuple[int, int]]:  # (network address, subnet mask length) pairs
+    generator = random.Random(seed)
+    prefixes = []
+    for _ in range(count):
+        subnet_mask_length = generator.randint(8, 32)
+        prefixes.append((generator.getrandbits(32) & (2 ** 32 - 2 ** (32 - subnet_mask_length)), subnet_mask_length))
+    return prefixes
+
+
+def benchmark_memory(count: int) -> None:
+    prefixes = random_prefixes(count)
+
+    def load_blocks():
+        return [IPAddressBlock(IPAddress(network_address, subnet_mask_length)) for network_address, subnet_mask_length in prefixes]
+
+    report("IPAddressBlock(IPAddress(...))", count, time_call(load_blocks))
+
+    tracemalloc.start()
+    blocks = load_blocks()
+    allocated, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{'memory per block':<40} {allocated / count:8.1f} B  {allocated / 2 ** 20:11,.1f} MiB total")
+    del blocks
+
+    report("IPAddressBlock._from_int", count, time_call(lambda: [IPAddressBlock._from_int(*prefix) for prefix in prefixes]))
+
+    blocks = [IPAddressBlock._from_int(*prefix) for prefix in prefixes]
+    probe = IPAddress(random.Random(1).getrandbits(32))
+    report("IPAddressBlock.contains", count, time_call(lambda: [block.contains(probe) for block in blocks]))
+    report("IPAddressBlock.get_broadcast_address", count, time_call(lambda: [block.get_broadcast_address() for block in blocks]))
+
+
+# Builds a reproducible database of block_count blocks: the same seed always gives the same database
+# Organizations hold a skewed number of blocks (a few large holders, many small ones) and blocks may nest, like real registry data
+def generate_database(block_count: int, seed: int = 0, blocks_per_organization: int = 10) -> Database:
+    generator = random.Random(seed)
+    lengths = generator.choices(list(PREFIX_LENGTH_WEIGHTS), weights=list(PREFIX_LENGTH_WEIGHTS.values()), k=block_count)
+    organization_count = max(1, block_count // blocks_per_organization)
+    block_lists = [[] for _ in range(organization_count)]
+    for subnet_mask_length in lengths:
+        if generator.random() < 0.5:
+            organization_index = generator.randrange(organization_count)
+        else:  # log-uniform rank, so the first organizations are the big holders
+            organization_index = int(organization_count ** generator.random()) - 1
+        network_address = generator.getrandbits(32) & (2 ** 32 - 2 ** (32 - subnet_mask_length))
+        block_lists[organization_index].append(IPAddressBlock._from_int(network_address, subnet_mask_length))
+
+    database = Database()
+    database.overlap_policy = ALLOW_OVERLAPS  # random blocks overlap now and then, as in real dumps
+    was_enabled = gc.isenabled()
+    gc.disable()  # millions of long lived objects would trigger repeated full collections
+    try:
+        for organization_index, ip_address_blocks in enumerate(block_lists):
+            name = f"{generator.choice(ORGANIZATION_NAME_WORDS)} {generator.choice(ORGANIZATION_NAME_WORDS)} {organization_index}"
+            database.add_organization(Organization(name, ip_address_blocks))
+    finally:
+        if was_enabled:
+            gc.enable()
+    database.overlap_policy = REJECT_OVERLAPS
+    return database
+
+
+def measure(function, count: int) -> dict:  # runs function once, it is expected to perform count operations
+    seconds = time_call(function)
+    return {"count": count, "seconds": round(seconds, 6), "per_second": round(count / seconds, 1) if seconds else None}
+
+
+def benchmark_suite_size(block_count: int, seed: int, queries: int, measure_memory: bool) -> dict:
+    generator = random.Random(seed + 1)
+    result = {"blocks": block_count}
+    start = time.perf_counter()
+    database = generate_database(block_count, seed)
+    result["build"] = {"count": block_count, "seconds": round(time.perf_counter() - start, 6)}
+    result["organizations"] = len(database.organizations)
+
+    if measure_memory:
+        del database
+        gc.collect()
+        tracemalloc.start()
+        database = generate_database(block_count, seed)
+        allocated, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        result["memory"] = {"bytes": allocated, "bytes_per_block": round(allocated / block_count, 1)}
+
+    ip_address_strings = random_ip_address_strings(queries, seed)
+    result["parse"] = measure(lambda: [IPAddress(string) for string in ip_address_strings], queries)
+    result["search_all_address"] = measure(lambda: [database.search_all(string, 10) for string in ip_address_strings], queries)
+    names = [generator.choice(database.organizations).name for _ in range(queries)]
+    fragments = [generator.choice(ORGANIZATION_NAME_WORDS)[:generator.randint(2, 6)].lower() for _ in range(queries)]
+    result["search_all_name"] = measure(lambda: [database.search_all(name, 10) for name in names], queries)
+    result["search_all_substring"] = measure(lambda: [database.search_all(fragment, 10) for fragment in fragments], queries)
+
+    organizations = [generator.choice(database.organizations) for _ in range(queries)]
+    ip_addresses = [IPAddress(generator.getrandbits(32)) for _ in range(queries)]
+    result["owns_ip_address"] = measure(lambda: [organization.owns_ip_address(ip_address)
+                                                 for organization, ip_address in zip(organizations, ip_addresses)], queries)
+    result["find_owner"] = measure(lambda: [database.find_owner(ip_address) for ip_address in ip_addresses], queries)
+    result["total_allocated_ip_addresses"] = measure(lambda: [database.total_allocated_ip_addresses() for _ in range(queries)], queries)
+    result["total_ip_addresses"] = measure(lambda: [organization.total_ip_addresses() for organization in organizations], queries)
+
+    block = IPAddressBlock(IPAddress("10.0.0.0/16"))
+    result["iterate_block"] = measure(lambda: sum(1 for _ in block), block.get_num_addresses() - 2)
+    block = IPAddressBlock(IPAddress("10.0.0.0/8"))
+    result["iterate_block_numpy"] = measure(lambda: sum(int(chunk.sum(dtype="u8")) for chunk in block.iter_numpy()), block.get_num_addresses())
+    return result
+
+
+def benchmark_suite(sizes: list[int], seed: int, queries: int, measure_memory: bool) -> dict:
+    results = []
+    for block_count in sizes:
+        print(f"suite: {block_count} blocks", file=sys.stderr)
+        results.append(benchmark_suite_size(block_count, seed, queries, measure_memory))
+    return {
+        "format_version": SUITE_FORMAT_VERSION,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "seed": seed,
+        "queries": queries,
+        "results": results,
+    }
+
+
+# Compares two suite outputs, prints the change of every timing present in both and returns the ones that got slower than threshold
+def compare_suites(baseline: dict, current: dict, threshold: float) -> list[str]:
+    regressions = []
+    baseline_results = {result["blocks"]: result for result in baseline["results"]}
+    for result in current["results"]:
+        baseline_result = baseline_results.get(result["blocks"])
+        if baseline_result is None:
+            continue
+        for name, timing in result.items():
+            if not isinstance(timing, dict) or "seconds" not in timing or "seconds" not in baseline_result.get(name, {}):
+                continue
+            ratio = timing["seconds"] / baseline_result[name]["seconds"] if baseline_result[name]["seconds"] else 1.0
+            label = f"{result['blocks']} blocks {name}"
+            print(f"{label:<48} {baseline_result[name]['seconds']:10.4f} s -> {timing['seconds']:10.4f} s  x{ratio:.2f}")
+            if ratio > threshold:
+                regressions.append(label)
+    return regressions
+
+
+def benchmark_parallel(block_count: int, count: int, max_processes: int) -> None:  # lookup throughput by number of worker processes
+    import numpy as np
+    from parallel import ParallelLookup
+    from snapshot import Snapshot
+    snapshot = Snapshot.from_database(generate_database(block_count))
+    ip_addresses = np.random.default_rng(0).integers(0, 2 ** 32, count, dtype=np.uint64).astype(np.uint32)
+    report("Snapshot.lookup_many (one process)", count, time_call(snapshot.lookup_many, ip_addresses))
+    processes = 1
+    while processes <= max_processes:
+        with ParallelLookup(snapshot, processes) as parallel_lookup:
+            parallel_lookup.lookup_many(ip_addresses[:processes])  # starts the workers
+            report(f"ParallelLookup ({processes} processes)", count, time_call(parallel_lookup.lookup_many, ip_addresses))
+        processes *= 2
+
+
+STARTUP_MODULES = ("model", "ipv4db", "application")  # cold imports timed by the startup benchmark
+_IMPORT_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+print(json.dumps({{"seconds": time.perf_counter() - start, "numpy_imported": "numpy" in sys.modules}}))
+"""
+_FIRST_FRAME_SCRIPT = """
+import json, time
+start = time.perf_counter()
+try:
+    import application
+    app = application.App()
+    app.update()  # the first frame is drawn and input is handled from here on
+except Exception as e:  # no display, e.g. _tkinter.TclError on a headless machine
+    print(json.dumps({"error": str(e)}))
+    raise SystemExit
+first_frame = time.perf_counter() - start
+while not app.database_loaded and app.database_load_error is None:
+    app.update()
+    time.sleep(0.001)
+loaded = time.perf_counter() - start
+app.close()
+if app.database_load_error is not None:
+    print(json.dumps({"error": f"Could not load database: {app.database_load_error}"}))
+    raise SystemExit
+print(json.dumps({"first_frame_seconds": first_frame, "database_loaded_seconds": loaded}))
+"""
+
+
+def _run_script(script: str, directory: str) -> dict:  # in a fresh interpreter, so nothing is imported yet
+    environment = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.abspath(__file__)))
+    completed = subprocess.run([sys.executable, "-c", script], cwd=directory, env=environment, capture_output=True, text=True)
+    lines = completed.stdout.strip().splitlines()
+    return json.loads(lines[-1]) if lines else {"error": completed.stderr.strip().splitlines()[-1]}
+
+
+# Cold import of each module and, where a display is available, time from importing the GUI to its first frame and
+# until the saved database (block_count blocks) is loaded; median of repeats, interpreter startup not included
+def benchmark_startup(block_count: int, seed: int, repeats: int) -> dict:
+    from snapshot import save_snapshot
+    results = {"format_version": SUITE_FORMAT_VERSION, "python": platform.python_version(), "blocks": block_count, "imports": {}}
+    for module in STARTUP_MODULES:
+        runs = [_run_script(_IMPORT_SCRIPT.format(module=module), os.getcwd()) for _ in range(repeats)]
+        results["imports"][module] = {"seconds": statistics.median(run["seconds"] for run in runs),
+                                      "numpy_imported": runs[0]["numpy_imported"]} if "error" not in runs[0] else runs[0]
+    with tempfile.TemporaryDirectory() as directory:
+        save_snapshot(generate_database(block_count, seed), os.path.join(directory, "ipv4db.snapshot"))
+        runs = [_run_script(_FIRST_FRAME_SCRIPT, directory) for _ in range(repeats)]
+    if "error" in runs[0]:
+        results["first_frame"] = {"skipped": runs[0]["error"]}
+    else:
+        results["first_frame"] = {name: statistics.median(run[name] for run in runs) for name in ("first_frame_seconds", "database_loaded_seconds")}
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="IPv4DB model benchmarks")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+    parse_parser = subparsers.add_parser("parse", help="string parsing throughput")
+    parse_parser.add_argument("--count", type=int, default=200_000)
+    memory_parser = subparsers.add_parser("memory", help="memory use and throughput of loading address blocks")
+    memory_parser.add_argument("--count", type=int, default=1_000_000)
+    suite_parser = subparsers.add_parser("suite", help="model operations on seeded synthetic databases, as JSON")
+    suite_parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000], help="blocks per database, up to 10M")
+    suite_parser.add_argument("--seed", type=int, default=0)
+    suite_parser.add_argument("--queries", type=int, default=10_000, help="operations timed per benchmark")
+    suite_parser.add_argument("--no-memory", action="store_true", help="skip the traced second build used to measure memory")
+    suite_parser.add_argument("--output", help="write the JSON here instead of stdout")
+    parallel_parser = subparsers.add_parser("parallel", help="multi-process lookup throughput")
+    parallel_parser.add_argument("--blocks", type=int, default=100_000)
+    parallel_parser.add_argument("--count", type=int, default=20_000_000)
+    parallel_parser.add_argument("--max-processes", type=int, default=os.cpu_count() or 1)
+    startup_parser = subparsers.add_parser("startup", help="cold import and GUI time to first frame, as JSON")
+    startup_parser.add_argument("--blocks", type=int, default=100_000, help="blocks in the saved database the GUI loads")
+    startup_parser.add_argument("--seed", type=int, default=0)
+    startup_parser.add_argument("--repeats", type=int, default=3)
+    compare_parser = subparsers.add_parser("compare", help="compare two suite outputs, exits with 1 on regressions")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=1.2, help="slowdown ratio counted as a regression")
+    args = parser.parse_args()
+
+    if args.benchmark == "parse":
+        benchmark_parse(args.count)
+    elif args.benchmark == "memory":
+        benchmark_memory(args.count)
+    elif args.benchmark == "suite":
+        output = json.dumps(benchmark_suite(args.sizes, args.seed, args.queries, not args.no_memory), indent=2)
+        if args.output:
+            with open(args.output, "w") as file:
+                file.write(output + "\n")
+        else:
+            print(output)
+    elif args.benchmark == "parallel":
+        benchmark_parallel(args.blocks, args.count, args.max_processes)
+    elif args.benchmark == "startup":
+        print(json.dumps(benchmark_startup(args.blocks, args.seed, args.repeats), indent=2))
+    elif args.benchmark == "compare":
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        with open(args.current) as file:
+            current = json.load(file)
+        regressions = compare_suites(baseline, current, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regressions: " + ", ".join(regressions))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+from collections import OrderedDict
+
+DEFAULT_CAPACITY = 65_536  # addresses remembered by a LookupCache
+BUCKET_SHIFT = 16  # cached addresses are also grouped by their /16, so invalidating a range only visits the groups it covers
+
+
+class LookupCache:  # Bounded LRU of ownership lookup results, keyed by int address
+    def __init__(self, capacity: int = DEFAULT_CAPACITY):
+        if capacity < 1:
+            raise ValueError("Invalid cache capacity: must be at least 1")
+        self.capacity = capacity
+        self.entries = OrderedDict()  # address -> (organization, block), or (None, None) if unallocated; least recently used first
+        self.buckets = {}  # address >> BUCKET_SHIFT -> set of the cached addresses in that /16
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0  # entries dropped to stay within capacity
+        self.invalidations = 0  # entries dropped because a block covering them changed
+
+    def get(self, ip_address: int):  # cached result, or None on a miss
+        result = self.entries.get(ip_address)
+        if result is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(ip_address)
+        self.hits += 1
+        return result
+
+    def put(self, ip_address: int, result: tuple) -> None:
+        if ip_address not in self.entries:
+            self.buckets.setdefault(ip_address >> BUCKET_SHIFT, set()).add(ip_address)
+        self.entries[ip_address] = result
+        self.entries.move_to_end(ip_address)
+        if len(self.entries) > self.capacity:
+            evicted, _ = self.entries.popitem(last=False)
+            self._discard_from_bucket(evicted)
+            self.evictions += 1
+
+    def _discard_from_bucket(self, ip_address: int) -> None:
+        bucket = self.buckets[ip_address >> BUCKET_SHIFT]
+        bucket.discard(ip_address)
+        if not bucket:
+            del self.buckets[ip_address >> BUCKET_SHIFT]
+
+    # Drops the results of the addresses first to last (inclusive), the only ones a changed block can affect
+    # Visits only the /16 groups in the range that hold cached addresses (or the groups that exist, if fewer), then
+    # drops the groups it covers whole and filters the two at its ends, so the cost follows what is actually dropped
+    def invalidate_range(self, first: int, last: int) -> None:
+        first_bucket, last_bucket = first >> BUCKET_SHIFT, last >> BUCKET_SHIFT
+        if last_bucket - first_bucket + 1 <= len(self.buckets):
+            keys = [key for key in range(first_bucket, last_bucket + 1) if key in self.buckets]
+        else:
+            keys = [key for key in self.buckets if first_bucket <= key <= last_bucket]
+        stale = []
+        for key in keys:
+            bucket = self.buckets[key]
+            if first <= key << BUCKET_SHIFT and ((key + 1) << BUCKET_SHIFT) - 1 <= last:  # covered whole
+                stale.extend(bucket)
+                del self.buckets[key]
+                continue
+            low, high = max(first, key << BUCKET_SHIFT), min(last, ((key + 1) << BUCKET_SHIFT) - 1)
+            if high - low + 1 <= len(bucket):
+                dropped = [ip_address for ip_address in range(low, high + 1) if ip_address in bucket]
+            else:
+                dropped = [ip_address for ip_address in bucket if low <= ip_address <= high]
+            bucket.difference_update(dropped)
+            if not bucket:
+                del self.buckets[key]
+            stale.extend(dropped)
+        for ip_address in stale:
+            del self.entries[ip_address]
+        self.invalidations += len(stale)
+
+    def clear(self) -> None:
+        self.invalidations += len(self.entries)
+        self.entries.clear()
+        self.buckets.clear()
+
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def counters(self) -> dict:
+        return {"size": len(self.entries), "capacity": self.capacity, "hits": self.hits, "misses": self.misses,
+                "evictions": self.evictions, "invalidations": self.invalidations}
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __repr__(self):
+        return f"LookupCache: {len(self.entries)}/{self.capacity} entries, {self.hits} hits, {self.misses} misses, {self.evictions} evictions, {self.invalidations} invalidations"
@@ -0,0 +1,191 @@
+import numpy as np
+
+from model import IPAddress, IPAddressBlock
+
+_ADDRESS_SPACE_END = 2 ** 32
+
+
+def _exponents(values: np.ndarray) -> np.ndarray:  # floor(log2(values)) of positive int64 values below 2^53
+    return np.frexp(values.astype(np.float64))[1].astype(np.int64) - 1
+
+
+# Minimal CIDR cover of each of the half-open ranges [starts, stops), as (network addresses, subnet mask lengths, range indices)
+# ordered by range and then by address. Every round takes the largest aligned block that fits at the start of each range,
+# so there are at most 64 rounds and each only looks at the ranges still open.
+def _ranges_to_prefixes(starts: np.ndarray, stops: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    starts = np.asarray(starts, dtype=np.int64).copy()
+    stops = np.asarray(stops, dtype=np.int64)
+    prefix_counts = np.zeros(len(starts), dtype=np.int64)  # prefixes emitted so far for each range
+    range_indices = np.flatnonzero(starts < stops)
+    starts, stops = starts[range_indices], stops[range_indices]
+    rounds = []  # (network addresses, subnet mask lengths, range indices, rank of the prefix within its range)
+    while len(starts):
+        alignment = np.where(starts == 0, _ADDRESS_SPACE_END, starts & -starts)  # largest block aligned at the start
+        sizes = np.minimum(alignment, np.left_shift(1, _exponents(stops - starts)))  # ... that still fits in the range
+        rounds.append((starts.copy(), 32 - _exponents(sizes), range_indices, prefix_counts[range_indices]))
+        prefix_counts[range_indices] += 1
+        starts += sizes
+        active = starts < stops
+        starts, stops, range_indices = starts[active], stops[active], range_indices[active]
+
+    # every range gets a run of slots in range order, and its prefixes fill the run in the order they were emitted
+    range_offsets = np.cumsum(prefix_counts) - prefix_counts
+    total = int(prefix_counts.sum())
+    network_addresses = np.empty(total, dtype=np.uint32)
+    subnet_mask_lengths = np.empty(total, dtype=np.uint8)
+    prefix_range_indices = np.empty(total, dtype=np.int64)
+    for round_addresses, round_lengths, round_range_indices, ranks in rounds:
+        slots = range_offsets[round_range_indices] + ranks
+        network_addresses[slots] = round_addresses
+        subnet_mask_lengths[slots] = round_lengths
+        prefix_range_indices[slots] = round_range_indices
+    return network_addresses, subnet_mask_lengths, prefix_range_indices
+
+
+# Bulk model.range_to_prefixes for arrays of inclusive [first, last] ranges, which may overlap: returns
+# (uint32 network addresses, uint8 subnet mask lengths, index of the range each prefix covers part of),
+# ordered by range and then by address
+def ranges_to_prefixes(firsts, lasts) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    firsts = np.asarray(firsts, dtype=np.int64)
+    lasts = np.asarray(lasts, dtype=np.int64)
+    if len(firsts) != len(lasts):
+        raise ValueError("Expected as many range ends as range starts")
+    if len(firsts) and (firsts.min() < 0 or lasts.max() >= _ADDRESS_SPACE_END or (firsts > lasts).any()):
+        raise ValueError("Invalid address range: must satisfy 0 <= first <= last < 2^32")
+    return _ranges_to_prefixes(firsts, lasts + 1)
+
+
+# Bulk model.block_to_range: inclusive (firsts, lasts) uint32 arrays of prefixes, host bits are dropped like IPAddressBlock does
+def prefixes_to_ranges(network_addresses, subnet_mask_lengths) -> tuple[np.ndarray, np.ndarray]:
+    network_addresses = np.asarray(network_addresses, dtype=np.int64)
+    subnet_mask_lengths = np.asarray(subnet_mask_lengths, dtype=np.int64)
+    if len(subnet_mask_lengths) and (subnet_mask_lengths.min() < 0 or subnet_mask_lengths.max() > 32):
+        raise ValueError("Invalid subnet mask length: must be between 0 and 32 (inclusive)")
+    sizes = np.left_shift(1, 32 - subnet_mask_lengths)
+    firsts = network_addresses & ~(sizes - 1)
+    return firsts.astype(np.uint32), (firsts + sizes - 1).astype(np.uint32)
+
+
+class CIDRSet:  # Immutable set of IPv4 addresses stored as sorted, disjoint, non-adjacent half-open intervals
+    def __init__(self, blocks=()):  # blocks are IPAddressBlocks, or anything IPAddressBlock accepts
+        firsts, lasts = [], []
+        for block in blocks:
+            if not isinstance(block, IPAddressBlock):
+                block = IPAddressBlock(block)
+            firsts.append(block.first)
+            lasts.append(block.last)
+        self.starts, self.stops = self._normalize(np.asarray(firsts, dtype=np.int64), np.asarray(lasts, dtype=np.int64) + 1)
+
+    @classmethod
+    def _from_intervals(cls, starts: np.ndarray, stops: np.ndarray) -> 'CIDRSet':  # starts/stops must already be normalized
+        cidr_set = object.__new__(cls)
+        cidr_set.starts = starts  # int64, sorted ascending
+        cidr_set.stops = stops  # int64, exclusive, always below the next start
+        return cidr_set
+
+    @staticmethod
+    def from_prefixes(network_addresses, subnet_mask_lengths) -> 'CIDRSet':  # arrays of prefixes, e.g. from parse_many or a Snapshot
+        firsts, lasts = prefixes_to_ranges(network_addresses, subnet_mask_lengths)
+        return CIDRSet._from_intervals(*CIDRSet._normalize(firsts.astype(np.int64), lasts.astype(np.int64) + 1))
+
+    @staticmethod
+    def from_ranges(firsts, lasts) -> 'CIDRSet':  # arrays of inclusive [first, last] address ranges, which may overlap
+        firsts = np.asarray(firsts, dtype=np.int64)
+        lasts = np.asarray(lasts, dtype=np.int64)
+        if len(firsts) != len(lasts):
+            raise ValueError("Expected as many range ends as range starts")
+        if len(firsts) and (firsts.min() < 0 or lasts.max() >= _ADDRESS_SPACE_END or (firsts > lasts).any()):
+            raise ValueError("Invalid address range: must satisfy 0 <= first <= last < 2^32")
+        return CIDRSet._from_intervals(*CIDRSet._normalize(firsts, lasts + 1))
+
+    @staticmethod
+    def _normalize(starts: np.ndarray, stops: np.ndarray) -> tuple[np.ndarray, np.ndarray]:  # sorts and merges overlapping or adjacent intervals
+        if not len(starts):
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        order = np.argsort(starts, kind="stable")
+        starts, stops = starts[order], np.maximum.accumulate(stops[order])
+        is_first = np.empty(len(starts), dtype=bool)
+        is_first[0] = True
+        is_first[1:] = starts[1:] > stops[:-1]  # not touching anything before it
+        last_of_run = np.append(np.flatnonzero(is_first)[1:] - 1, len(starts) - 1)
+        return starts[is_first], stops[last_of_run]
+
+    # Sweeps the boundaries of both sets, keeping the stretches where keep(in self + 2 * in other) is true
+    def _combine(self, other: 'CIDRSet', keep) -> 'CIDRSet':
+        positions = np.concatenate((self.starts, self.stops, other.starts, other.stops))
+        if not len(positions):
+            return CIDRSet()
+        deltas = np.concatenate((np.full(len(self.starts), 1), np.full(len(self.stops), -1),
+                                 np.full(len(other.starts), 2), np.full(len(other.stops), -2)))
+        order = np.argsort(positions, kind="stable")
+        positions, deltas = positions[order], deltas[order]
+        boundaries = np.flatnonzero(np.append(True, positions[1:] != positions[:-1]))
+        positions = positions[boundaries]
+        states = np.cumsum(np.add.reduceat(deltas, boundaries))  # state of the stretch [positions[i], positions[i + 1])
+        kept = keep(states[:-1])
+        return CIDRSet._from_intervals(*CIDRSet._normalize(positions[:-1][kept], positions[1:][kept]))
+
+    def union(self, other: 'CIDRSet') -> 'CIDRSet':
+        return CIDRSet._from_intervals(*CIDRSet._normalize(np.concatenate((self.starts, other.starts)),
+                                                           np.concatenate((self.stops, other.stops))))
+
+    def intersection(self, other: 'CIDRSet') -> 'CIDRSet':
+        return self._combine(other, lambda states: states == 3)
+
+    def difference(self, other: 'CIDRSet') -> 'CIDRSet':
+        return self._combine(other, lambda states: states == 1)
+
+    def symmetric_difference(self, other: 'CIDRSet') -> 'CIDRSet':
+        return self._combine(other, lambda states: (states == 1) | (states == 2))
+
+    def complement(self) -> 'CIDRSet':  # every address of the IPv4 space not in the set
+        starts = np.concatenate(([0], self.stops))
+        stops = np.concatenate((self.starts, [_ADDRESS_SPACE_END]))
+        kept = starts < stops
+        return CIDRSet._from_intervals(starts[kept], stops[kept])
+
+    __or__ = union
+    __and__ = intersection
+    __sub__ = difference
+    __xor__ = symmetric_difference
+    __invert__ = complement
+
+    def to_prefixes(self) -> tuple[np.ndarray, np.ndarray]:  # minimal CIDR cover as (uint32 network addresses, uint8 subnet mask lengths)
+        network_addresses, subnet_mask_lengths, _ = _ranges_to_prefixes(self.starts, self.stops)
+        return network_addresses, subnet_mask_lengths
+
+    def to_blocks(self) -> list[IPAddressBlock]:  # minimal list of blocks covering exactly the set, in address order
+        network_addresses, subnet_mask_lengths = self.to_prefixes()
+        return [IPAddressBlock._from_int(network_address, subnet_mask_length)
+                for network_address, subnet_mask_length in zip(network_addresses.tolist(), subnet_mask_lengths.tolist())]
+
+    def ranges(self) -> list[tuple[int, int]]:  # inclusive (first, last) address ranges, in address order
+        return list(zip(self.starts.tolist(), (self.stops - 1).tolist()))
+
+    def get_num_addresses(self) -> int:
+        return int((self.stops - self.starts).sum())
+
+    def contains(self, item) -> bool:  # an address (IPAddress or int), or a whole IPAddressBlock
+        if isinstance(item, IPAddressBlock):
+            first, last = item.first, item.last
+        else:
+            first = last = item.ip_address if isinstance(item, IPAddress) else item
+        index = np.searchsorted(self.starts, first, side="right") - 1
+        return bool(index >= 0 and last < self.stops[index])
+
+    __contains__ = contains
+
+    def __bool__(self) -> bool:
+        return len(self.starts) > 0
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, CIDRSet):
+            return NotImplemented
+        return np.array_equal(self.starts, other.starts) and np.array_equal(self.stops, other.stops)
+
+    def __repr__(self):
+        return f"CIDRSet: {len(self.starts)} ranges, {self.get_num_addresses()} addresses"
+
+
+def aggregate(blocks) -> list[IPAddressBlock]:  # collapses blocks into the minimal list of blocks covering the same addresses
+    return CIDRSet(blocks).to_blocks()
@@ -0,0 +1,116 @@
+# Point-in-time view of the allocations, for questions like "who owned this address on a given day"
+# Every change creates a new version of a PersistentPrefixTrie, which copies only the path to the changed prefix
+# (at most 33 nodes) and shares everything else with the previous version. Keeping a version per timestamp
+# therefore costs space in proportion to the changes, and a lookup as of any timestamp is a binary search for
+# the version followed by the same trie walk as a current lookup.
+import bisect
+import time
+from collections import Counter
+
+from index import PersistentPrefixTrie, PrefixTrie
+from model import Database, IPAddress, IPAddressBlock, Organization
+
+
+class Allocation:  # One assignment of a block to an organization, valid from valid_from until valid_until (exclusive)
+    __slots__ = ("organization_name", "ip_address_block", "valid_from", "valid_until")
+
+    def __init__(self, organization_name: str, ip_address_block: IPAddressBlock, valid_from: float):
+        self.organization_name: str = organization_name
+        self.ip_address_block: IPAddressBlock = ip_address_block
+        self.valid_from: float = valid_from  # timestamps are seconds since the epoch, as time.time() returns them
+        self.valid_until: float = None  # None while the assignment is current
+
+    def is_valid_at(self, timestamp: float) -> bool:
+        return self.valid_from <= timestamp and (self.valid_until is None or timestamp < self.valid_until)
+
+    def __repr__(self):
+        return (f"{self.organization_name}: {self.ip_address_block.get_identity_address()} "
+                f"[{self.valid_from}, {'now' if self.valid_until is None else self.valid_until})")
+
+
+def _key(organization_name: str, ip_address_block: IPAddressBlock) -> tuple:
+    return organization_name, ip_address_block.first, ip_address_block.ip_address.subnet_mask_length
+
+
+class AllocationHistory:  # Every version of the allocations since the history was started, attached as database.history
+    def __init__(self, clock=time.time):
+        self.clock = clock  # timestamp of changes made through the database hooks, e.g. the date of a dump being loaded
+        self.timestamps: list[float] = []  # one per version, increasing
+        self.versions: list[PersistentPrefixTrie] = []  # Allocation values, the trie of timestamps[i]
+        self.current: dict = {}  # (organization name, network address, subnet mask length) -> current Allocations for it
+        self.all_allocations = PrefixTrie()  # every Allocation ever made, for timelines
+
+    def attach(self, database: Database) -> None:  # records the current allocations of the database as a version, then follows its changes
+        self.record_state([(organization.name, block) for organization in database.organizations for block in organization.ip_address_blocks], self._now())
+        database.history = self
+
+    # Database hooks, with the time of the change taken from the clock
+
+    def blocks_added(self, organization: Organization, ip_address_blocks: list[IPAddressBlock]) -> None:
+        self._change(self._now(), [(organization.name, block) for block in ip_address_blocks], [])
+
+    def blocks_removed(self, organization: Organization, ip_address_blocks: list[IPAddressBlock]) -> None:
+        self._change(self._now(), [], [(organization.name, block) for block in ip_address_blocks])
+
+    # Makes the latest version equal the given (organization name, block) pairs, recording only what differs
+    # Loading a series of dumps this way (e.g. one per day, oldest first) stores each dump's changes, not its copy
+    def record_state(self, allocations, timestamp: float) -> None:
+        if self.timestamps and timestamp < self.timestamps[-1]:
+            raise ValueError("Invalid timestamp: history can only be extended after its latest version")
+        blocks = {}
+        wanted = Counter()
+        for organization_name, ip_address_block in allocations:
+            key = _key(organization_name, ip_address_block)
+            blocks.setdefault(key, ip_address_block)
+            wanted[key] += 1
+        held = Counter({key: len(current) for key, current in self.current.items()})
+        added = [(key[0], blocks[key]) for key, count in (wanted - held).items() for _ in range(count)]
+        removed = [(key[0], IPAddressBlock._from_int(key[1], key[2])) for key, count in (held - wanted).items() for _ in range(count)]
+        self._change(timestamp, added, removed)
+
+    def _now(self) -> float:
+        timestamp = self.clock()
+        return max(timestamp, self.timestamps[-1]) if self.timestamps else timestamp  # the clock may step back, versions may not
+
+    def _change(self, timestamp: float, added: list, removed: list) -> None:
+        if not added and not removed:
+            return
+        trie = self.versions[-1] if self.versions else PersistentPrefixTrie()
+        for organization_name, ip_address_block in removed:
+            current = self.current[_key(organization_name, ip_address_block)]
+            allocation = current.pop()
+            if not current:
+                del self.current[_key(organization_name, ip_address_block)]
+            allocation.valid_until = timestamp
+            trie = trie.remove(ip_address_block.first, ip_address_block.ip_address.subnet_mask_length, allocation)
+        for organization_name, ip_address_block in added:
+            allocation = Allocation(organization_name, ip_address_block, timestamp)
+            self.current.setdefault(_key(organization_name, ip_address_block), []).append(allocation)
+            trie = trie.insert(ip_address_block.first, ip_address_block.ip_address.subnet_mask_length, allocation)
+            self.all_allocations.insert(ip_address_block.first, ip_address_block.ip_address.subnet_mask_length, allocation)
+        if self.timestamps and self.timestamps[-1] == timestamp:  # changes made at the same time form one version
+            self.versions[-1] = trie
+        else:
+            self.timestamps.append(timestamp)
+            self.versions.append(trie)
+
+    def version_at(self, timestamp: float) -> PersistentPrefixTrie:  # the allocations as they were at the timestamp
+        index = bisect.bisect_right(self.timestamps, timestamp) - 1
+        return self.versions[index] if index >= 0 else PersistentPrefixTrie()
+
+    def find_owner_at(self, ip_address: IPAddress, timestamp: float) -> Allocation:  # most specific allocation containing the address at the timestamp, or None
+        ip_address = ip_address if isinstance(ip_address, int) else ip_address.ip_address
+        return self.version_at(timestamp).longest_match(ip_address)
+
+    def allocations_at(self, timestamp: float) -> list[Allocation]:  # in address order
+        return self.version_at(timestamp).values()
+
+    def timeline(self, ip_address: IPAddress) -> list[Allocation]:  # every allocation that ever contained the address, oldest first
+        ip_address = ip_address if isinstance(ip_address, int) else ip_address.ip_address
+        return sorted(self.all_allocations.overlapping(ip_address, 32), key=lambda allocation: allocation.valid_from)
+
+    def __len__(self) -> int:  # number of versions
+        return len(self.versions)
+
+    def __repr__(self):
+        return f"AllocationHistory: {len(self.versions)} versions, {len(self.all_allocations)} allocations"
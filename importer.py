@@ -0,0 +1,196 @@
+import csv
+import gc
+import os
+from contextlib import contextmanager
+
+from cidr import ranges_to_prefixes
+from model import Database, IPAddress, IPAddressBlock, Organization, OverlapError
+
+DEFAULT_BATCH_SIZE = 10_000  # blocks buffered before they are inserted into the database
+MAX_REPORTED_ERRORS = 1000  # later errors are only counted
+
+
+class ImportResult:
+    def __init__(self):
+        self.lines: int = 0
+        self.blocks: int = 0
+        self.organizations: int = 0  # organizations created by the import
+        self.error_count: int = 0
+        self.errors: list[tuple[int, str]] = []  # (line number, message), the first MAX_REPORTED_ERRORS only
+
+    def add_error(self, line_number: int, message: str) -> None:
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line_number, message))
+
+    def __repr__(self):
+        return f"Imported {self.blocks} blocks from {self.lines} lines ({self.organizations} new organizations, {self.error_count} errors)"
+
+
+def _read_lines(source):  # yields the lines of a path, or of an already open file or any iterable of strings
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, encoding="utf-8", errors="replace", newline="") as file:
+            yield from file
+    else:
+        yield from source
+
+
+# Bulk imports allocate millions of long lived objects, which would otherwise be traversed again by every collection
+# Each flushed batch is moved to the permanent generation with gc.freeze(), so collections during the import only
+# look at the objects created since. gc.freeze() is process wide: whatever the other threads (e.g. the Tk main loop)
+# hold at that moment is exempted too, and cycles among it are only collected after the import. gc.unfreeze() at the
+# end returns everything to the oldest generation. The collector stays enabled throughout, so the worst a concurrent
+# import can do is unfreeze this one early, which costs time but never leaks.
+@contextmanager
+def _gc_frozen_batches():
+    try:
+        yield
+    finally:
+        gc.unfreeze()
+
+
+class _BatchInserter:  # buffers parsed blocks per organization and inserts them in bulk
+    def __init__(self, database: Database, result: ImportResult, batch_size: int):
+        self.database = database
+        self.result = result
+        self.batch_size = batch_size
+        self.organizations = {}  # name -> Organization, covers the whole database so lookups stay O(1)
+        for organization in database.organizations:
+            self.organizations.setdefault(organization.name, organization)
+        self.pending = {}  # name -> (line number, block) pairs waiting to be inserted
+        self.pending_ranges = []  # (line number, name, first, last) waiting to be split into blocks, all at once
+        self.pending_count = 0
+
+    def add(self, name: str, ip_address_block: IPAddressBlock, line_number: int) -> None:
+        self.pending.setdefault(name, []).append((line_number, ip_address_block))
+        self.pending_count += 1
+        if self.pending_count >= self.batch_size:
+            self.flush()
+
+    def add_range(self, name: str, first: int, last: int, line_number: int) -> None:  # an arbitrary inclusive address range
+        self.pending.setdefault(name, [])  # keeps organizations in the order they first appear
+        self.pending_ranges.append((line_number, name, first, last))
+        self.pending_count += 1
+        if self.pending_count >= self.batch_size:
+            self.flush()
+
+    def _split_ranges(self) -> None:  # converts the pending ranges to blocks with one bulk conversion
+        if not self.pending_ranges:
+            return
+        network_addresses, subnet_mask_lengths, range_indices = ranges_to_prefixes([first for _, _, first, _ in self.pending_ranges],
+                                                                                   [last for _, _, _, last in self.pending_ranges])
+        for network_address, subnet_mask_length, range_index in zip(network_addresses.tolist(), subnet_mask_lengths.tolist(), range_indices.tolist()):
+            line_number, name, _, _ = self.pending_ranges[range_index]
+            self.pending.setdefault(name, []).append((line_number, IPAddressBlock._from_int(network_address, subnet_mask_length)))
+        self.pending_ranges.clear()
+
+    def flush(self) -> None:
+        self._split_ranges()
+        for name, pending_blocks in self.pending.items():
+            organization = self.organizations.get(name)
+            if organization is None:
+                organization = Organization(name)
+                self.organizations[name] = organization
+                self.database.add_organization(organization)
+                self.result.organizations += 1
+            try:
+                organization.add_ip_address_blocks([block for _, block in pending_blocks])
+                self.result.blocks += len(pending_blocks)
+            except OverlapError:  # retry one by one so only the overlapping lines are rejected
+                for line_number, block in pending_blocks:
+                    try:
+                        organization.add_ip_address_block(block)
+                        self.result.blocks += 1
+                    except OverlapError as e:
+                        self.result.add_error(line_number, str(e))
+        self.pending.clear()
+        self.pending_count = 0
+        gc.freeze()  # see _gc_frozen_batches
+
+
+# Imports an RIR "delegated" or "delegated-extended" statistics file:
+#   registry|cc|type|start|value|date|status[|opaque-id[|extensions...]]
+# Allocated and assigned ipv4 records become blocks of the organization named by the opaque id,
+# or by "registry cc" for files without one. Header, summary and other records are skipped.
+def import_delegated(database: Database, source, batch_size: int = DEFAULT_BATCH_SIZE, progress=None) -> ImportResult:
+    with _gc_frozen_batches():
+        return _import_delegated(database, source, batch_size, progress)
+
+
+def _import_delegated(database: Database, source, batch_size: int, progress) -> ImportResult:
+    result = ImportResult()
+    inserter = _BatchInserter(database, result, batch_size)
+    for line_number, line in enumerate(_read_lines(source), start=1):
+        result.lines = line_number
+        if progress is not None and line_number % batch_size == 0:
+            progress(line_number)
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        fields = line.split("|")
+        if len(fields) < 7 or fields[2] != "ipv4" or fields[1] == "*":  # version line, summary line or another address family
+            continue
+        if fields[6] not in ("allocated", "assigned"):
+            continue
+        try:
+            start = IPAddress(fields[3]).ip_address
+            if not fields[4].isdigit() or not 0 < int(fields[4]) <= 2 ** 32 - start:
+                raise ValueError("Invalid address count: " + fields[4])
+        except ValueError as e:
+            result.add_error(line_number, str(e))
+            continue
+        name = fields[7] if len(fields) > 7 and fields[7] else fields[0] + " " + fields[1]
+        inserter.add_range(name, start, start + int(fields[4]) - 1, line_number)
+    inserter.flush()
+    return result
+
+
+# Imports a CSV dump of "organization,prefix" rows, an optional header row is skipped.
+# Prefixes without a subnet mask length are taken as single addresses (/32), and a
+# "first-last" address range in place of the prefix is split into the blocks covering it.
+def import_allocation_csv(database: Database, source, batch_size: int = DEFAULT_BATCH_SIZE, progress=None) -> ImportResult:
+    with _gc_frozen_batches():
+        return _import_allocation_csv(database, source, batch_size, progress)
+
+
+def _import_allocation_csv(database: Database, source, batch_size: int, progress) -> ImportResult:
+    result = ImportResult()
+    inserter = _BatchInserter(database, result, batch_size)
+    for line_number, row in enumerate(csv.reader(_read_lines(source)), start=1):
+        result.lines = line_number
+        if progress is not None and line_number % batch_size == 0:
+            progress(line_number)
+        if not row or not "".join(row).strip():
+            continue
+        if len(row) < 2:
+            result.add_error(line_number, "Expected organization,prefix")
+            continue
+        name, prefix = row[0].strip(), row[1].strip()
+        if "-" in prefix:
+            try:
+                first, last = (IPAddress(address.strip()).ip_address for address in prefix.split("-", 1))
+                if first > last:
+                    raise ValueError("Invalid address range: first address is after the last one")
+            except ValueError as e:
+                result.add_error(line_number, str(e))
+                continue
+            inserter.add_range(name, first, last, line_number)
+            continue
+        try:
+            ip_address = IPAddress(prefix)
+        except ValueError as e:
+            if line_number == 1:  # header row
+                continue
+            result.add_error(line_number, str(e))
+            continue
+        if "/" not in prefix:
+            ip_address.subnet_mask_length = 32
+        inserter.add(name, IPAddressBlock(ip_address), line_number)
+    inserter.flush()
+    return result
+
+
+def import_file(database: Database, path: str, batch_size: int = DEFAULT_BATCH_SIZE, progress=None) -> ImportResult:  # picks the format from the file extension
+    if path.lower().endswith(".csv"):
+        return import_allocation_csv(database, path, batch_size, progress)
+    return import_delegated(database, path, batch_size, progress)
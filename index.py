@@ -0,0 +1,416 @@
+import bisect
+import heapq
+from itertools import islice
+
+
+class _PrefixTrieNode:
+    __slots__ = ("prefix", "length", "children", "entries")
+
+    def __init__(self, prefix: int, length: int):
+        self.prefix: int = prefix  # network address of the node, host bits are always 0
+        self.length: int = length  # 0-32
+        self.children: list = [None, None]  # indexed by the bit that follows the prefix
+        self.entries: list = []  # values stored at exactly this prefix, in insertion order
+
+
+_MASKS = [(2 ** 32 - 1) ^ (2 ** (32 - length) - 1) for length in range(33)]  # subnet mask for each prefix length
+
+
+def _common_length(a: int, b: int, limit: int) -> int:  # number of leading bits a and b share, capped at limit
+    difference = (a ^ b) & 0xFFFFFFFF
+    if difference == 0:
+        return limit
+    return min(32 - difference.bit_length(), limit)
+
+
+class PrefixTrie:  # Path compressed binary (Patricia) trie keyed by IPv4 prefixes
+    def __init__(self):
+        self.root = _PrefixTrieNode(0, 0)
+        self.size = 0
+
+    def insert(self, prefix: int, length: int, value) -> None:
+        prefix &= _MASKS[length]
+        node = self.root
+        while True:  # node always matches the first node.length bits of prefix, and node.length <= length
+            if node.length == length:
+                node.entries.append(value)
+                self.size += 1
+                return
+            bit = (prefix >> (31 - node.length)) & 1
+            child = node.children[bit]
+            if child is None:  # empty branch, hang a new leaf here
+                leaf = _PrefixTrieNode(prefix, length)
+                leaf.entries.append(value)
+                node.children[bit] = leaf
+                self.size += 1
+                return
+            if child.length <= length and not (prefix ^ child.prefix) & _MASKS[child.length]:  # child is an ancestor of prefix, keep walking
+                node = child
+                continue
+            common = _common_length(child.prefix, prefix, min(child.length, length))
+            # prefix and child diverge before child ends, so an intermediate node is needed
+            middle = _PrefixTrieNode(prefix & _MASKS[common], common)
+            middle.children[(child.prefix >> (31 - common)) & 1] = child
+            if common == length:  # prefix is itself the ancestor of child
+                middle.entries.append(value)
+            else:
+                leaf = _PrefixTrieNode(prefix, length)
+                leaf.entries.append(value)
+                middle.children[(prefix >> (31 - common)) & 1] = leaf
+            node.children[bit] = middle
+            self.size += 1
+            return
+
+    def remove(self, prefix: int, length: int, value) -> None:  # throws a ValueError if value is not stored at the prefix
+        prefix &= _MASKS[length]
+        path = []  # (parent, bit) pairs leading to node
+        node = self.root
+        while node is not None and node.length < length:
+            bit = (prefix >> (31 - node.length)) & 1
+            path.append((node, bit))
+            node = node.children[bit]
+        if node is None or node.length != length or node.prefix != prefix:
+            raise ValueError("Prefix not in trie")
+        node.entries.remove(value)
+        self.size -= 1
+
+        # collapse nodes that no longer store anything and no longer branch
+        while path and not node.entries:
+            parent, bit = path.pop()
+            children = [child for child in node.children if child is not None]
+            if len(children) == 2:
+                break
+            parent.children[bit] = children[0] if children else None
+            if children:
+                break
+            node = parent  # parent lost a child, it may not be needed anymore either
+
+    def longest_match(self, ip_address: int, max_length: int = 32):  # most recently added value of the most specific prefix containing ip_address, or None
+        best = None
+        node = self.root
+        while node is not None and node.length <= max_length:
+            if node.length and (ip_address ^ node.prefix) & _MASKS[node.length]:
+                break
+            if node.entries:
+                best = node.entries[-1]
+            if node.length == 32:
+                break
+            node = node.children[(ip_address >> (31 - node.length)) & 1]
+        return best
+
+    def get(self, prefix: int, length: int) -> list:  # values stored at exactly this prefix
+        prefix &= _MASKS[length]
+        node = self.root
+        while node is not None and node.length < length:
+            node = node.children[(prefix >> (31 - node.length)) & 1]
+        if node is None or node.length != length or node.prefix != prefix:
+            return []
+        return list(node.entries)
+
+    def overlapping(self, prefix: int, length: int) -> list:  # values of every stored prefix that encloses, equals or lies inside the prefix
+        prefix &= _MASKS[length]
+        values = []
+        node = self.root
+        while node is not None:
+            if node.length >= length:
+                if not (node.prefix ^ prefix) & _MASKS[length]:
+                    self._collect_values(node, values)
+                break
+            if node.length and (prefix ^ node.prefix) & _MASKS[node.length]:
+                break
+            values.extend(node.entries)
+            node = node.children[(prefix >> (31 - node.length)) & 1]
+        return values
+
+    def _collect_values(self, node: _PrefixTrieNode, values: list) -> None:
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            values.extend(node.entries)
+            stack.extend(child for child in node.children if child is not None)
+
+    # The parts of a prefix not covered by any stored prefix, as a minimal list of (prefix, length) in address order
+    # If counts is given only the values it returns True for are taken into account
+    def uncovered(self, prefix: int, length: int, counts=None) -> list[tuple[int, int]]:
+        prefix &= _MASKS[length]
+        node = self.root
+        while node is not None:
+            if node.length >= length:  # first node at or below the prefix, the subtree to search if it lies inside it
+                if (node.prefix ^ prefix) & _MASKS[length]:
+                    node = None
+                break
+            if node.length and (prefix ^ node.prefix) & _MASKS[node.length]:  # the branch leads away from the prefix
+                node = None
+                break
+            if self._covers(node, counts):  # an enclosing prefix covers all of it
+                return []
+            node = node.children[(prefix >> (31 - node.length)) & 1]
+        gaps = []
+        self._collect_gaps(prefix, length, node, counts, gaps)
+        return gaps
+
+    @staticmethod
+    def _covers(node: _PrefixTrieNode, counts) -> bool:
+        if counts is None:
+            return bool(node.entries)
+        return any(counts(value) for value in node.entries)
+
+    def _collect_gaps(self, prefix: int, length: int, node: _PrefixTrieNode, counts, gaps: list) -> None:  # node is None or inside prefix/length
+        if node is None:
+            gaps.append((prefix, length))
+        elif node.length == length:
+            if self._covers(node, counts):
+                return
+            if length == 32:
+                gaps.append((prefix, length))
+                return
+            self._collect_gaps(prefix, length + 1, node.children[0], counts, gaps)
+            self._collect_gaps(prefix | 1 << (31 - length), length + 1, node.children[1], counts, gaps)
+        else:  # node is deeper, only the half containing it needs to be searched
+            bit = (node.prefix >> (31 - length)) & 1
+            self._collect_gaps(prefix, length + 1, node if bit == 0 else None, counts, gaps)
+            self._collect_gaps(prefix | 1 << (31 - length), length + 1, node if bit == 1 else None, counts, gaps)
+
+    def __len__(self) -> int:
+        return self.size
+
+
+class _PersistentNode:  # never modified once built, so any number of tries can share it
+    __slots__ = ("prefix", "length", "children", "entries")
+
+    def __init__(self, prefix: int, length: int, children: tuple = (None, None), entries: tuple = ()):
+        self.prefix: int = prefix
+        self.length: int = length
+        self.children: tuple = children
+        self.entries: tuple = entries
+
+
+def _with_child(children: tuple, bit: int, child) -> tuple:
+    return (child, children[1]) if bit == 0 else (children[0], child)
+
+
+def _persistent_insert(node: _PersistentNode, prefix: int, length: int, value) -> _PersistentNode:  # copy of node with value added
+    if node.length == length:
+        return _PersistentNode(node.prefix, length, node.children, node.entries + (value,))
+    bit = (prefix >> (31 - node.length)) & 1
+    child = node.children[bit]
+    if child is None:
+        child = _PersistentNode(prefix, length, entries=(value,))
+    elif child.length <= length and not (prefix ^ child.prefix) & _MASKS[child.length]:
+        child = _persistent_insert(child, prefix, length, value)
+    else:  # same cases as PrefixTrie.insert
+        common = _common_length(child.prefix, prefix, min(child.length, length))
+        child_bit = (child.prefix >> (31 - common)) & 1
+        if common == length:
+            child = _PersistentNode(prefix, length, _with_child((None, None), child_bit, child), (value,))
+        else:
+            leaf = _PersistentNode(prefix, length, entries=(value,))
+            child = _PersistentNode(prefix & _MASKS[common], common, _with_child((leaf, leaf), child_bit, child))
+    return _PersistentNode(node.prefix, node.length, _with_child(node.children, bit, child), node.entries)
+
+
+def _persistent_remove(node: _PersistentNode, prefix: int, length: int, value) -> _PersistentNode:  # copy of node without value, None if nothing is left below it
+    if node.length == length:
+        if node.prefix != prefix or not any(entry is value for entry in node.entries):
+            raise ValueError("Prefix not in trie")
+        index = max(index for index, entry in enumerate(node.entries) if entry is value)
+        node = _PersistentNode(node.prefix, length, node.children, node.entries[:index] + node.entries[index + 1:])
+    else:
+        bit = (prefix >> (31 - node.length)) & 1
+        child = node.children[bit]
+        if child is None or child.length > length or (prefix ^ child.prefix) & _MASKS[child.length]:
+            raise ValueError("Prefix not in trie")
+        node = _PersistentNode(node.prefix, node.length, _with_child(node.children, bit, _persistent_remove(child, prefix, length, value)), node.entries)
+    if node.entries or node.length == 0:  # the root is always kept
+        return node
+    children = [child for child in node.children if child is not None]
+    return node if len(children) == 2 else (children[0] if children else None)  # collapses nodes that no longer store anything and no longer branch
+
+
+class PersistentPrefixTrie:  # Immutable PrefixTrie: insert and remove return a new trie that shares all but the changed path with this one
+    def __init__(self, root: _PersistentNode = None, size: int = 0):
+        self.root = root or _PersistentNode(0, 0)
+        self.size = size
+
+    def insert(self, prefix: int, length: int, value) -> 'PersistentPrefixTrie':
+        return PersistentPrefixTrie(_persistent_insert(self.root, prefix & _MASKS[length], length, value), self.size + 1)
+
+    def remove(self, prefix: int, length: int, value) -> 'PersistentPrefixTrie':  # value is matched by identity; throws a ValueError if it is not stored at the prefix
+        return PersistentPrefixTrie(_persistent_remove(self.root, prefix & _MASKS[length], length, value), self.size - 1)
+
+    def longest_match(self, ip_address: int):  # same as PrefixTrie.longest_match
+        best = None
+        node = self.root
+        while node is not None:
+            if node.length and (ip_address ^ node.prefix) & _MASKS[node.length]:
+                break
+            if node.entries:
+                best = node.entries[-1]
+            if node.length == 32:
+                break
+            node = node.children[(ip_address >> (31 - node.length)) & 1]
+        return best
+
+    def values(self) -> list:  # every stored value, in prefix order
+        values = []
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            values.extend(node.entries)
+            stack.extend(child for child in reversed(node.children) if child is not None)
+        return values
+
+    def __len__(self) -> int:
+        return self.size
+
+
+class NameIndex:  # Exact lookup and ranked, case-insensitive prefix/substring search over names
+    def __init__(self):
+        self.by_name = {}  # exact name -> values with that name, in insertion order
+        self.values = {}  # sequence number -> value, sequence numbers follow insertion order
+        self.sequence_numbers = {}  # id(value) -> sequence number
+        self.lowercase_names = {}  # sequence number -> lowercase name
+        # Names grouped by length, since prefix matches rank shorter names first: for each length the names in
+        # insertion order, and the same names sorted as (lowercase name, sequence number) for prefix ranges
+        self.names_by_length = {}  # name length -> {sequence number: lowercase name}
+        self.sorted_names = {}  # name length -> sorted (lowercase name, sequence number)
+        self.unsorted_names = {}  # name length -> names added since it was last sorted, merged in on the next search
+        # Lowercase trigram -> sequence numbers of the names containing it. Names are padded with two "\0" so every
+        # position starts a trigram, which makes any 1 or 2 character substring the prefix of one of them
+        self.trigrams = {}
+        self.trigrams_by_prefix = {}  # first 1 or 2 characters -> the trigrams starting with them, for short queries
+        self.next_sequence_number = 0
+
+    def add(self, name: str, value) -> None:  # O(1) plus the trigrams, so loading n names costs one sort instead of n insertions
+        sequence_number = self.next_sequence_number
+        self.next_sequence_number += 1
+        lowercase_name = name.lower()
+        self.by_name.setdefault(name, []).append(value)
+        self.values[sequence_number] = value
+        self.sequence_numbers[id(value)] = sequence_number
+        self.lowercase_names[sequence_number] = lowercase_name
+        self.names_by_length.setdefault(len(lowercase_name), {})[sequence_number] = lowercase_name
+        self.unsorted_names.setdefault(len(lowercase_name), []).append((lowercase_name, sequence_number))
+        for trigram in _trigrams(lowercase_name + "\0\0"):
+            postings = self.trigrams.get(trigram)
+            if postings is None:
+                postings = self.trigrams[trigram] = set()
+                self.trigrams_by_prefix.setdefault(trigram[:1], set()).add(trigram)
+                self.trigrams_by_prefix.setdefault(trigram[:2], set()).add(trigram)
+            postings.add(sequence_number)
+
+    def remove(self, name: str, value) -> None:
+        sequence_number = self.sequence_numbers.pop(id(value))
+        values = self.by_name[name]
+        values.remove(value)
+        if not values:
+            del self.by_name[name]
+        del self.values[sequence_number]
+        lowercase_name = self.lowercase_names.pop(sequence_number)
+        length = len(lowercase_name)
+        del self.names_by_length[length][sequence_number]
+        sorted_names = self._sorted_names(length)
+        del sorted_names[bisect.bisect_left(sorted_names, (lowercase_name, sequence_number))]
+        if not sorted_names:
+            del self.names_by_length[length]
+            del self.sorted_names[length]
+        for trigram in _trigrams(lowercase_name + "\0\0"):
+            postings = self.trigrams[trigram]
+            postings.discard(sequence_number)
+            if not postings:
+                del self.trigrams[trigram]
+                for prefix in (trigram[:1], trigram[:2]):
+                    trigrams = self.trigrams_by_prefix[prefix]
+                    trigrams.discard(trigram)
+                    if not trigrams:
+                        del self.trigrams_by_prefix[prefix]
+
+    def _sorted_names(self, length: int) -> list:  # sorted_names[length] with the names added since merged in
+        sorted_names = self.sorted_names.setdefault(length, [])
+        unsorted_names = self.unsorted_names.pop(length, None)
+        if unsorted_names:
+            if len(unsorted_names) * 16 < len(sorted_names):  # a few names added between searches
+                for entry in unsorted_names:
+                    bisect.insort(sorted_names, entry)
+            else:
+                sorted_names.extend(unsorted_names)
+                sorted_names.sort()
+        return sorted_names
+
+    # Sequence numbers of the names of this length starting with query, in insertion order, the first limit only
+    # The sorted names give how many match. When there are many, the names of this length are walked in insertion
+    # order instead until limit are found, which for k matches among n names takes about limit * n / k steps, so
+    # either way the cost stays below sqrt(limit * n) and a short prefix never ranks every match.
+    def _prefix_matches(self, length: int, query: str, limit: int = None) -> list[int]:
+        sorted_names = self._sorted_names(length)
+        start = bisect.bisect_left(sorted_names, (query,))
+        end = bisect.bisect_right(sorted_names, (query + "\U0010ffff" * (length - len(query)), float("inf")), start)
+        if limit is None or end - start <= limit:
+            return sorted(sequence_number for _, sequence_number in sorted_names[start:end])
+        if limit * len(sorted_names) < (end - start) ** 2:
+            matches = []
+            for sequence_number, lowercase_name in self.names_by_length[length].items():
+                if lowercase_name.startswith(query):
+                    matches.append(sequence_number)
+                    if len(matches) == limit:
+                        break
+            return matches
+        return heapq.nsmallest(limit, (sequence_number for _, sequence_number in sorted_names[start:end]))
+
+    def get(self, name: str):  # first value added with exactly this name, or None
+        values = self.by_name.get(name)
+        return values[0] if values else None
+
+    # Values whose name contains the query, ignoring case, best matches first: exact names, then names
+    # starting with the query, then other matches; shorter names and earlier insertions first within each
+    def search(self, query: str, limit: int = None) -> list:
+        query = query.lower()
+        if not query:  # everything matches, keep insertion order
+            sequence_numbers = islice(self.values, limit)
+            return [self.values[sequence_number] for sequence_number in sequence_numbers]
+
+        ranked = []  # (rank, name length, sequence number)
+        for length in sorted(length for length in self.names_by_length if length >= len(query)):  # exact names have the query's length
+            remaining = None if limit is None else limit - len(ranked)
+            if remaining == 0:
+                break
+            rank = 0 if length == len(query) else 1
+            ranked.extend((rank, length, sequence_number) for sequence_number in self._prefix_matches(length, query, remaining))
+
+        if limit is not None and len(ranked) >= limit:  # other matches rank below all of these
+            candidates = ()
+        elif len(query) >= 3:  # only names containing every trigram of the query can match
+            postings = sorted((self.trigrams.get(trigram, set()) for trigram in _trigrams(query)), key=len)
+            candidates = postings[0].intersection(*postings[1:])
+        else:  # only names with a trigram starting with the query can match
+            postings = [self.trigrams[trigram] for trigram in self.trigrams_by_prefix.get(query, ())]
+            matches = sum(len(sequence_numbers) for sequence_numbers in postings)
+            if limit is not None and (limit - len(ranked)) * len(self.values) < matches ** 2:
+                # Common, like a single letter: walk the names in rank order, as _prefix_matches does
+                return [self.values[sequence_number] for _, _, sequence_number in ranked] + self._substring_walk(query, limit - len(ranked))
+            candidates = set().union(*postings)
+        for sequence_number in candidates:
+            lowercase_name = self.lowercase_names[sequence_number]
+            if query in lowercase_name and not lowercase_name.startswith(query):
+                ranked.append((2, len(lowercase_name), sequence_number))
+
+        ranked = heapq.nsmallest(limit, ranked) if limit is not None else sorted(ranked)
+        return [self.values[sequence_number] for _, _, sequence_number in ranked]
+
+    # Values of the first limit names, shortest then earliest, containing query but not starting with it
+    def _substring_walk(self, query: str, limit: int) -> list:
+        values = []
+        for length in sorted(length for length in self.names_by_length if length > len(query)):
+            for sequence_number, lowercase_name in self.names_by_length[length].items():
+                if query in lowercase_name and not lowercase_name.startswith(query):
+                    values.append(self.values[sequence_number])
+                    if len(values) == limit:
+                        return values
+        return values
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+
+def _trigrams(lowercase_name: str) -> set[str]:
+    return {lowercase_name[i:i + 3] for i in range(len(lowercase_name) - 2)}
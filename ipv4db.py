@@ -0,0 +1,167 @@
+# Headless command line interface, run as "python -m ipv4db"
+#   lookup [FILE ...]   owner of every address read from the files (or stdin), one JSON object per line
+#   stats               allocation statistics of the snapshot, as JSON
+#   import FILE ...     imports RIR delegated files or CSV allocation dumps into the snapshot
+#   checkpoint          folds the journal of changes made since the last checkpoint into the snapshot, see journal.py
+#   serve               HTTP/JSON lookup service, see server.py
+# lookup, stats and serve read the snapshot plus the journal tail, so they see changes not yet checkpointed
+# Nothing here imports the GUI, so it runs without a display and starts quickly
+import argparse
+import json
+import sys
+
+import numpy as np
+
+from metrics import enable_from_environment, metrics
+from model import parse_many
+from journal import load_current_snapshot
+from snapshot import DEFAULT_SNAPSHOT_PATH, Snapshot
+
+LOOKUP_BATCH_SIZE = 65_536  # addresses read and resolved at a time
+
+
+def _read_lines(paths: list[str]):  # lines of the files in order, or of stdin without any, without line endings
+    if not paths:
+        for line in sys.stdin:
+            yield line.rstrip("\r\n")
+        return
+    for path in paths:
+        with open(path, encoding="utf-8", errors="replace") as file:
+            for line in file:
+                yield line.rstrip("\r\n")
+
+
+def _batches(lines, batch_size: int):
+    batch = []
+    for line in lines:
+        if line.strip():
+            batch.append(line.strip())
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+
+def lookup(snapshot: Snapshot, lines, output, batch_size: int = LOOKUP_BATCH_SIZE) -> int:  # writes one JSON line per address, returns the number of errors
+    error_count = 0
+    owners = {}  # block row -> the JSON encoded organization and block fields, so each is only encoded once
+    for batch in _batches(lines, batch_size):
+        with metrics.timer("cli.lookup_batch"):
+            with metrics.timer("ip_address.parse_many"):
+                ip_addresses, _, errors = parse_many(batch)
+            errors = dict(errors)
+            with metrics.timer("interval_table.lookup"):
+                organization_indices, rows = snapshot.interval_table.lookup(np.frombuffer(ip_addresses, dtype=np.uint32))
+            metrics.increment("ip_address.parsed", len(batch))
+        records = []
+        for position, (query, organization_index, row) in enumerate(zip(batch, organization_indices.tolist(), rows.tolist())):
+            if position in errors:
+                error_count += 1
+                records.append(json.dumps({"query": query, "error": errors[position]}))
+                continue
+            if row < 0:
+                owner = '"organization": null, "block": null'
+            else:
+                owner = owners.get(row)
+                if owner is None:
+                    owner = (f'"organization": {json.dumps(snapshot.get_organization_name(organization_index))}, '
+                             f'"block": "{snapshot.get_block(row).get_identity_address()}"')
+                    owners[row] = owner
+            records.append(f'{{"query": {json.dumps(query)}, {owner}}}')
+        output.write("\n".join(records) + "\n")
+    output.flush()
+    return error_count
+
+
+def stats(snapshot: Snapshot) -> dict:  # computed from the arrays directly, without building the database
+    interval_sizes = snapshot.interval_table.ends.astype(np.int64) - snapshot.interval_table.starts.astype(np.int64) + 1
+    allocated = int(interval_sizes.sum())  # the intervals partition the allocated space
+    blocks_by_length = np.bincount(snapshot.block_lengths, minlength=33).tolist()
+    return {
+        "organizations": snapshot.organization_count(),
+        "blocks": len(snapshot.block_addresses),
+        "allocated_addresses": allocated,
+        "unallocated_addresses": 2 ** 32 - allocated,
+        "blocks_by_subnet_mask_length": {f"/{length}": count for length, count in enumerate(blocks_by_length) if count},
+    }
+
+
+def import_files(snapshot_path: str, paths: list[str]) -> int:  # adds the files to the snapshot, creating it if needed; returns the number of errors
+    from importer import import_file
+    from journal import open_database
+    database = open_database(snapshot_path)  # journaled, so an interrupted import keeps the files finished so far
+    error_count = 0
+    for path in paths:
+        with metrics.timer("cli.import_file"):
+            result = import_file(database, path)
+        print(f"{path}: {result}", file=sys.stderr)
+        for line_number, message in result.errors:
+            print(f"{path}:{line_number}: {message}", file=sys.stderr)
+        error_count += result.error_count
+    database.journal.checkpoint()
+    database.journal.close()
+    return error_count
+
+
+def checkpoint(snapshot_path: str) -> None:
+    from journal import open_database
+    database = open_database(snapshot_path)
+    database.journal.checkpoint()
+    database.journal.close()
+
+
+def main(argv: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(prog="ipv4db", description="Query and update an IPv4DB snapshot without the GUI")
+    parser.add_argument("--snapshot", default=DEFAULT_SNAPSHOT_PATH, help=f"snapshot file (default: {DEFAULT_SNAPSHOT_PATH})")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    lookup_parser = subparsers.add_parser("lookup", help="owners of addresses read from files or stdin, as newline delimited JSON")
+    lookup_parser.add_argument("files", nargs="*", help="files with one address per line, stdin if none")
+    subparsers.add_parser("stats", help="allocation statistics as JSON")
+    import_parser = subparsers.add_parser("import", help="import RIR delegated files or CSV allocation dumps into the snapshot")
+    import_parser.add_argument("files", nargs="+")
+    subparsers.add_parser("checkpoint", help="fold the journal of changes made by the GUI or an import into the snapshot")
+    serve_parser = subparsers.add_parser("serve", help="HTTP/JSON lookup service")
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--metrics", metavar="FILE", help="record metrics and write them to FILE on exit, as Prometheus text for .prom, JSON otherwise")
+    args = parser.parse_args(argv)
+
+    if args.metrics or enable_from_environment():
+        metrics.enable()
+    try:
+        return _run(args)
+    finally:
+        if args.metrics:
+            metrics.dump(args.metrics)
+
+
+def _run(args: argparse.Namespace) -> int:
+    try:
+        if args.command == "import":
+            return 1 if import_files(args.snapshot, args.files) else 0
+        if args.command == "checkpoint":
+            checkpoint(args.snapshot)
+            return 0
+        if args.command == "serve":
+            from server import serve
+            serve(args.snapshot, args.host, args.port)
+            return 0
+        snapshot = load_current_snapshot(args.snapshot)
+    except (OSError, ValueError) as e:
+        print("Error: ", e, file=sys.stderr)
+        return 2
+    try:
+        if args.command == "lookup":
+            return 1 if lookup(snapshot, _read_lines(args.files), sys.stdout) else 0
+        print(json.dumps(stats(snapshot), indent=2))
+        return 0
+    except OSError as e:
+        print("Error: ", e, file=sys.stderr)
+        return 2
+    finally:
+        snapshot.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
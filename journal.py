@@ -0,0 +1,346 @@
+# Append-only journal of Database changes, so edits survive a restart without rewriting the whole snapshot
+# The snapshot file is the checkpoint and the journal next to it holds every change made since. Each change is one
+# record written with a single unbuffered append, so it survives the process crashing right after. Records are
+# fsynced in groups by a background thread, at most sync_interval seconds after they were written (or at once by
+# sync()), so a machine crash loses at most that much.
+# File layout, all little endian:
+#   header (16 bytes, see _HEADER)
+#   records: payload size uint32, CRC-32 of the payload uint32, payload
+#   payload: sequence uint64, operation uint8, operands
+#     ADD_ORGANIZATION     name size uint32, utf-8 name, blocks
+#     REMOVE_ORGANIZATION  organization index uint32
+#     ADD_BLOCKS           organization index uint32, blocks
+#     REMOVE_BLOCK         organization index uint32, network address uint32, subnet mask length uint8
+#   blocks: count uint32, network addresses uint32[count], subnet mask lengths uint8[count]
+# Organizations are referred to by their index in Database.organizations at the time of the change, which replay
+# reproduces exactly since it starts from the organization order of the checkpoint and applies the same changes.
+# Sequences grow by one per record and a checkpoint stores the last one it includes, so replay skips records that
+# are already in it. That makes each step of a compaction safe to interrupt:
+#   1. the journal is renamed to <journal>.old and a new one is started
+#   2. a background thread loads the checkpoint, replays <journal>.old onto it and saves it as the new checkpoint
+#   3. <journal>.old is deleted
+# A torn record at the end of the journal (a crash in the middle of an append) is dropped when it is opened.
+# A compaction that fails (e.g. a full disk) leaves <journal>.old in place and is retried with a growing delay, and
+# its error is raised by the next append, so the caller learns about it while the changes keep being recorded.
+import os
+import struct
+import threading
+import time
+import zlib
+
+from model import ALLOW_OVERLAPS, Database, IPAddressBlock, Organization
+from snapshot import DEFAULT_SNAPSHOT_PATH, Snapshot, load_snapshot
+
+JOURNAL_MAGIC = b"IPV4DBJL"
+JOURNAL_VERSION = 1
+SYNC_INTERVAL = 0.05  # seconds a written record may wait for its fsync
+COMPACTION_THRESHOLD = 64 * 2 ** 20  # journal size in bytes that starts a background compaction
+COMPACTION_RETRY_DELAY = 60.0  # seconds before a failed compaction is tried again, doubling with every failure
+MAX_COMPACTION_RETRY_DELAY = 3600.0
+_HEADER = struct.Struct("<8sHH4x")  # magic, version, header size
+_RECORD = struct.Struct("<II")  # payload size, checksum
+_PAYLOAD = struct.Struct("<QB")  # sequence, operation
+_INDEX = struct.Struct("<I")
+
+ADD_ORGANIZATION = 1
+REMOVE_ORGANIZATION = 2
+ADD_BLOCKS = 3
+REMOVE_BLOCK = 4
+
+
+def journal_path_for(snapshot_path: str) -> str:  # the journal kept next to a snapshot, e.g. ipv4db.journal for ipv4db.snapshot
+    return os.path.splitext(snapshot_path)[0] + ".journal"
+
+
+def _pack_blocks(ip_address_blocks: list[IPAddressBlock]) -> bytes:
+    count = len(ip_address_blocks)
+    return struct.pack(f"<I{count}I{count}B", count, *[block.first for block in ip_address_blocks],
+                       *[block.ip_address.subnet_mask_length for block in ip_address_blocks])
+
+
+def _unpack_blocks(operands, offset: int) -> list[IPAddressBlock]:
+    (count,) = _INDEX.unpack_from(operands, offset)
+    addresses = struct.unpack_from(f"<{count}I", operands, offset + 4)
+    lengths = struct.unpack_from(f"<{count}B", operands, offset + 4 + 4 * count)
+    return [IPAddressBlock._from_int(address, length) for address, length in zip(addresses, lengths)]
+
+
+def _read_records(path: str):  # (sequence, operation, operands) of every intact record; returns the size of the intact part
+    with open(path, "rb") as file:
+        data = file.read()
+    if len(data) < _HEADER.size:  # the header itself was torn, nothing was ever appended
+        return 0
+    magic, version, header_size = _HEADER.unpack_from(data)
+    if magic != JOURNAL_MAGIC:
+        raise ValueError(f"Invalid journal: {path} is not an IPv4DB journal file")
+    if version != JOURNAL_VERSION or header_size != _HEADER.size:
+        raise ValueError(f"Invalid journal: unsupported version {version}")
+    view = memoryview(data)
+    offset = _HEADER.size
+    while offset + _RECORD.size <= len(data):
+        size, checksum = _RECORD.unpack_from(data, offset)
+        payload = view[offset + _RECORD.size:offset + _RECORD.size + size]
+        if size < _PAYLOAD.size or len(payload) < size or zlib.crc32(payload) != checksum:
+            break
+        sequence, operation = _PAYLOAD.unpack_from(payload)
+        yield sequence, operation, payload[_PAYLOAD.size:]
+        offset += _RECORD.size + size
+    return offset
+
+
+def _apply(database: Database, operation: int, operands) -> None:
+    if operation == ADD_ORGANIZATION:
+        (name_size,) = _INDEX.unpack_from(operands)
+        name = bytes(operands[4:4 + name_size]).decode("utf-8")
+        database.add_organization(Organization(name, _unpack_blocks(operands, 4 + name_size)))
+        return
+    (index,) = _INDEX.unpack_from(operands)
+    organization = database.organizations[index]
+    if operation == REMOVE_ORGANIZATION:
+        database.remove_organization(organization)
+    elif operation == ADD_BLOCKS:
+        organization.add_ip_address_blocks(_unpack_blocks(operands, 4))
+    elif operation == REMOVE_BLOCK:
+        address, length = struct.unpack_from("<IB", operands, 4)
+        organization.remove_ip_address_block(IPAddressBlock._from_int(address, length))
+    else:
+        raise ValueError(f"Invalid journal: unknown operation {operation}")
+
+
+def replay(database: Database, path: str, after: int = 0) -> tuple[int, int]:  # applies the records newer than after; returns (last sequence, intact size)
+    if not os.path.exists(path):
+        return after, 0
+    overlap_policy = database.overlap_policy
+    database.overlap_policy = ALLOW_OVERLAPS  # every record was accepted when it was written
+    records = _read_records(path)
+    try:
+        while True:
+            sequence, operation, operands = next(records)
+            if sequence > after:
+                try:
+                    _apply(database, operation, operands)
+                except (IndexError, ValueError, struct.error):
+                    raise ValueError(f"Invalid journal: record {sequence} does not apply to the checkpoint") from None
+                after = sequence
+    except StopIteration as stop:
+        return after, stop.value
+    finally:
+        database.overlap_policy = overlap_policy
+
+
+def load_checkpoint(snapshot_path: str) -> tuple[Database, int]:  # the checkpointed database and its last journal sequence
+    if not os.path.exists(snapshot_path):
+        return Database(), 0
+    snapshot = load_snapshot(snapshot_path)
+    try:
+        return snapshot.to_database(), snapshot.journal_sequence
+    finally:
+        snapshot.close()
+
+
+def _sync_directory(path: str) -> None:  # makes a rename or a newly created file in the directory durable
+    if os.name == "posix":
+        descriptor = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+        try:
+            os.fsync(descriptor)
+        finally:
+            os.close(descriptor)
+
+
+class Journal:  # Records the changes of one Database, attached as database.journal by open_database
+    def __init__(self, database: Database, snapshot_path: str, path: str, sequence: int = 0, size: int = 0,
+                 sync_interval: float = SYNC_INTERVAL, compaction_threshold: int = COMPACTION_THRESHOLD):
+        self.database = database
+        self.snapshot_path = snapshot_path
+        self.path = path
+        self.old_path = path + ".old"  # journal being folded into the checkpoint by a compaction
+        self.sequence = sequence  # of the last record written
+        self.sync_interval = sync_interval
+        self.compaction_threshold = compaction_threshold
+        self.indices = {id(organization): index for index, organization in enumerate(database.organizations)}  # organization indices as records use them
+        self.lock = threading.Lock()  # guards the file, size, sequence and unsynced count
+        self.closed = False
+        self.file = None
+        self.size = 0  # bytes in the current journal file
+        self.unsynced = 0  # records written since the last fsync
+        self.error = None  # failure of the background sync or compaction, raised by the next append, sync, checkpoint or close
+        self.compaction_thread = None
+        self.compaction_retry_at = 0.0  # time.monotonic() before which the size threshold starts no compaction
+        self.compaction_retry_delay = COMPACTION_RETRY_DELAY
+        self._open(size)
+        self.wakeup = threading.Event()  # set when there are records to sync or the journal is closing
+        self.sync_thread = threading.Thread(target=self._sync_loop, name="journal sync", daemon=True)
+        self.sync_thread.start()
+        if os.path.exists(self.old_path):  # a compaction was interrupted, finish it
+            self.compact()
+
+    def _open(self, size: int) -> None:  # continues the journal file after its intact part, or starts a new one
+        if size >= _HEADER.size:
+            with open(self.path, "r+b") as file:
+                file.truncate(size)  # drops a torn record at the end
+            self.file = open(self.path, "ab", buffering=0)
+            self.size = size
+            return
+        self.file = open(self.path, "wb", buffering=0)
+        self.file.write(_HEADER.pack(JOURNAL_MAGIC, JOURNAL_VERSION, _HEADER.size))
+        os.fsync(self.file.fileno())
+        _sync_directory(self.path)
+        self.size = _HEADER.size
+
+    # Change notifications from Database and Organization, from the one thread that changes the database
+
+    def organization_added(self, organization: Organization, index: int) -> None:  # index: where the database put it
+        self.indices[id(organization)] = index
+        name = organization.name.encode("utf-8")
+        self._append(ADD_ORGANIZATION, _INDEX.pack(len(name)) + name + _pack_blocks(organization.ip_address_blocks))
+
+    def organization_removed(self, organization: Organization) -> None:
+        index = self.indices.pop(id(organization))
+        organizations = self.database.organizations
+        for later_index in range(index, len(organizations)):  # the organizations after it moved up by one
+            self.indices[id(organizations[later_index])] = later_index
+        self._append(REMOVE_ORGANIZATION, _INDEX.pack(index))
+
+    def blocks_added(self, organization: Organization, ip_address_blocks: list[IPAddressBlock]) -> None:
+        self._append(ADD_BLOCKS, _INDEX.pack(self.indices[id(organization)]) + _pack_blocks(ip_address_blocks))
+
+    def block_removed(self, organization: Organization, ip_address_block: IPAddressBlock) -> None:
+        self._append(REMOVE_BLOCK, struct.pack("<IIB", self.indices[id(organization)], ip_address_block.first,
+                                               ip_address_block.ip_address.subnet_mask_length))
+
+    def _append(self, operation: int, operands: bytes) -> None:
+        with self.lock:
+            if self.closed:
+                raise ValueError("Journal is closed")
+            self.sequence += 1
+            payload = _PAYLOAD.pack(self.sequence, operation) + operands
+            record = _RECORD.pack(len(payload), zlib.crc32(payload)) + payload
+            self.file.write(record)
+            self.size += len(record)
+            self.unsynced += 1
+            wake = self.unsynced == 1  # the sync thread is already due otherwise
+            compact = self.size >= self.compaction_threshold and time.monotonic() >= self.compaction_retry_at
+        if wake:
+            self.wakeup.set()
+        if compact:
+            self.compact()
+        self._raise_error()  # the change itself is recorded, this reports an earlier background failure
+
+    def sync(self) -> None:  # fsyncs the records written so far
+        with self.lock:
+            if self.unsynced:
+                os.fsync(self.file.fileno())
+                self.unsynced = 0
+        self._raise_error()
+
+    def _sync_loop(self) -> None:
+        while True:
+            self.wakeup.wait()
+            if self.closed:
+                return
+            time.sleep(self.sync_interval)  # lets more records join this fsync
+            self.wakeup.clear()
+            try:
+                with self.lock:
+                    if self.unsynced and not self.closed:
+                        os.fsync(self.file.fileno())
+                        self.unsynced = 0
+            except OSError as e:
+                self.error = e
+
+    def _raise_error(self) -> None:
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def compact(self) -> None:  # folds the journal into the checkpoint on a background thread, unless one is already running
+        with self.lock:
+            if self.compaction_thread is not None and self.compaction_thread.is_alive():
+                return
+            if not os.path.exists(self.old_path):  # otherwise the leftover of an interrupted compaction goes first
+                os.fsync(self.file.fileno())
+                self.unsynced = 0
+                self.file.close()
+                os.replace(self.path, self.old_path)
+                self._open(0)
+            self.compaction_thread = threading.Thread(target=self._compact, name="journal compaction", daemon=True)
+            self.compaction_thread.start()
+
+    def _compact(self) -> None:  # runs on its own copy of the database, the live one is never touched
+        try:
+            database, sequence = load_checkpoint(self.snapshot_path)
+            sequence, _ = replay(database, self.old_path, sequence)
+            Snapshot.from_database(database, sequence).save(self.snapshot_path)
+            os.remove(self.old_path)
+        except (OSError, ValueError) as e:
+            with self.lock:
+                self.error = e
+                self.compaction_retry_at = time.monotonic() + self.compaction_retry_delay
+                self.compaction_retry_delay = min(self.compaction_retry_delay * 2, MAX_COMPACTION_RETRY_DELAY)
+        else:
+            with self.lock:
+                self._reset_compaction_retry()
+
+    def _reset_compaction_retry(self) -> None:
+        self.compaction_retry_at = 0.0
+        self.compaction_retry_delay = COMPACTION_RETRY_DELAY
+
+    def wait_for_compaction(self) -> None:
+        thread = self.compaction_thread
+        if thread is not None:
+            thread.join()
+        self._raise_error()
+
+    # Writes the live database as the checkpoint and empties the journal, e.g. before copying the snapshot elsewhere
+    # Call it from the thread that changes the database
+    def checkpoint(self) -> None:
+        if self.compaction_thread is not None:  # an older checkpoint must not be saved over this one afterwards
+            self.compaction_thread.join()
+        with self.lock:
+            Snapshot.from_database(self.database, self.sequence).save(self.snapshot_path)
+            self.file.close()
+            self._open(0)  # every record is in the checkpoint now
+            self.unsynced = 0
+            if os.path.exists(self.old_path):
+                os.remove(self.old_path)
+            self._reset_compaction_retry()
+        self._raise_error()
+
+    def close(self) -> None:  # syncs and closes the file; a running compaction is finished on the next open if it is cut short
+        with self.lock:
+            if self.closed:
+                return
+            if self.unsynced:
+                os.fsync(self.file.fileno())
+            self.closed = True
+            self.file.close()
+        self.wakeup.set()
+        self._raise_error()
+
+
+# Loads the checkpoint plus the journal tail and attaches a Journal that records every further change
+def open_database(snapshot_path: str = DEFAULT_SNAPSHOT_PATH, journal_path: str = None, sync_interval: float = SYNC_INTERVAL,
+                  compaction_threshold: int = COMPACTION_THRESHOLD) -> Database:
+    journal_path = journal_path or journal_path_for(snapshot_path)
+    database, sequence = load_checkpoint(snapshot_path)
+    sequence, _ = replay(database, journal_path + ".old", sequence)
+    sequence, size = replay(database, journal_path, sequence)
+    database.journal = Journal(database, snapshot_path, journal_path, sequence, size, sync_interval, compaction_threshold)
+    return database
+
+
+def _has_records(path: str) -> bool:
+    return os.path.exists(path) and os.path.getsize(path) > _HEADER.size
+
+
+# Read-only snapshot of the checkpoint plus the journal tail, for readers such as the command line and the server
+# Without a journal tail this is the checkpoint file itself, memory mapped; otherwise the database is rebuilt in
+# memory and no Journal is attached, so nothing is written and the files are left as they are
+def load_current_snapshot(snapshot_path: str = DEFAULT_SNAPSHOT_PATH, journal_path: str = None) -> Snapshot:
+    journal_path = journal_path or journal_path_for(snapshot_path)
+    if not _has_records(journal_path) and not _has_records(journal_path + ".old"):
+        return load_snapshot(snapshot_path)
+    database, sequence = load_checkpoint(snapshot_path)
+    sequence, _ = replay(database, journal_path + ".old", sequence)
+    sequence, _ = replay(database, journal_path, sequence)
+    return Snapshot.from_database(database, sequence)
@@ -0,0 +1,138 @@
+import numpy as np
+
+from model import IPAddress
+
+
+class IntervalTable:  # Disjoint, sorted address intervals each resolved to the most specific owning block
+    def __init__(self, starts: np.ndarray, ends: np.ndarray, organization_indices: np.ndarray, block_indices: np.ndarray):
+        self.starts: np.ndarray = starts  # uint32, sorted ascending
+        self.ends: np.ndarray = ends  # uint32, inclusive
+        self.organization_indices: np.ndarray = organization_indices  # int32, index into Database.organizations
+        self.block_indices: np.ndarray = block_indices  # int32, index into Organization.ip_address_blocks
+
+    @staticmethod
+    def from_blocks(firsts, lasts, organization_indices, block_indices, ranks=None) -> 'IntervalTable':  # ranks: see insertion_ranks
+        firsts = np.asarray(firsts, dtype=np.uint32)
+        lasts = np.asarray(lasts, dtype=np.uint32)
+        organization_indices = np.asarray(organization_indices, dtype=np.int32)
+        block_indices = np.asarray(block_indices, dtype=np.int32)
+        ranks = np.zeros(len(firsts), dtype=np.int64) if ranks is None else np.asarray(ranks, dtype=np.int64)
+
+        # outer blocks before the blocks nested inside them, equal blocks by rank and then row, so the last one wins
+        order = np.lexsort((ranks, -lasts.astype(np.int64), firsts))
+        firsts, lasts = firsts[order].tolist(), lasts[order].tolist()
+
+        # CIDR blocks either nest or are disjoint, so a stack sweep splits them into the
+        # intervals where one block is the most specific
+        starts, ends, rows = [], [], []
+
+        def emit(start: int, end: int, row: int) -> None:
+            starts.append(start)
+            ends.append(end)
+            rows.append(row)
+
+        stack = []  # (last, row) of the blocks enclosing the cursor, innermost on top
+        cursor = 0  # first address not yet emitted
+        for row, first, last in zip(order.tolist(), firsts, lasts):
+            while stack and stack[-1][0] < first:
+                stack_last, stack_row = stack.pop()
+                if cursor <= stack_last:
+                    emit(cursor, stack_last, stack_row)
+                    cursor = stack_last + 1
+            if stack and cursor < first:
+                emit(cursor, first - 1, stack[-1][1])
+            cursor = first
+            stack.append((last, row))
+        while stack:
+            stack_last, stack_row = stack.pop()
+            if cursor <= stack_last:
+                emit(cursor, stack_last, stack_row)
+                cursor = stack_last + 1
+
+        rows = np.asarray(rows, dtype=np.int64)
+        return IntervalTable(np.asarray(starts, dtype=np.uint32),
+                             np.asarray(ends, dtype=np.uint32),
+                             organization_indices[rows],
+                             block_indices[rows])
+
+    @staticmethod
+    def from_database(database) -> 'IntervalTable':
+        firsts, lasts, organization_indices, block_indices = [], [], [], []
+        for organization_index, organization in enumerate(database.organizations):
+            for block_index, block in enumerate(organization.ip_address_blocks):
+                firsts.append(block.first)
+                lasts.append(block.last)
+                organization_indices.append(organization_index)
+                block_indices.append(block_index)
+        return IntervalTable.from_blocks(firsts, lasts, organization_indices, block_indices,
+                                         insertion_ranks(database, firsts, lasts, organization_indices))
+
+    def lookup(self, ip_addresses: np.ndarray) -> tuple[np.ndarray, np.ndarray]:  # (organization indices, block indices), -1 where unowned
+        if not len(self.starts):
+            unowned = np.full(len(ip_addresses), -1, dtype=np.int32)
+            return unowned, unowned.copy()
+        positions = np.searchsorted(self.starts, ip_addresses, side="right") - 1
+        clipped = np.maximum(positions, 0)
+        owned = (positions >= 0) & (ip_addresses <= self.ends[clipped])
+        return (np.where(owned, self.organization_indices[clipped], -1).astype(np.int32),
+                np.where(owned, self.block_indices[clipped], -1).astype(np.int32))
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+
+def to_ip_address_array(ip_addresses) -> np.ndarray:  # accepts a NumPy array, or any iterable of ints, strings or IPAddresses
+    if isinstance(ip_addresses, np.ndarray):
+        if ip_addresses.dtype == np.uint32:
+            return ip_addresses
+        if not np.issubdtype(ip_addresses.dtype, np.integer):
+            ip_addresses = ip_addresses.tolist()  # strings or objects, parsed below
+        elif len(ip_addresses) and (ip_addresses.min() < 0 or ip_addresses.max() >= 2 ** 32):
+            raise ValueError("Invalid IP address: IP address must be between 0 and 2^32 - 1")
+        else:
+            return ip_addresses.astype(np.uint32)
+
+    def to_int(ip_address) -> int:
+        if isinstance(ip_address, int) and 0 <= ip_address < 2 ** 32:
+            return ip_address
+        return IPAddress(ip_address).ip_address
+
+    return np.fromiter((to_int(ip_address) for ip_address in ip_addresses), dtype=np.uint32)
+
+
+# Ranks for IntervalTable.from_blocks that break ties between equal blocks (possible unless overlaps are rejected)
+# the way Database.find_owner does: the block added last wins, whatever the order of the organizations. Only the
+# rows of equal blocks need one, they get the last position of their organization among the prefix trie entries
+# of that prefix, which are kept in insertion order. Blocks of one organization fall back to their row order.
+def insertion_ranks(database, firsts, lasts, organization_indices) -> np.ndarray:
+    firsts = np.asarray(firsts, dtype=np.int64)
+    lasts = np.asarray(lasts, dtype=np.int64)
+    ranks = np.zeros(len(firsts), dtype=np.int64)
+    if len(firsts) < 2:
+        return ranks
+    order = np.lexsort((lasts, firsts))
+    equal = np.nonzero((firsts[order][1:] == firsts[order][:-1]) & (lasts[order][1:] == lasts[order][:-1]))[0]
+    positions = {}  # (first, last) -> {id(organization): its last position among the entries of the prefix}
+    for row in np.unique(np.concatenate((order[equal], order[equal + 1]))).tolist():
+        first, last = int(firsts[row]), int(lasts[row])
+        if (first, last) not in positions:
+            entries = database.prefix_trie.get(first, 33 - (last - first + 1).bit_length())
+            positions[first, last] = {id(organization): position for position, (organization, _) in enumerate(entries)}
+        ranks[row] = positions[first, last].get(id(database.organizations[int(organization_indices[row])]), -1)
+    return ranks
+
+
+# Finds the blocks that overlap an earlier block in one sorted pass
+# Returns (rows, enclosing rows): for each overlapping block, the index of a block that encloses or equals it
+def find_overlaps(firsts, lasts) -> tuple[np.ndarray, np.ndarray]:
+    firsts = np.asarray(firsts, dtype=np.int64)
+    lasts = np.asarray(lasts, dtype=np.int64)
+    if len(firsts) < 2:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    order = np.lexsort((-lasts, firsts))
+    sorted_firsts, sorted_lasts = firsts[order], lasts[order]
+    reach = np.maximum.accumulate(sorted_lasts)  # furthest address covered so far
+    holders = np.maximum.accumulate(np.where(sorted_lasts == reach, np.arange(len(order)), 0))  # block reaching that far, it encloses any later block that starts before the reach
+    overlapping = np.nonzero(sorted_firsts[1:] <= reach[:-1])[0] + 1
+    return order[overlapping], order[holders[overlapping - 1]]
+
@@ -0,0 +1,203 @@
+# Opt-in metrics for the hot paths: call counts, latency histograms and ad hoc timers
+# Nothing is measured until enable() is called. It replaces the registered methods with timing wrappers and
+# disable() puts the originals back, so while disabled the uninstrumented code runs exactly as before.
+# Set IPV4DB_METRICS=1 to enable them from the start in the GUI and the command line.
+import bisect
+import contextlib
+import functools
+import json
+import os
+import re
+import threading
+import time
+
+from model import Database, IPAddress, Organization
+
+LATENCY_BUCKETS = tuple(m * 10.0 ** e for e in range(-6, 1) for m in (1, 2.5, 5)) + (10.0,)  # upper bounds in seconds, 1 µs to 10 s
+_NULL_TIMER = contextlib.nullcontext()
+
+
+class OperationStats:  # Calls of one operation and their latency histogram
+    __slots__ = ("count", "errors", "total", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0  # calls that raised
+        self.total = 0.0  # seconds
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)  # calls per latency bucket, the last one is above every bound
+
+    def record(self, duration: float, failed: bool = False) -> None:
+        self.count += 1
+        self.errors += failed
+        self.total += duration
+        self.buckets[bisect.bisect_left(LATENCY_BUCKETS, duration)] += 1
+
+    def quantile(self, q: float) -> float:  # upper bound of the bucket holding the q-quantile, inf if above every bound
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS + (float("inf"),), self.buckets):
+            seen += count
+            if seen >= rank and seen:
+                return bound
+        return 0.0
+
+    def to_dict(self) -> dict:
+        return {"count": self.count, "errors": self.errors, "total_seconds": self.total,
+                "mean_seconds": self.total / self.count if self.count else 0.0,
+                "p50_seconds": self.quantile(0.5), "p95_seconds": self.quantile(0.95), "p99_seconds": self.quantile(0.99),
+                "buckets": {str(bound): count for bound, count in zip(LATENCY_BUCKETS + ("+Inf",), self.buckets)}}
+
+
+def _prometheus_name(name: str) -> str:
+    return re.sub(r"[^a-zA-Z0-9_]", "_", name)
+
+
+class Metrics:
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()  # the GUI and its worker thread record concurrently
+        self.operations = {}  # operation name -> OperationStats
+        self.counters = {}  # event name -> count
+        self.collectors = {}  # name -> function returning {gauge name: number}, read when the metrics are dumped
+        self.targets = []  # (class, method name, operation name) wrapped while enabled
+        self.originals = []  # (class, method name, original function) to restore on disable
+        self.enabled_at = None
+
+    def register(self, owner: type, attribute: str, name: str) -> None:  # instruments owner.attribute as the operation name
+        self.targets.append((owner, attribute, name))
+        if self.enabled:
+            self._wrap(owner, attribute, name)
+
+    def enable(self) -> None:
+        if self.enabled:
+            return
+        self.enabled = True
+        self.enabled_at = time.time()
+        for owner, attribute, name in self.targets:
+            self._wrap(owner, attribute, name)
+
+    def disable(self) -> None:  # keeps what was measured, see reset
+        self.enabled = False
+        for owner, attribute, original in reversed(self.originals):
+            setattr(owner, attribute, original)
+        self.originals.clear()
+
+    def reset(self) -> None:
+        with self.lock:
+            self.operations.clear()
+            self.counters.clear()
+
+    def _wrap(self, owner: type, attribute: str, name: str) -> None:
+        original = owner.__dict__[attribute]
+        record = self.record
+        perf_counter = time.perf_counter
+
+        @functools.wraps(original)
+        def timed(*args, **kwargs):
+            start = perf_counter()
+            try:
+                result = original(*args, **kwargs)
+            except BaseException:
+                record(name, perf_counter() - start, True)
+                raise
+            record(name, perf_counter() - start)
+            return result
+
+        self.originals.append((owner, attribute, original))
+        setattr(owner, attribute, timed)
+
+    def record(self, name: str, duration: float, failed: bool = False) -> None:
+        with self.lock:
+            stats = self.operations.get(name)
+            if stats is None:
+                stats = self.operations[name] = OperationStats()
+            stats.record(duration, failed)
+
+    def increment(self, name: str, amount: int = 1) -> None:  # counts an event, only while enabled
+        if self.enabled:
+            with self.lock:
+                self.counters[name] = self.counters.get(name, 0) + amount
+
+    def timer(self, name: str):  # context manager timing a block as the operation name, a shared no-op while disabled
+        if not self.enabled:
+            return _NULL_TIMER
+        return self._timer(name)
+
+    @contextlib.contextmanager
+    def _timer(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.record(name, time.perf_counter() - start, True)
+            raise
+        self.record(name, time.perf_counter() - start)
+
+    def counts(self) -> dict:  # operation name -> calls so far, for computing rates
+        with self.lock:
+            return {name: stats.count for name, stats in self.operations.items()}
+
+    def gauges(self) -> dict:
+        gauges = {}
+        for collector_name, collector in list(self.collectors.items()):
+            for name, value in collector().items():
+                gauges[f"{collector_name}.{name}"] = value
+        return gauges
+
+    def to_dict(self) -> dict:
+        with self.lock:
+            operations = {name: stats.to_dict() for name, stats in sorted(self.operations.items())}
+            counters = dict(sorted(self.counters.items()))
+        return {"enabled": self.enabled, "enabled_at": self.enabled_at, "operations": operations, "counters": counters, "gauges": self.gauges()}
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict(), indent=2)
+
+    def to_prometheus(self) -> str:  # text exposition format
+        lines = ["# HELP ipv4db_operation_seconds Latency of instrumented operations",
+                 "# TYPE ipv4db_operation_seconds histogram"]
+        with self.lock:
+            operations = sorted((name, stats.count, stats.errors, stats.total, list(stats.buckets)) for name, stats in self.operations.items())
+            counters = sorted(self.counters.items())
+        for name, count, _, total, buckets in operations:
+            cumulative = 0
+            for bound, bucket_count in zip(LATENCY_BUCKETS, buckets):
+                cumulative += bucket_count
+                lines.append(f'ipv4db_operation_seconds_bucket{{operation="{name}",le="{bound:g}"}} {cumulative}')
+            lines.append(f'ipv4db_operation_seconds_bucket{{operation="{name}",le="+Inf"}} {count}')
+            lines.append(f'ipv4db_operation_seconds_sum{{operation="{name}"}} {total!r}')
+            lines.append(f'ipv4db_operation_seconds_count{{operation="{name}"}} {count}')
+        lines += ["# HELP ipv4db_operation_errors_total Instrumented calls that raised", "# TYPE ipv4db_operation_errors_total counter"]
+        lines += [f'ipv4db_operation_errors_total{{operation="{name}"}} {errors}' for name, _, errors, _, _ in operations]
+        lines += ["# HELP ipv4db_events_total Counted events", "# TYPE ipv4db_events_total counter"]
+        lines += [f'ipv4db_events_total{{event="{name}"}} {count}' for name, count in counters]
+        for name, value in sorted(self.gauges().items()):
+            lines += [f"# TYPE ipv4db_{_prometheus_name(name)} gauge", f"ipv4db_{_prometheus_name(name)} {value}"]
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path: str) -> None:  # Prometheus text for .prom files, JSON otherwise
+        text = self.to_prometheus() if path.endswith(".prom") else self.to_json()
+        with open(path, "w", encoding="utf-8") as file:
+            file.write(text)
+
+
+metrics = Metrics()  # the one registry the app, the command line and the server share
+metrics.register(IPAddress, "__init__", "ip_address.parse")
+metrics.register(Database, "add_organization", "database.add_organization")
+metrics.register(Database, "remove_organization", "database.remove_organization")
+metrics.register(Database, "find_owner", "database.find_owner")
+metrics.register(Database, "lookup_many", "database.lookup_many")
+metrics.register(Database, "search_all", "database.search_all")
+metrics.register(Database, "total_allocated_ip_addresses", "database.total_allocated_ip_addresses")
+metrics.register(Database, "total_unallocated_ip_addresses", "database.total_unallocated_ip_addresses")
+metrics.register(Organization, "add_ip_address_block", "organization.add_ip_address_block")
+metrics.register(Organization, "add_ip_address_blocks", "organization.add_ip_address_blocks")
+metrics.register(Organization, "remove_ip_address_block", "organization.remove_ip_address_block")
+# The command line and the server resolve addresses in batches with parse_many and IntervalTable.lookup instead of
+# the per address paths above; they time those calls as ip_address.parse_many and interval_table.lookup
+
+
+def enable_from_environment() -> bool:
+    if os.environ.get("IPV4DB_METRICS", "") not in ("", "0"):
+        metrics.enable()
+    return metrics.enabled
@@ -1,4 +1,29 @@
+from array import array
+
+from allocator import FIRST_FIT, FreeSpace
+from index import NameIndex, PrefixTrie
+from stats import AllocationStats
+
+_DECIMAL_OCTETS = {str(octet): octet for octet in range(256)}  # only canonical spellings, anything else takes the slow path
+_SUBNET_MASK_LENGTHS = {str(length): length for length in range(33)}
+_SUBNET_MASKS = [2 ** 32 - 2 ** (32 - length) for length in range(33)]  # indexed by subnet mask length
+
+# Fast path for the common a.b.c.d[/n] form, returns (ip address, subnet mask length) or None if the slow path is needed
+def _parse_dotted_decimal(ip_address: str):
+    ip_address, slash, subnet_mask_length = ip_address.partition('/')
+    octets = ip_address.split('.')
+    if len(octets) != 4:
+        return None
+    try:
+        return (_DECIMAL_OCTETS[octets[0]] << 24 | _DECIMAL_OCTETS[octets[1]] << 16
+                | _DECIMAL_OCTETS[octets[2]] << 8 | _DECIMAL_OCTETS[octets[3]],
+                _SUBNET_MASK_LENGTHS[subnet_mask_length] if slash else None)
+    except KeyError:
+        return None
+
 class IPAddress:
+    __slots__ = ("ip_address", "subnet_mask_length")
+    
     # Initialises an IPAddress object, throws an error if input is invalid
     def __init__(self, ip_address = 0, 
                  subnet_mask_length: int = 0):  # not needed if ip_address is str in CIDR notation with subnet mask length
@@ -14,42 +39,13 @@ class IPAddress:
             
         # case 2: argument is str
         elif isinstance(ip_address, str):
-            if ip_address.count('/') > 1:
-                raise ValueError("Invalid IP address: Only one slash allowed in CIDR notation")
-            elif ip_address.count('/') == 1:
-                ip_address, subnet_mask_length_str = ip_address.split("/")
-                if not subnet_mask_length_str.isdigit():
-                    raise ValueError("Invalid IP address: Subnet mask length must be an integer")
-                elif not 0 <= int(subnet_mask_length_str) <= 32:
-                    raise ValueError("Invalid IP address: Subnet mask length must be between 0 and 32 (inclusive)")
-                self.subnet_mask_length = int(subnet_mask_length_str)
-            if ip_address.count(".") == 3:
-                for octet in ip_address.split('.'):
-                    if not octet.isdigit():
-                        raise ValueError("Invalid IP address: Each octet separated by a '.' must be an integer")
-                    if len(octet) == 8:  # assume in binary form
-                        if not 0 <= int(octet, 2) < 255:
-                            raise ValueError("Invalid IP address: Binary octets separated by a '.' must be between 0 and 255 (inclusive)")
-                        self.ip_address = self.ip_address * 256 + int(octet, 2)
-                    elif len(octet) > 3:  # assume in wrong binary form
-                        raise ValueError("Invalid IP address: Binary octets separated by a '.' must have 8 bits each")
-                    else:  # if decimal
-                        if not 0 <= int(octet) < 255:
-                            raise ValueError("Invalid IP address: Decimal octets separated by a '.' must be between 0 and 255 (inclusive)")
-                        self.ip_address = self.ip_address * 256 + int(octet)
+            parsed = _parse_dotted_decimal(ip_address)
+            if parsed is None:
+                self._parse_str(ip_address)
             else:
-                if not ip_address.isdigit():
-                    raise ValueError("Invalid IP address: IP address must be an integer, either in binary or in decimal")
-                if len(ip_address) == 32:  # assume in binary form
-                    if not 0 <= int(ip_address, 2) < 2 ** 32:
-                        raise ValueError("Invalid IP address: Binary IP address must be between 0 and 2^32 - 1")
-                    self.ip_address = int(ip_address, 2)
-                elif len(ip_address) > 10:  # assume in wrong binary form
-                    raise ValueError("Invalid IP address: Binary IP address must have 32 bits")
-                else: # assume decimal
-                    if not 0 <= int(ip_address) < 2 ** 32:
-                        raise ValueError("Invalid IP address: Decimal IP address must be between 0 and 2^32 - 1")
-                    self.ip_address = int(ip_address)
+                self.ip_address = parsed[0]
+                if parsed[1] is not None:
+                    self.subnet_mask_length = parsed[1]
                 
         # case 3: argument is IPAdress
         elif isinstance(ip_address, IPAddress):
@@ -60,18 +56,65 @@ class IPAddress:
         else:
             raise ValueError("Invalid argument type")
         
+    # Parses every supported string form (binary, decimal, dotted, CIDR) and reports exactly what is wrong
+    def _parse_str(self, ip_address: str) -> None:
+        if ip_address.count('/') > 1:
+            raise ValueError("Invalid IP address: Only one slash allowed in CIDR notation")
+        elif ip_address.count('/') == 1:
+            ip_address, subnet_mask_length_str = ip_address.split("/")
+            if not subnet_mask_length_str.isdigit():
+                raise ValueError("Invalid IP address: Subnet mask length must be an integer")
+            elif not 0 <= int(subnet_mask_length_str) <= 32:
+                raise ValueError("Invalid IP address: Subnet mask length must be between 0 and 32 (inclusive)")
+            self.subnet_mask_length = int(subnet_mask_length_str)
+        if ip_address.count(".") == 3:
+            for octet in ip_address.split('.'):
+                if not octet.isdigit():
+                    raise ValueError("Invalid IP address: Each octet separated by a '.' must be an integer")
+                if len(octet) == 8:  # assume in binary form
+                    if not 0 <= int(octet, 2) <= 255:
+                        raise ValueError("Invalid IP address: Binary octets separated by a '.' must be between 0 and 255 (inclusive)")
+                    self.ip_address = self.ip_address * 256 + int(octet, 2)
+                elif len(octet) > 3:  # assume in wrong binary form
+                    raise ValueError("Invalid IP address: Binary octets separated by a '.' must have 8 bits each")
+                else:  # if decimal
+                    if not 0 <= int(octet) <= 255:
+                        raise ValueError("Invalid IP address: Decimal octets separated by a '.' must be between 0 and 255 (inclusive)")
+                    self.ip_address = self.ip_address * 256 + int(octet)
+        else:
+            if not ip_address.isdigit():
+                raise ValueError("Invalid IP address: IP address must be an integer, either in binary or in decimal")
+            if len(ip_address) == 32:  # assume in binary form
+                if not 0 <= int(ip_address, 2) < 2 ** 32:
+                    raise ValueError("Invalid IP address: Binary IP address must be between 0 and 2^32 - 1")
+                self.ip_address = int(ip_address, 2)
+            elif len(ip_address) > 10:  # assume in wrong binary form
+                raise ValueError("Invalid IP address: Binary IP address must have 32 bits")
+            else: # assume decimal
+                if not 0 <= int(ip_address) < 2 ** 32:
+                    raise ValueError("Invalid IP address: Decimal IP address must be between 0 and 2^32 - 1")
+                self.ip_address = int(ip_address)
+    
+    # Creates an IPAddress without any validation, only for values that are already known to be valid
+    @classmethod
+    def _from_int(cls, ip_address: int, subnet_mask_length: int = 0) -> 'IPAddress':
+        new_ip_address = object.__new__(cls)
+        new_ip_address.ip_address = ip_address
+        new_ip_address.subnet_mask_length = subnet_mask_length
+        return new_ip_address
+    
     def get_subnet_mask(self) -> 'IPAddress':
-        return IPAddress(2 ** 32 - 2 ** (32 - self.subnet_mask_length))
+        return IPAddress._from_int(_SUBNET_MASKS[self.subnet_mask_length])
     
     # deep copy
     def get_copy(self) -> 'IPAddress':
-        return IPAddress(self.ip_address, self.subnet_mask_length)
+        return IPAddress._from_int(self.ip_address, self.subnet_mask_length)
     
     def get_network_address(self) -> 'IPAddress':
-        return IPAddress(self.ip_address & self.get_subnet_mask().ip_address, self.subnet_mask_length)
+        return IPAddress._from_int(self.ip_address & _SUBNET_MASKS[self.subnet_mask_length], self.subnet_mask_length)
     
     def get_host_address(self) -> 'IPAddress':
-        return IPAddress(self.ip_address & ~self.get_subnet_mask().ip_address, self.subnet_mask_length)
+        return IPAddress._from_int(self.ip_address & ~_SUBNET_MASKS[self.subnet_mask_length], self.subnet_mask_length)
     
     def __repr__(self):
         str_digits = []
@@ -98,13 +141,20 @@ class IPAddress:
     
     def __add__(self, other):
         if isinstance(other, int):
-            return IPAddress(self.ip_address + other, self.subnet_mask_length)
-        return IPAddress(self.ip_address + other.ip_address)
+            return IPAddress._checked(self.ip_address + other, self.subnet_mask_length)
+        return IPAddress._checked(self.ip_address + other.ip_address)
     
     def __sub__(self, other):
         if isinstance(other, int):
-            return IPAddress(self.ip_address - other, self.subnet_mask_length)
-        return IPAddress(self.ip_address - other.ip_address)
+            return IPAddress._checked(self.ip_address - other, self.subnet_mask_length)
+        return IPAddress._checked(self.ip_address - other.ip_address)
+    
+    # Range check only, for arithmetic results whose other properties are already valid
+    @classmethod
+    def _checked(cls, ip_address: int, subnet_mask_length: int = 0) -> 'IPAddress':
+        if not 0 <= ip_address < 2 ** 32:
+            raise ValueError("Invalid IP address: IP address must be between 0 and 2^32 - 1")
+        return cls._from_int(ip_address, subnet_mask_length)
     
     def __iadd__(self, other):
         if isinstance(other, int):
@@ -120,46 +170,144 @@ class IPAddress:
             self.ip_address -= other.ip_address
         return self
 
+# Parses many addresses at once, e.g. the lines of a file, without raising on bad rows
+# Returns packed arrays of addresses and subnet mask lengths parallel to the input (0 for bad rows),
+# and a list of (row, error message) for every row that could not be parsed
+def parse_many(ip_addresses) -> tuple[array, array, list[tuple[int, str]]]:
+    addresses = array('I')
+    subnet_mask_lengths = array('B')
+    errors = []
+    for row, ip_address in enumerate(ip_addresses):
+        if not isinstance(ip_address, str):  # e.g. a number in a JSON request, reported like any other invalid row
+            errors.append((row, "Invalid IP address: not a string"))
+            addresses.append(0)
+            subnet_mask_lengths.append(0)
+            continue
+        ip_address = ip_address.strip()
+        parsed = _parse_dotted_decimal(ip_address)
+        if parsed is not None:
+            addresses.append(parsed[0])
+            subnet_mask_lengths.append(parsed[1] or 0)
+            continue
+        try:
+            parsed = IPAddress(ip_address)
+        except ValueError as e:
+            errors.append((row, str(e)))
+            addresses.append(0)
+            subnet_mask_lengths.append(0)
+        else:
+            addresses.append(parsed.ip_address)
+            subnet_mask_lengths.append(parsed.subnet_mask_length)
+    return addresses, subnet_mask_lengths, errors
+
 class IPAddressBlock:
+    __slots__ = ("ip_address", "first", "last")
+    
     def __init__(self, network_ip_address: IPAddress):
-        self.ip_address: IPAddress = IPAddress(network_ip_address)
+        self.ip_address: IPAddress = IPAddress(network_ip_address).get_network_address()  # host bits are dropped so the block is prefix aligned
+        self.first: int = self.ip_address.ip_address  # identity (network) address
+        self.last: int = self.first + 2 ** (32 - self.ip_address.subnet_mask_length) - 1  # broadcast address
+    
+    # Creates a block without any validation, only for a network address and subnet mask length that are already known to be valid
+    @classmethod
+    def _from_int(cls, network_address: int, subnet_mask_length: int) -> 'IPAddressBlock':
+        new_block = object.__new__(cls)
+        new_block.ip_address = IPAddress._from_int(network_address, subnet_mask_length)
+        new_block.first = network_address
+        new_block.last = network_address + 2 ** (32 - subnet_mask_length) - 1
+        return new_block
         
     def get_identity_address(self) -> 'IPAddress':
         return self.ip_address.get_copy()
 
     def get_broadcast_address(self) -> 'IPAddress':
-        return self.ip_address + self.get_num_addresses() - 1
+        return IPAddress._from_int(self.last, self.ip_address.subnet_mask_length)
     
     def get_lower_bound_address(self) -> 'IPAddress':
         return self.ip_address + 1
     
     def get_upper_bound_address(self) -> 'IPAddress':
-        return self.ip_address + self.get_num_addresses() - 2
+        return self.ip_address + (self.get_num_addresses() - 2)
     
     def get_num_addresses(self) -> int:
-        return 2 ** (32 - self.ip_address.subnet_mask_length)
+        return self.last - self.first + 1
     
-    def contains(self, ip_address: IPAddress) -> bool:  # checks if an ip address is in the block, including identity and broadcast addresses
-        return self.get_identity_address() <= ip_address <= self.get_broadcast_address()
+    def contains(self, ip_address: IPAddress) -> bool:  # checks if an ip address (or its int value) is in the block, including identity and broadcast addresses
+        if not isinstance(ip_address, int):
+            ip_address = ip_address.ip_address
+        return self.first <= ip_address <= self.last
     
     def __eq__(self, other: object) -> bool:
         return self.ip_address == other.ip_address
     
-    def __iter__(self):  # iterates through all addresses in the block except the network and broadcast addresses
-        self.current_address = self.get_lower_bound_address()
-        self.get_upper_bound_address = self.get_upper_bound_address()
-        return self
+    def addresses(self) -> range:  # int values of every address in the block, a lazy view that takes O(1) memory
+        return range(self.first, self.last + 1)
     
-    def __next__(self):
-        if self.current_address > self.get_upper_bound_address:
-            raise StopIteration
-        else:
-            self.current_address += 1
-            return self.current_address - 1
+    def hosts(self) -> range:  # int values of all addresses except the network and broadcast addresses
+        return range(self.first + 1, self.last)
+    
+    # block[i] is the int value of the i-th address (block[0] is the network address, block[-1] the broadcast address),
+    # block[i:j:step] is a range of int values, neither allocates anything per address
+    def __getitem__(self, index):
+        try:
+            return self.addresses()[index]
+        except IndexError:
+            raise IndexError("Address index out of range") from None
+    
+    # numpy uint32 array of the addresses block[start:stop:step], for vectorized scans of large blocks a chunk at a time
+    def to_numpy(self, start: int = None, stop: int = None, step: int = None):
+        import numpy as np
+        addresses = self.addresses()[start:stop:step]
+        return np.arange(addresses.start, addresses.stop, addresses.step, dtype=np.uint32)
+    
+    def iter_numpy(self, chunk_size: int = 2 ** 20):  # the addresses of the block as consecutive to_numpy chunks of at most chunk_size
+        for start in range(0, self.get_num_addresses(), chunk_size):
+            yield self.to_numpy(start, start + chunk_size)
+    
+    def __iter__(self):  # iterates lazily through all addresses in the block except the network and broadcast addresses, every iterator is independent
+        subnet_mask_length = self.ip_address.subnet_mask_length
+        for ip_address in self.hosts():
+            yield IPAddress._from_int(ip_address, subnet_mask_length)
     
     def __repr__(self):
         return "Address Block: " + str(self.get_identity_address()) + " (ID) - " + str(self.get_broadcast_address())
     
+# Minimal list of (network address, subnet mask length) prefixes covering exactly the addresses first to last (inclusive), in address order
+# Each prefix is the largest block aligned at the current start (its lowest set bit) that still fits in the rest of the range
+def range_to_prefixes(first: int, last: int) -> list[tuple[int, int]]:
+    if not 0 <= first <= last < 2 ** 32:
+        raise ValueError("Invalid address range: must satisfy 0 <= first <= last < 2^32")
+    prefixes = []
+    stop = last + 1
+    while first < stop:
+        size = min(first & -first or 2 ** 32, 1 << ((stop - first).bit_length() - 1))
+        prefixes.append((first, 33 - size.bit_length()))
+        first += size
+    return prefixes
+
+def range_to_blocks(first, last) -> list[IPAddressBlock]:  # first and last are IPAddresses or ints, both included in the range
+    first = first.ip_address if isinstance(first, IPAddress) else first
+    last = last.ip_address if isinstance(last, IPAddress) else last
+    return [IPAddressBlock._from_int(network_address, subnet_mask_length)
+            for network_address, subnet_mask_length in range_to_prefixes(first, last)]
+
+def block_to_range(ip_address_block) -> tuple[int, int]:  # (first, last) int addresses of a block, or of anything IPAddressBlock accepts
+    if not isinstance(ip_address_block, IPAddressBlock):
+        ip_address_block = IPAddressBlock(ip_address_block)
+    return ip_address_block.first, ip_address_block.last
+
+# What a Database does when a block overlaps a block that is already allocated
+REJECT_OVERLAPS = "reject"  # raise an OverlapError and leave the database unchanged
+REPORT_OVERLAPS = "report"  # add the block, and record the overlap in Database.reported_overlaps
+ALLOW_OVERLAPS = "allow"  # add the block without checking
+
+class OverlapError(ValueError):
+    def __init__(self, overlaps: list[tuple['Organization', IPAddressBlock, 'Organization', IPAddressBlock]]):
+        self.overlaps = overlaps  # (organization, block, other organization, other block) for every overlap found
+        organization, block, other_organization, other_block = overlaps[0]
+        super().__init__(f"Overlapping networks: {block.get_identity_address()} overlaps {other_block.get_identity_address()} of {other_organization.name}"
+                         + (f" (and {len(overlaps) - 1} more)" if len(overlaps) > 1 else ""))
+
 class Organization:
     def __init__(self, name: str, ip_address_blocks: list[IPAddressBlock] = None):
         self.name: str = name
@@ -169,6 +317,7 @@ class Organization:
             self.ip_address_blocks: list[IPAddressBlock] = [ip_address_blocks]
         else:
             self.ip_address_blocks: list[IPAddressBlock] = list(ip_address_blocks)
+        self.database: Database = None  # set while the organization is in a database, which indexes its blocks
     
     def owns_ip_address(self, ip_address: IPAddress) -> bool:
         for block in self.ip_address_blocks:
@@ -176,14 +325,42 @@ class Organization:
                 return True
         return False
     
-    def total_ip_addresses(self) -> int:
-        return sum([block.get_num_addresses() for block in self.ip_address_blocks])
+    def total_ip_addresses(self) -> int:  # addresses in at least one of the blocks, overlapping blocks are only counted once
+        if self.database is not None:
+            return self.database.stats.organization_addresses[self]
+        total = 0
+        covered_until = -1  # last address counted so far
+        for block in sorted(self.ip_address_blocks, key=lambda block: block.first):
+            if block.last > covered_until:
+                total += block.last - max(block.first, covered_until + 1) + 1
+                covered_until = block.last
+        return total
     
     def add_ip_address_block(self, ip_address_block: IPAddressBlock) -> None:
+        if self.database is not None:
+            self.database._check_overlaps(self, [ip_address_block])
         self.ip_address_blocks.append(ip_address_block)
+        if self.database is not None:
+            self.database._on_blocks_added(self, [ip_address_block])
+            if self.database.journal is not None:
+                self.database.journal.blocks_added(self, [ip_address_block])
+        
+    def add_ip_address_blocks(self, ip_address_blocks: list[IPAddressBlock]) -> None:  # bulk version of add_ip_address_block
+        ip_address_blocks = list(ip_address_blocks)
+        if self.database is not None:
+            self.database._check_overlaps(self, ip_address_blocks)
+        self.ip_address_blocks.extend(ip_address_blocks)
+        if self.database is not None:
+            self.database._on_blocks_added(self, ip_address_blocks)
+            if self.database.journal is not None:
+                self.database.journal.blocks_added(self, ip_address_blocks)
         
     def remove_ip_address_block(self, ip_address_block: IPAddressBlock) -> None:
-        self.ip_address_blocks.remove(ip_address_block)
+        removed_block = self.ip_address_blocks.pop(self.ip_address_blocks.index(ip_address_block))  # the stored block, which may be a different object than the argument
+        if self.database is not None:
+            self.database._on_blocks_removed(self, [removed_block])
+            if self.database.journal is not None:
+                self.database.journal.block_removed(self, removed_block)
     
     def __repr__(self):
         return self.name + ": \n  " + "\n  ".join([str(ip_address_block) for ip_address_block in self.ip_address_blocks])
@@ -191,23 +368,169 @@ class Organization:
 class Database:
     def __init__(self):
         self.organizations = []
+        self.prefix_trie = PrefixTrie()  # maps allocated prefixes to (organization, block) pairs
+        self._interval_table = None  # lookup.IntervalTable for batch lookups, rebuilt on demand after any change
+        self._free_space = None  # allocator.FreeSpace, built from the prefix trie by the first allocate and kept in sync after
+        self.stats = AllocationStats()
+        self.name_index = NameIndex()  # organizations by name
+        self.overlap_policy: str = REJECT_OVERLAPS
+        self.reported_overlaps = []  # overlaps let through by REPORT_OVERLAPS, in the format of OverlapError.overlaps
+        self.lookup_cache = None  # optional cache.LookupCache in front of find_owner, kept exact on every change
+        self.journal = None  # optional journal.Journal, told about every change once it has been applied
+        self.history = None  # optional history.AllocationHistory, versioned from the moment it is attached
+    
+    def total_allocated_ip_addresses(self) -> int:  # addresses in at least one block, overlapping blocks are only counted once
+        return self.stats.allocated_addresses
     
-    def total_allocated_ip_addresses(self) -> int:
-        return sum([organization.total_ip_addresses() for organization in self.organizations])
+    def total_unallocated_ip_addresses(self) -> int:  # addresses not in any block, overlapping blocks are only counted once
+        return 2 ** 32 - self.stats.allocated_addresses
     
+    # Everything that can fail is checked before the database changes, so a rejected organization leaves no trace
     def add_organization(self, organization: Organization) -> None:
+        if not isinstance(organization.name, str):
+            raise ValueError("Invalid organization name: must be a string")
+        if organization.database is not None:
+            raise ValueError("Organization is already in a database")
+        if not all(isinstance(block, IPAddressBlock) for block in organization.ip_address_blocks):
+            raise ValueError("Invalid IP address block: must be an IPAddressBlock")
+        self._check_overlaps(organization, organization.ip_address_blocks)
+        self.name_index.add(organization.name, organization)
+        index = len(self.organizations)
         self.organizations.append(organization)
+        organization.database = self
+        self.stats.add_organization(organization)
+        self._on_blocks_added(organization, organization.ip_address_blocks)
+        if self.journal is not None:
+            self.journal.organization_added(organization, index)
     
     def remove_organization(self, organization: Organization) -> None:
         self.organizations.remove(organization)
+        self._on_blocks_removed(organization, organization.ip_address_blocks)
+        self.stats.remove_organization(organization)
+        self.name_index.remove(organization.name, organization)
+        organization.database = None
+        if self.journal is not None:
+            self.journal.organization_removed(organization)
+    
+    def find_owner(self, ip_address: IPAddress) -> tuple[Organization, IPAddressBlock]:  # most specific allocated block containing the address and its owner, or (None, None)
+        ip_address = ip_address if isinstance(ip_address, int) else ip_address.ip_address
+        if self.lookup_cache is not None:
+            cached = self.lookup_cache.get(ip_address)
+            if cached is not None:
+                return cached
+        match = self.prefix_trie.longest_match(ip_address)
+        match = match if match is not None else (None, None)
+        if self.lookup_cache is not None:
+            self.lookup_cache.put(ip_address, match)
+        return match
+    
+    # Batch version of find_owner over a NumPy uint32 array, or any iterable of ints, strings or IPAddresses
+    # Returns parallel int32 arrays of organization indices (into self.organizations) and block indices
+    # (into the owner's ip_address_blocks), -1 where the address is unallocated
+    def lookup_many(self, ip_addresses):
+        from lookup import IntervalTable, to_ip_address_array  # NumPy is only needed for batch lookups
+        if self._interval_table is None:
+            self._interval_table = IntervalTable.from_database(self)
+        return self._interval_table.lookup(to_ip_address_array(ip_addresses))
+    
+    # Assigns an unallocated block of the given size to the organization and returns it
+    # FIRST_FIT takes the lowest free address, BEST_FIT the smallest free block that fits
+    def allocate(self, organization: Organization, subnet_mask_length: int, policy: str = FIRST_FIT) -> IPAddressBlock:
+        if organization.database is not self:
+            raise ValueError("Organization is not in this database")
+        if self._free_space is None:  # most databases are only loaded and searched, so the free lists cost nothing until needed
+            self._free_space = FreeSpace(self.prefix_trie.uncovered(0, 0))
+        network_address = self._free_space.find(subnet_mask_length, policy)
+        if network_address is None:
+            raise ValueError(f"No unallocated /{subnet_mask_length} block left")
+        ip_address_block = IPAddressBlock._from_int(network_address, subnet_mask_length)
+        organization.add_ip_address_block(ip_address_block)
+        return ip_address_block
+    
+    def release(self, ip_address_block: IPAddressBlock) -> None:  # takes the block away from the organization that owns it
+        owners = self.prefix_trie.get(ip_address_block.first, ip_address_block.ip_address.subnet_mask_length)
+        if not owners:
+            raise ValueError("Block is not allocated")
+        organization, _ = owners[-1]
+        organization.remove_ip_address_block(ip_address_block)
+    
+    # Audits the whole database in one sorted pass, e.g. after importing with overlaps allowed
+    # Returns (organization, block, other organization, other block) for every block that overlaps an enclosing or equal block
+    def find_conflicts(self) -> list[tuple[Organization, IPAddressBlock, Organization, IPAddressBlock]]:
+        from lookup import find_overlaps
+        pairs = [(organization, block) for organization in self.organizations for block in organization.ip_address_blocks]
+        rows, enclosing_rows = find_overlaps([block.first for _, block in pairs], [block.last for _, block in pairs])
+        return [pairs[row] + pairs[enclosing_row] for row, enclosing_row in zip(rows.tolist(), enclosing_rows.tolist())]
+    
+    # Applies the overlap policy to blocks about to be added to the organization
+    def _check_overlaps(self, organization: Organization, ip_address_blocks: list[IPAddressBlock]) -> None:
+        if self.overlap_policy == ALLOW_OVERLAPS:
+            return
+        overlaps = []
+        for block in ip_address_blocks:
+            for other_organization, other_block in self.prefix_trie.overlapping(block.first, block.ip_address.subnet_mask_length):
+                overlaps.append((organization, block, other_organization, other_block))
+        enclosing_block = None  # blocks of the same batch can also overlap each other
+        for block in sorted(ip_address_blocks, key=lambda block: (block.first, -block.last)):
+            if enclosing_block is not None and block.first <= enclosing_block.last:
+                overlaps.append((organization, block, organization, enclosing_block))
+            else:
+                enclosing_block = block
+        if not overlaps:
+            return
+        if self.overlap_policy == REJECT_OVERLAPS:
+            raise OverlapError(overlaps)
+        self.reported_overlaps.extend(overlaps)
+    
+    # Keeps the indexes in sync, called whenever blocks enter or leave the database
+    # A block only changes the owner of the addresses inside it, so only those are dropped from the lookup cache
+    def _on_blocks_added(self, organization: Organization, ip_address_blocks: list[IPAddressBlock]) -> None:
+        self._interval_table = None
+        for block in ip_address_blocks:
+            if self.lookup_cache is not None:
+                self.lookup_cache.invalidate_range(block.first, block.last)
+            subnet_mask_length = block.ip_address.subnet_mask_length
+            newly_allocated = self.prefix_trie.uncovered(block.first, subnet_mask_length)
+            if newly_allocated == [(block.first, subnet_mask_length)]:  # nothing overlapped, so the organization did not own any of it either
+                newly_owned = newly_allocated
+            else:
+                newly_owned = self.prefix_trie.uncovered(block.first, subnet_mask_length, lambda value: value[0] is organization)
+            self.prefix_trie.insert(block.first, subnet_mask_length, (organization, block))
+            if self._free_space is not None:
+                for network_address, length in newly_allocated:
+                    self._free_space.carve(network_address, length)
+            self.stats.add_block(organization, subnet_mask_length, newly_allocated, newly_owned)
+        if self.history is not None:
+            self.history.blocks_added(organization, ip_address_blocks)
+    
+    def _on_blocks_removed(self, organization: Organization, ip_address_blocks: list[IPAddressBlock]) -> None:
+        self._interval_table = None
+        for block in ip_address_blocks:
+            if self.lookup_cache is not None:
+                self.lookup_cache.invalidate_range(block.first, block.last)
+            subnet_mask_length = block.ip_address.subnet_mask_length
+            self.prefix_trie.remove(block.first, subnet_mask_length, (organization, block))
+            no_longer_allocated = self.prefix_trie.uncovered(block.first, subnet_mask_length)
+            if no_longer_allocated == [(block.first, subnet_mask_length)]:
+                no_longer_owned = no_longer_allocated
+            else:
+                no_longer_owned = self.prefix_trie.uncovered(block.first, subnet_mask_length, lambda value: value[0] is organization)
+            if self._free_space is not None:
+                for network_address, length in no_longer_allocated:
+                    self._free_space.release(network_address, length)
+            self.stats.remove_block(organization, subnet_mask_length, no_longer_allocated, no_longer_owned)
+        if self.history is not None:
+            self.history.blocks_removed(organization, ip_address_blocks)
     
     def get_organization_by_name(self, name: str) -> Organization:
-        for organization in self.organizations:
-            if organization.name == name:
-                return organization
-        return None
+        return self.name_index.get(name)
+    
+    # Organizations whose name contains the query, ignoring case
+    # Ranked exact name first, then names starting with the query, then the rest, shorter names first
+    def search_organizations(self, query: str, limit: int = None) -> list[Organization]:
+        return self.name_index.search(query, limit)
     
-    def search_all(self, query):  # Searches the IP addresses in the database as well as the organization names 
+    def search_all(self, query, limit: int = None):  # Searches the IP addresses in the database as well as the organization names 
         # Search IP addresses and IP address blocks
         try:
             ip_address = IPAddress(query)
@@ -217,20 +540,10 @@ class Database:
         owner = None
         owner_block = None
         if ip_address is not None:
-            for organization in self.organizations:
-                if organization.owns_ip_address(ip_address):
-                    owner = organization
-        if owner:
-            for block in owner.ip_address_blocks:
-                if block.contains(ip_address):
-                    owner_block = block
-                    break
+            owner, owner_block = self.find_owner(ip_address)
         
         # Search organizations names
-        matched_organizations = []
-        for organization in self.organizations:
-            if query in organization.name:
-                matched_organizations.append(organization)
+        matched_organizations = self.search_organizations(query, limit)
         
         # Returns IP Address, owner organization, the block containing the IP address, and matched organizations
         return ip_address, owner, owner_block, matched_organizations
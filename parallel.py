@@ -0,0 +1,119 @@
+# Multi-process batch lookups for jobs that are bound by one core
+# The packed lookup arrays of a Snapshot are copied into shared memory once; worker processes map them
+# without copying. Each batch is written to a shared input array, the workers resolve index ranges of it
+# straight into shared output arrays, so only segment names and (start, stop) pairs are ever pickled.
+import os
+from multiprocessing import get_context
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from lookup import IntervalTable, to_ip_address_array
+from snapshot import Snapshot
+
+DEFAULT_CHUNK_SIZE = 262_144  # addresses per task
+_TABLE_ARRAYS = (("starts", np.uint32), ("ends", np.uint32), ("organization_indices", np.int32), ("block_positions", np.int32))
+
+
+def _attach(name: str) -> SharedMemory:  # maps an existing segment without letting this process's resource tracker unlink it
+    try:
+        return SharedMemory(name=name, track=False)
+    except TypeError:  # Python < 3.13 always registers attached segments, so skip the registration
+        from multiprocessing import resource_tracker
+        register = resource_tracker.register
+        resource_tracker.register = lambda name, rtype: None
+        try:
+            return SharedMemory(name=name)
+        finally:
+            resource_tracker.register = register
+
+
+def _views(buffer, count: int, layout) -> dict:  # consecutive arrays of count elements each, in the order of layout
+    views = {}
+    offset = 0
+    for name, dtype in layout:
+        views[name] = np.ndarray(count, dtype=dtype, buffer=buffer, offset=offset)
+        offset += count * np.dtype(dtype).itemsize
+    return views
+
+
+def _size(count: int, layout) -> int:
+    return max(1, sum(count * np.dtype(dtype).itemsize for _, dtype in layout))
+
+
+# Worker process state, set up once per process by _initialize_worker
+_worker_table = None
+_worker_batch = None  # (segment name, mapped segment, input view, organization output view, position output view) of the current batch
+
+
+def _initialize_worker(table_name: str, interval_count: int) -> None:
+    global _worker_table
+    shared_memory = _attach(table_name)
+    arrays = _views(shared_memory.buf, interval_count, _TABLE_ARRAYS)
+    _worker_table = (shared_memory, IntervalTable(arrays["starts"], arrays["ends"], arrays["organization_indices"], arrays["block_positions"]))
+
+
+def _lookup_range(batch_name: str, count: int, start: int, stop: int) -> None:
+    global _worker_batch
+    if _worker_batch is None or _worker_batch[0] != batch_name:
+        if _worker_batch is not None:  # the previous batch is finished, drop its views before unmapping it
+            shared_memory = _worker_batch[1]
+            _worker_batch = None
+            shared_memory.close()
+        shared_memory = _attach(batch_name)
+        arrays = _views(shared_memory.buf, count, (("ip_addresses", np.uint32), ("organization_indices", np.int32), ("block_positions", np.int32)))
+        _worker_batch = (batch_name, shared_memory, arrays["ip_addresses"], arrays["organization_indices"], arrays["block_positions"])
+    _, _, ip_addresses, organization_indices, block_positions = _worker_batch
+    organization_indices[start:stop], block_positions[start:stop] = _worker_table[1].lookup(ip_addresses[start:stop])
+
+
+class ParallelLookup:  # Same results as Snapshot.lookup_many / Database.lookup_many, spread over a process pool
+    def __init__(self, source, processes: int = None, chunk_size: int = DEFAULT_CHUNK_SIZE):  # source is a Snapshot or a Database
+        snapshot = source if isinstance(source, Snapshot) else Snapshot.from_database(source)
+        table = snapshot.interval_table
+        # block rows are resolved to positions within the organization up front, as Snapshot.lookup_many does
+        block_positions = snapshot.block_positions[table.block_indices] if len(table) else np.empty(0, dtype=np.int32)
+        self.interval_count = len(table)
+        self.chunk_size = chunk_size
+        self.processes = processes or os.cpu_count() or 1
+        self.table_memory = SharedMemory(create=True, size=_size(self.interval_count, _TABLE_ARRAYS))
+        arrays = _views(self.table_memory.buf, self.interval_count, _TABLE_ARRAYS)
+        arrays["starts"][:] = table.starts
+        arrays["ends"][:] = table.ends
+        arrays["organization_indices"][:] = table.organization_indices
+        arrays["block_positions"][:] = block_positions
+        del arrays  # views would keep the segment from being closed
+        self.pool = get_context().Pool(self.processes, initializer=_initialize_worker,
+                                       initargs=(self.table_memory.name, self.interval_count))
+
+    # Returns parallel int32 arrays of organization indices and block positions, -1 where the address is unallocated
+    def lookup_many(self, ip_addresses) -> tuple[np.ndarray, np.ndarray]:
+        ip_addresses = to_ip_address_array(ip_addresses)
+        count = len(ip_addresses)
+        layout = (("ip_addresses", np.uint32), ("organization_indices", np.int32), ("block_positions", np.int32))
+        batch_memory = SharedMemory(create=True, size=_size(count, layout))
+        try:
+            arrays = _views(batch_memory.buf, count, layout)
+            arrays["ip_addresses"][:] = ip_addresses
+            tasks = [(batch_memory.name, count, start, min(start + self.chunk_size, count)) for start in range(0, count, self.chunk_size)]
+            self.pool.starmap(_lookup_range, tasks, chunksize=1)
+            organization_indices, block_positions = arrays["organization_indices"].copy(), arrays["block_positions"].copy()
+            del arrays
+        finally:
+            batch_memory.close()
+            batch_memory.unlink()
+        return organization_indices, block_positions
+
+    def close(self) -> None:
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+            self.table_memory.close()
+            self.table_memory.unlink()
+
+    def __enter__(self) -> 'ParallelLookup':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
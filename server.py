@@ -0,0 +1,193 @@
+# Local HTTP/JSON lookup service over an immutable Snapshot
+#   GET  /lookup/<ip>   owner of one address
+#   POST /lookup        owners of a JSON list of addresses (or {"addresses": [...]}), in order
+#   GET  /stats         allocation statistics of the current snapshot and request counters
+#   POST /reload        reloads the snapshot file and the journal next to it
+#   GET  /metrics       metrics in Prometheus text format, see metrics.py (empty unless metrics are enabled)
+# Every request works on the snapshot that was current when it started. A reload builds the new snapshot on a
+# thread and then swaps the reference, so lookups never wait for it and never see a half loaded state.
+import asyncio
+import json
+import os
+import time
+from http import HTTPStatus
+from urllib.parse import unquote
+
+import numpy as np
+
+from ipv4db import stats
+from journal import load_current_snapshot
+from metrics import metrics
+from model import parse_many
+from snapshot import Snapshot
+
+MAX_BODY_SIZE = 16 * 2 ** 20  # bytes, larger requests are refused
+MAX_HEADER_COUNT = 100
+THREAD_BATCH_SIZE = 1_000  # batches at least this large are resolved on a thread, so other requests keep being served
+ROUTES = ("/lookup", "/stats", "/reload", "/metrics")  # operation names of the request timers, besides /lookup/<ip>
+
+
+class HTTPError(Exception):
+    def __init__(self, status: HTTPStatus, message: str = None):
+        super().__init__(message or status.phrase)
+        self.status = status
+
+
+def lookup_addresses(snapshot: Snapshot, queries: list[str]) -> list[dict]:  # same fields as the command line lookup
+    with metrics.timer("ip_address.parse_many"):
+        ip_addresses, _, errors = parse_many(queries)
+    errors = dict(errors)
+    with metrics.timer("interval_table.lookup"):
+        organization_indices, rows = snapshot.interval_table.lookup(np.frombuffer(ip_addresses, dtype=np.uint32))
+    metrics.increment("ip_address.parsed", len(queries))
+    results = []
+    for position, (query, organization_index, row) in enumerate(zip(queries, organization_indices.tolist(), rows.tolist())):
+        if position in errors:
+            results.append({"query": query, "error": errors[position]})
+        elif row < 0:
+            results.append({"query": query, "organization": None, "block": None})
+        else:
+            results.append({"query": query, "organization": snapshot.get_organization_name(organization_index),
+                            "block": str(snapshot.get_block(row).get_identity_address())})
+    return results
+
+
+class LookupServer:
+    def __init__(self, snapshot: Snapshot, snapshot_path: str = None):
+        self.snapshot = snapshot  # replaced as a whole on reload, never modified
+        self.snapshot_path = snapshot_path  # file reloaded by /reload, None if the snapshot was built in memory
+        self.loaded_at = time.time()
+        self.started_at = time.time()
+        self.request_count = 0
+        self.error_count = 0
+        self.reload_lock = asyncio.Lock()  # one reload at a time, lookups do not take it
+
+    def swap(self, snapshot: Snapshot) -> None:  # e.g. Snapshot.from_database(database) after the database was edited
+        self.snapshot = snapshot  # the old one is released once the requests still using it finish
+        self.loaded_at = time.time()
+
+    async def reload(self) -> None:
+        if self.snapshot_path is None:
+            raise HTTPError(HTTPStatus.CONFLICT, "Snapshot was not loaded from a file")
+        async with self.reload_lock:
+            snapshot = await asyncio.to_thread(load_current_snapshot, self.snapshot_path)
+            self.swap(snapshot)
+
+    async def route(self, method: str, path: str, body: bytes):  # returns the JSON payload (or text), or raises HTTPError
+        snapshot = self.snapshot
+        if path.startswith("/lookup/"):
+            if method != "GET":
+                raise HTTPError(HTTPStatus.METHOD_NOT_ALLOWED)
+            result = lookup_addresses(snapshot, [unquote(path[len("/lookup/"):])])[0]
+            if "error" in result:
+                raise HTTPError(HTTPStatus.BAD_REQUEST, result["error"])
+            return result
+        if path == "/lookup":
+            if method != "POST":
+                raise HTTPError(HTTPStatus.METHOD_NOT_ALLOWED)
+            try:
+                queries = json.loads(body)
+            except ValueError:
+                raise HTTPError(HTTPStatus.BAD_REQUEST, "Body is not valid JSON") from None
+            if isinstance(queries, dict):
+                queries = queries.get("addresses")
+            if not isinstance(queries, list) or not all(isinstance(query, str) for query in queries):
+                raise HTTPError(HTTPStatus.BAD_REQUEST, "Expected a list of address strings")
+            if len(queries) >= THREAD_BATCH_SIZE:
+                return {"results": await asyncio.to_thread(lookup_addresses, snapshot, queries)}
+            return {"results": lookup_addresses(snapshot, queries)}
+        if path == "/stats":
+            if method != "GET":
+                raise HTTPError(HTTPStatus.METHOD_NOT_ALLOWED)
+            return dict(stats(snapshot), server={"requests": self.request_count, "errors": self.error_count,
+                                                 "uptime_seconds": round(time.time() - self.started_at, 3),
+                                                 "snapshot_loaded_at": self.loaded_at})
+        if path == "/reload":
+            if method != "POST":
+                raise HTTPError(HTTPStatus.METHOD_NOT_ALLOWED)
+            await self.reload()
+            return {"reloaded": True, "snapshot_loaded_at": self.loaded_at}
+        if path == "/metrics":
+            if method != "GET":
+                raise HTTPError(HTTPStatus.METHOD_NOT_ALLOWED)
+            return metrics.to_prometheus()
+        raise HTTPError(HTTPStatus.NOT_FOUND)
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                keep_alive = await self.handle_request(request_line, reader, writer)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            pass
+        finally:
+            writer.close()
+
+    async def handle_request(self, request_line: bytes, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> bool:  # returns whether to keep the connection open
+        self.request_count += 1
+        keep_alive = False
+        try:
+            parts = request_line.decode("latin-1").split()
+            if len(parts) != 3 or not parts[2].startswith("HTTP/"):
+                raise HTTPError(HTTPStatus.BAD_REQUEST, "Malformed request line")
+            method, target, version = parts
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                if len(headers) >= MAX_HEADER_COUNT:
+                    raise HTTPError(HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE)
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+            connection = headers.get("connection", "").lower()
+            keep_alive = connection == "keep-alive" if version == "HTTP/1.0" else connection != "close"
+            length = headers.get("content-length", "0")
+            if not length.isdigit() or int(length) > MAX_BODY_SIZE:
+                keep_alive = False  # the body is not read, so the connection cannot be reused
+                if not length.isdigit():
+                    raise HTTPError(HTTPStatus.BAD_REQUEST, "Invalid Content-Length")
+                raise HTTPError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE)
+            body = await reader.readexactly(int(length))
+            path = target.split("?", 1)[0]
+            with metrics.timer("server" + ("/lookup/<ip>" if path.startswith("/lookup/") else path if path in ROUTES else "/other")):
+                status, payload = HTTPStatus.OK, await self.route(method, path, body)
+        except HTTPError as e:
+            self.error_count += 1
+            status, payload = e.status, {"error": str(e)}
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):  # the client went away, see handle_connection
+            raise
+        except Exception as e:  # e.g. a reload of a missing or corrupt snapshot; any failure is answered instead of dropping the connection
+            self.error_count += 1
+            status, payload = HTTPStatus.INTERNAL_SERVER_ERROR, {"error": str(e) or type(e).__name__}
+        if isinstance(payload, str):
+            content_type, body = "text/plain; version=0.0.4", payload.encode("utf-8")
+        else:
+            content_type, body = "application/json", json.dumps(payload).encode("utf-8")
+        writer.write(f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+                     f"Content-Type: {content_type}\r\n"
+                     f"Content-Length: {len(body)}\r\n"
+                     f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode("latin-1") + body)
+        return keep_alive
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8080) -> asyncio.Server:
+        return await asyncio.start_server(self.handle_connection, host, port)
+
+
+def serve(snapshot_path: str, host: str = "127.0.0.1", port: int = 8080) -> None:  # runs until interrupted
+    async def main():
+        server = LookupServer(load_current_snapshot(snapshot_path), os.path.abspath(snapshot_path))
+        http_server = await server.start(host, port)
+        print(f"Serving {snapshot_path} on http://{host}:{http_server.sockets[0].getsockname()[1]}")
+        async with http_server:
+            await http_server.serve_forever()
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
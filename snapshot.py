@@ -0,0 +1,216 @@
+import mmap
+import os
+import struct
+import zlib
+
+import numpy as np
+
+from lookup import IntervalTable, insertion_ranks, to_ip_address_array
+from model import ALLOW_OVERLAPS, REJECT_OVERLAPS, REPORT_OVERLAPS, Database, IPAddressBlock, Organization
+
+# File layout, all little endian:
+#   header (68 bytes, see _HEADER)
+#   organization name offsets   uint32[organizations + 1], into the name blob
+#   organization name blob      utf-8 bytes
+#   block network addresses     uint32[blocks], sorted by address then subnet mask length
+#   block subnet mask lengths   uint8[blocks]
+#   block organizations         int32[blocks], index into the name table
+#   block positions             int32[blocks], index of the block within its organization
+#   interval starts             uint32[intervals], the prebuilt lookup.IntervalTable
+#   interval ends               uint32[intervals]
+#   interval organizations      int32[intervals]
+#   interval blocks             int32[intervals], row into the block arrays
+# Every section starts on an 8 byte boundary, the checksum is a CRC-32 of everything after the header
+DEFAULT_SNAPSHOT_PATH = "ipv4db.snapshot"  # used by the GUI and the command line unless told otherwise
+SNAPSHOT_MAGIC = b"IPV4DBSN"
+SNAPSHOT_VERSION = 2  # version 1 had no journal sequence, its reserved bytes read as 0
+_HEADER = struct.Struct("<8sHHIIIIIIQ24x")  # magic, version, header size, organizations, blocks, intervals, name blob size, checksum, flags, journal sequence
+_OVERLAP_POLICIES = (REJECT_OVERLAPS, REPORT_OVERLAPS, ALLOW_OVERLAPS)  # flags bits 0-1 hold the index of the saved overlap policy
+_OVERLAP_POLICY_MASK = 0b11
+
+
+def _align(offset: int) -> int:
+    return (offset + 7) & ~7
+
+
+def _layout(organization_count: int, block_count: int, interval_count: int, names_size: int) -> list[tuple[str, str, int, int]]:  # (name, dtype, count, offset) per section
+    sections = [
+        ("name_offsets", "<u4", organization_count + 1),
+        ("names", "u1", names_size),
+        ("block_addresses", "<u4", block_count),
+        ("block_lengths", "u1", block_count),
+        ("block_organizations", "<i4", block_count),
+        ("block_positions", "<i4", block_count),
+        ("interval_starts", "<u4", interval_count),
+        ("interval_ends", "<u4", interval_count),
+        ("interval_organizations", "<i4", interval_count),
+        ("interval_blocks", "<i4", interval_count),
+    ]
+    layout = []
+    offset = _HEADER.size
+    for name, dtype, count in sections:
+        offset = _align(offset)
+        layout.append((name, dtype, count, offset))
+        offset += count * np.dtype(dtype).itemsize
+    return layout
+
+
+class Snapshot:  # Read-only, array backed view of a whole database, either built in memory or mapped from a file
+    def __init__(self, arrays: dict, mapping: mmap.mmap = None, journal_sequence: int = 0, overlap_policy: str = REJECT_OVERLAPS):
+        self.name_offsets: np.ndarray = arrays["name_offsets"]
+        self.names: np.ndarray = arrays["names"]
+        self.block_addresses: np.ndarray = arrays["block_addresses"]
+        self.block_lengths: np.ndarray = arrays["block_lengths"]
+        self.block_organizations: np.ndarray = arrays["block_organizations"]
+        self.block_positions: np.ndarray = arrays["block_positions"]
+        self.interval_table = IntervalTable(arrays["interval_starts"], arrays["interval_ends"],
+                                            arrays["interval_organizations"], arrays["interval_blocks"])
+        self.mapping = mapping  # the open file mapping the arrays point into, if any
+        self.journal_sequence = journal_sequence  # last journal record included, see journal.py
+        self.overlap_policy = overlap_policy  # of the database it was taken from, given back by to_database
+
+    @staticmethod
+    def from_database(database: Database, journal_sequence: int = 0) -> 'Snapshot':
+        names = [organization.name.encode("utf-8") for organization in database.organizations]
+        name_offsets = np.zeros(len(names) + 1, dtype="<u4")
+        name_offsets[1:] = np.cumsum([len(name) for name in names], dtype=np.uint64)
+
+        addresses, lengths, organizations, positions = [], [], [], []
+        for organization_index, organization in enumerate(database.organizations):
+            for position, block in enumerate(organization.ip_address_blocks):
+                addresses.append(block.first)
+                lengths.append(block.ip_address.subnet_mask_length)
+                organizations.append(organization_index)
+                positions.append(position)
+        addresses = np.asarray(addresses, dtype="<u4")
+        lengths = np.asarray(lengths, dtype="u1")
+        order = np.lexsort((lengths, addresses))
+        addresses, lengths = addresses[order], lengths[order]
+        organizations = np.asarray(organizations, dtype="<i4")[order]
+        positions = np.asarray(positions, dtype="<i4")[order]
+
+        lasts = addresses.astype(np.uint64) + (np.uint64(1) << (32 - lengths.astype(np.uint64))) - np.uint64(1)
+        table = IntervalTable.from_blocks(addresses, lasts, organizations, np.arange(len(addresses), dtype=np.int32),
+                                          insertion_ranks(database, addresses, lasts, organizations))
+        return Snapshot({
+            "name_offsets": name_offsets,
+            "names": np.frombuffer(b"".join(names), dtype="u1"),
+            "block_addresses": addresses,
+            "block_lengths": lengths,
+            "block_organizations": organizations,
+            "block_positions": positions,
+            "interval_starts": table.starts,
+            "interval_ends": table.ends,
+            "interval_organizations": table.organization_indices,
+            "interval_blocks": table.block_indices,
+        }, journal_sequence=journal_sequence, overlap_policy=database.overlap_policy)
+
+    @staticmethod
+    def from_file(path: str, verify: bool = True) -> 'Snapshot':  # maps the file read-only, the arrays are views into the mapping
+        with open(path, "rb") as file:
+            mapping = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            if len(mapping) < _HEADER.size:
+                raise ValueError("Invalid snapshot: file is too short")
+            magic, version, header_size, organization_count, block_count, interval_count, names_size, checksum, flags, journal_sequence = _HEADER.unpack_from(mapping)
+            if magic != SNAPSHOT_MAGIC:
+                raise ValueError("Invalid snapshot: not an IPv4DB snapshot file")
+            if version not in (1, SNAPSHOT_VERSION) or header_size != _HEADER.size:
+                raise ValueError(f"Invalid snapshot: unsupported version {version}")
+            if flags & _OVERLAP_POLICY_MASK >= len(_OVERLAP_POLICIES):
+                raise ValueError("Invalid snapshot: unknown overlap policy")
+            layout = _layout(organization_count, block_count, interval_count, names_size)
+            name, dtype, count, offset = layout[-1]
+            if len(mapping) < offset + count * np.dtype(dtype).itemsize:
+                raise ValueError("Invalid snapshot: file is truncated")
+            if verify and zlib.crc32(memoryview(mapping)[_HEADER.size:]) != checksum:
+                raise ValueError("Invalid snapshot: checksum mismatch")
+            arrays = {name: np.frombuffer(mapping, dtype=dtype, count=count, offset=offset) for name, dtype, count, offset in layout}
+        except ValueError:
+            mapping.close()
+            raise
+        return Snapshot(arrays, mapping, journal_sequence, _OVERLAP_POLICIES[flags & _OVERLAP_POLICY_MASK])
+
+    def save(self, path: str) -> None:  # written to a temporary file first so an existing snapshot is replaced atomically
+        arrays = self._arrays()
+        layout = _layout(self.organization_count(), len(self.block_addresses), len(self.interval_table), len(self.names))
+        payload = bytearray()
+        for name, dtype, count, offset in layout:
+            payload.extend(bytes(offset - _HEADER.size - len(payload)))  # alignment padding
+            payload.extend(np.ascontiguousarray(arrays[name], dtype=dtype).tobytes())
+        header = _HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, _HEADER.size, self.organization_count(),
+                              len(self.block_addresses), len(self.interval_table), len(self.names), zlib.crc32(payload),
+                              _OVERLAP_POLICIES.index(self.overlap_policy), self.journal_sequence)
+        temporary_path = path + ".tmp"
+        with open(temporary_path, "wb") as file:
+            file.write(header)
+            file.write(payload)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary_path, path)
+
+    def _arrays(self) -> dict:
+        return {
+            "name_offsets": self.name_offsets,
+            "names": self.names,
+            "block_addresses": self.block_addresses,
+            "block_lengths": self.block_lengths,
+            "block_organizations": self.block_organizations,
+            "block_positions": self.block_positions,
+            "interval_starts": self.interval_table.starts,
+            "interval_ends": self.interval_table.ends,
+            "interval_organizations": self.interval_table.organization_indices,
+            "interval_blocks": self.interval_table.block_indices,
+        }
+
+    def organization_count(self) -> int:
+        return len(self.name_offsets) - 1
+
+    def get_organization_name(self, organization_index: int) -> str:
+        return self.names[self.name_offsets[organization_index]:self.name_offsets[organization_index + 1]].tobytes().decode("utf-8")
+
+    def get_block(self, row: int) -> IPAddressBlock:
+        return IPAddressBlock._from_int(int(self.block_addresses[row]), int(self.block_lengths[row]))
+
+    # Same result as Database.lookup_many on the database the snapshot was taken from
+    def lookup_many(self, ip_addresses) -> tuple[np.ndarray, np.ndarray]:
+        organization_indices, rows = self.interval_table.lookup(to_ip_address_array(ip_addresses))
+        if not len(self.block_positions):
+            return organization_indices, rows
+        return organization_indices, np.where(rows >= 0, self.block_positions[np.maximum(rows, 0)], -1).astype(np.int32)
+
+    def find_owner(self, ip_address) -> tuple[str, IPAddressBlock]:  # owner name and most specific block, or (None, None)
+        organization_indices, rows = self.interval_table.lookup(to_ip_address_array([ip_address]))
+        if rows[0] < 0:
+            return None, None
+        return self.get_organization_name(int(organization_indices[0])), self.get_block(int(rows[0]))
+
+    def to_database(self) -> Database:  # materializes Python objects, for when the database is going to be edited; keeps the saved overlap policy
+        block_lists = [[] for _ in range(self.organization_count())]
+        order = np.lexsort((self.block_positions, self.block_organizations))
+        for row, organization_index in zip(order.tolist(), self.block_organizations[order].tolist()):
+            block_lists[organization_index].append(self.get_block(row))
+        database = Database()
+        database.overlap_policy = ALLOW_OVERLAPS  # restores the saved state as is, even if overlaps were allowed when it was saved
+        for organization_index, ip_address_blocks in enumerate(block_lists):
+            database.add_organization(Organization(self.get_organization_name(organization_index), ip_address_blocks))
+        database.overlap_policy = self.overlap_policy
+        return database
+
+    def close(self) -> None:
+        if self.mapping is not None:
+            mapping, self.mapping = self.mapping, None
+            self.name_offsets = self.names = self.block_addresses = self.block_lengths = None
+            self.block_organizations = self.block_positions = self.interval_table = None
+            try:
+                mapping.close()
+            except BufferError:  # views handed out earlier are still alive, the mapping is released with them
+                pass
+
+
+def save_snapshot(database: Database, path: str) -> None:
+    Snapshot.from_database(database).save(path)
+
+
+def load_snapshot(path: str, verify: bool = True) -> Snapshot:
+    return Snapshot.from_file(path, verify)
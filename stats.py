@@ -0,0 +1,36 @@
+class AllocationStats:  # Running allocation counters, updated by Database on every change so reads are O(1)
+    def __init__(self):
+        self.allocated_addresses: int = 0  # addresses in at least one block
+        self.organization_addresses: dict = {}  # Organization -> addresses in at least one of its blocks
+        self.blocks_by_subnet_mask_length: list[int] = [0] * 33  # number of blocks of each size
+        self.addresses_by_slash8: list[int] = [0] * 256  # allocated addresses in each /8, indexed by the first octet
+
+    # newly_allocated / newly_owned are the parts of the block that were not covered before, by any
+    # organization / by the same organization, as (network address, subnet mask length) pairs
+    def add_block(self, organization, subnet_mask_length: int, newly_allocated: list[tuple[int, int]], newly_owned: list[tuple[int, int]]) -> None:
+        self.blocks_by_subnet_mask_length[subnet_mask_length] += 1
+        self._count(newly_allocated, 1)
+        self.organization_addresses[organization] = (self.organization_addresses.get(organization, 0)
+                                                     + sum(2 ** (32 - length) for _, length in newly_owned))
+
+    # no_longer_allocated / no_longer_owned are the parts of the block that are not covered anymore
+    def remove_block(self, organization, subnet_mask_length: int, no_longer_allocated: list[tuple[int, int]], no_longer_owned: list[tuple[int, int]]) -> None:
+        self.blocks_by_subnet_mask_length[subnet_mask_length] -= 1
+        self._count(no_longer_allocated, -1)
+        self.organization_addresses[organization] -= sum(2 ** (32 - length) for _, length in no_longer_owned)
+
+    def _count(self, prefixes: list[tuple[int, int]], sign: int) -> None:
+        for network_address, subnet_mask_length in prefixes:
+            self.allocated_addresses += sign * 2 ** (32 - subnet_mask_length)
+            if subnet_mask_length >= 8:
+                self.addresses_by_slash8[network_address >> 24] += sign * 2 ** (32 - subnet_mask_length)
+            else:  # spans several /8s, all of them completely
+                first_slash8 = network_address >> 24
+                for slash8 in range(first_slash8, first_slash8 + 2 ** (8 - subnet_mask_length)):
+                    self.addresses_by_slash8[slash8] += sign * 2 ** 24
+
+    def add_organization(self, organization) -> None:
+        self.organization_addresses.setdefault(organization, 0)
+
+    def remove_organization(self, organization) -> None:
+        self.organization_addresses.pop(organization, None)
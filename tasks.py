@@ -0,0 +1,93 @@
+import queue
+from concurrent.futures import Future, ThreadPoolExecutor
+
+POLL_INTERVAL = 50  # milliseconds between checks for finished tasks while any are pending
+
+
+def _print_error(error: Exception) -> None:
+    print("Error Running Task: ", error)
+
+
+# Runs database work on a background thread and hands the results back to the Tk main loop.
+# There is a single worker, so tasks run one at a time in submission order and never change the
+# database concurrently with each other. The main loop is not locked out, though: while a task runs it
+# still reads Database.organizations and Organization.ip_address_blocks to draw the cards. It only does
+# so through copies the GIL makes atomic (list(), slices, len()), so it never sees a torn list, but what
+# it draws may be a mix of before and after the running task. The task's on_done then redraws from the
+# finished state. Callbacks always run on the main loop, which picks them up with after() since Tk must
+# not be called from other threads.
+class TaskRunner:
+    def __init__(self, widget, on_busy_changed=None):
+        self.widget = widget  # any widget, used to schedule polling on its main loop
+        self.on_busy_changed = on_busy_changed  # called with True when the first task is submitted, False when the last one finishes
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ipv4db-task")
+        self.results = queue.Queue()  # (key, generation, callback, value, finished) posted by the worker
+        self.generations: dict = {}  # key -> generation of the latest task submitted with that key
+        self.futures: dict = {}  # key -> future of the latest task submitted with that key
+        self.pending_count = 0
+        self.polling = False
+
+    # Runs function(*args) on the worker and calls on_done(result) or on_error(exception) on the main loop.
+    # If on_progress is given, function is also passed progress=callable, whose values are forwarded to on_progress.
+    # A task submitted with a key supersedes the previous one with the same key: it is cancelled if it has not
+    # started yet, and otherwise its callbacks are dropped when it finishes.
+    def submit(self, function, *args, key=None, on_done=None, on_error=None, on_progress=None) -> Future:
+        generation = self.generations.get(key, 0) + 1
+        if key is not None:
+            self.generations[key] = generation
+            previous = self.futures.pop(key, None)
+            if previous is not None and previous.cancel():
+                self._task_finished()
+
+        def post(callback, value, finished: bool) -> None:
+            self.results.put((key, generation, callback, value, finished))
+
+        def run():
+            kwargs = {} if on_progress is None else {"progress": lambda value: post(on_progress, value, False)}
+            try:
+                value = function(*args, **kwargs)
+            except Exception as e:
+                post(on_error or _print_error, e, True)
+            else:
+                post(on_done, value, True)
+
+        future = self.executor.submit(run)
+        if key is not None:
+            self.futures[key] = future
+        self.pending_count += 1
+        if self.pending_count == 1 and self.on_busy_changed is not None:
+            self.on_busy_changed(True)
+        if not self.polling:
+            self.polling = True
+            self.widget.after(POLL_INTERVAL, self._poll)
+        return future
+
+    def is_busy(self) -> bool:
+        return self.pending_count > 0
+
+    def _task_finished(self) -> None:
+        self.pending_count -= 1
+        if self.pending_count == 0 and self.on_busy_changed is not None:
+            self.on_busy_changed(False)
+
+    def _poll(self) -> None:
+        while True:
+            try:
+                key, generation, callback, value, finished = self.results.get_nowait()
+            except queue.Empty:
+                break
+            if finished:
+                if key is not None and self.futures.get(key) is not None and self.generations[key] == generation:
+                    del self.futures[key]
+                self._task_finished()
+            if key is not None and self.generations[key] != generation:  # superseded by a newer task
+                continue
+            if callback is not None:
+                callback(value)
+        if self.pending_count > 0:
+            self.widget.after(POLL_INTERVAL, self._poll)
+        else:
+            self.polling = False
+
+    def shutdown(self, wait: bool = False) -> None:  # drops queued tasks, a task already running is left to finish (and waited for if wait)
+        self.executor.shutdown(wait=wait, cancel_futures=True)
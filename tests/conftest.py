@@ -0,0 +1,42 @@
+# The modules live at the top of the repository, next to this directory
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import random
+
+import pytest
+
+from model import ALLOW_OVERLAPS, Database, IPAddressBlock, Organization
+
+
+def _state(database: Database) -> list:
+    return [(organization.name, [(block.first, block.ip_address.subnet_mask_length) for block in organization.ip_address_blocks])
+            for organization in database.organizations]
+
+
+def _random_database(generator: random.Random, organization_count: int = 20) -> Database:  # distinct prefixes, nested ones allowed
+    database = Database()
+    database.overlap_policy = ALLOW_OVERLAPS
+    used = set()
+    for index in range(organization_count):
+        blocks = []
+        for _ in range(generator.randint(0, 6)):
+            length = generator.randint(8, 32)
+            address = generator.getrandbits(32) & ~(2 ** (32 - length) - 1)
+            if (address, length) not in used:
+                used.add((address, length))
+                blocks.append(IPAddressBlock._from_int(address, length))
+        database.add_organization(Organization(generator.choice(["Org", "Réseau", "網路", ""]) + f" {index}", blocks))
+    return database
+
+
+@pytest.fixture
+def state():  # (name, [(network address, subnet mask length), ...]) per organization, in order, for comparing databases
+    return _state
+
+
+@pytest.fixture
+def random_database():  # builds a seeded random database
+    return _random_database
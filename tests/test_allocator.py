@@ -0,0 +1,147 @@
+# Brute-force checks of the buddy allocator and the running allocation statistics
+import random
+
+import pytest
+
+from allocator import BEST_FIT, FIRST_FIT, FreeSpace
+from model import ALLOW_OVERLAPS, Database, IPAddressBlock, Organization
+
+
+def _merged(ranges) -> list[tuple[int, int]]:  # inclusive (first, last) ranges merged into disjoint ones, in address order
+    merged = []
+    for first, last in sorted(ranges):
+        if merged and first <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], last))
+        else:
+            merged.append((first, last))
+    return merged
+
+
+def _is_free(allocated: list[tuple[int, int]], first: int, last: int) -> bool:
+    return all(last < allocated_first or allocated_last < first for allocated_first, allocated_last in allocated)
+
+
+def _first_fit(allocated: list[tuple[int, int]], subnet_mask_length: int):  # lowest aligned free block of the size, or None
+    size = 2 ** (32 - subnet_mask_length)
+    address = 0
+    for first, last in allocated + [(2 ** 32, 2 ** 32)]:
+        if address + size - 1 < first:
+            return address if address < 2 ** 32 else None
+        if last + 1 > address:
+            address = -(-(last + 1) // size) * size  # next aligned address after the allocated range
+    return None
+
+
+def _random_block(generator: random.Random) -> IPAddressBlock:
+    length = generator.choice([2, 8, 9, 16] + list(range(20, 33)) * 2)
+    address = generator.getrandbits(24) if generator.random() < 0.8 else generator.getrandbits(32)
+    return IPAddressBlock._from_int(address & (2 ** 32 - 1) ^ address & (2 ** (32 - length) - 1), length)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_allocate_and_stats_match_brute_force(seed):
+    generator = random.Random(seed)
+    database = Database()
+    database.overlap_policy = ALLOW_OVERLAPS
+    organizations = [Organization(f"Organization {index}") for index in range(3)]
+    for organization in organizations:
+        database.add_organization(organization)
+    held = []  # (organization, block)
+    for step in range(150):
+        organization = generator.choice(organizations)
+        action = generator.random()
+        if action < 0.35:
+            block = _random_block(generator)
+            organization.add_ip_address_block(block)
+            held.append((organization, block))
+        elif action < 0.7:
+            subnet_mask_length = generator.randint(4, 32)
+            policy = generator.choice([FIRST_FIT, BEST_FIT])
+            allocated = _merged((block.first, block.last) for _, block in held)
+            expected = _first_fit(allocated, subnet_mask_length)
+            if expected is None:
+                with pytest.raises(ValueError):
+                    database.allocate(organization, subnet_mask_length, policy)
+                continue
+            block = database.allocate(organization, subnet_mask_length, policy)
+            assert block.ip_address.subnet_mask_length == subnet_mask_length
+            assert _is_free(allocated, block.first, block.last)
+            if policy == FIRST_FIT:
+                assert block.first == expected
+            held.append((organization, block))
+        elif held:
+            organization, block = held.pop(generator.randrange(len(held)))
+            if any((other.first, other.last) == (block.first, block.last) for _, other in held):
+                organization.remove_ip_address_block(block)
+            else:  # the only holder of the prefix, so release takes it from this organization
+                database.release(block)
+        _check_stats(database, held)
+
+
+def _check_stats(database: Database, held: list) -> None:
+    allocated = _merged((block.first, block.last) for _, block in held)
+    allocated_addresses = sum(last - first + 1 for first, last in allocated)
+    assert database.total_allocated_ip_addresses() == allocated_addresses
+    assert database.total_unallocated_ip_addresses() == 2 ** 32 - allocated_addresses
+    stats = database.stats
+    assert stats.blocks_by_subnet_mask_length == [sum(block.ip_address.subnet_mask_length == length for _, block in held) for length in range(33)]
+    by_slash8 = [0] * 256
+    for first, last in allocated:
+        for slash8 in range(first >> 24, (last >> 24) + 1):
+            by_slash8[slash8] += min(last, (slash8 << 24) + 2 ** 24 - 1) - max(first, slash8 << 24) + 1
+    assert stats.addresses_by_slash8 == by_slash8
+    for organization in database.organizations:
+        owned = _merged((block.first, block.last) for owner, block in held if owner is organization)
+        assert stats.organization_addresses[organization] == sum(last - first + 1 for first, last in owned)
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_free_space_matches_brute_force(seed):
+    generator = random.Random(seed)
+    free_space = FreeSpace()
+    allocated = []  # inclusive (first, last) of the carved prefixes
+    for step in range(200):
+        if allocated and generator.random() < 0.4:
+            first, last = allocated.pop(generator.randrange(len(allocated)))
+            free_space.release(first, 32 - (last - first + 1).bit_length() + 1)
+        else:
+            subnet_mask_length = generator.randint(1, 32)
+            network_address = free_space.find(subnet_mask_length, generator.choice([FIRST_FIT, BEST_FIT]))
+            if network_address is None:
+                assert _first_fit(_merged(allocated), subnet_mask_length) is None
+                continue
+            first, last = network_address, network_address + 2 ** (32 - subnet_mask_length) - 1
+            assert _is_free(allocated, first, last) and network_address % 2 ** (32 - subnet_mask_length) == 0
+            free_space.carve(network_address, subnet_mask_length)
+            allocated.append((first, last))
+        assert free_space.free_addresses == 2 ** 32 - sum(last - first + 1 for first, last in allocated)
+        for length, free_blocks in enumerate(free_space.free_blocks):  # maximal blocks: never both buddies free
+            for network_address in free_blocks:
+                assert _is_free(allocated, network_address, network_address + 2 ** (32 - length) - 1)
+                assert length == 0 or network_address ^ 1 << (32 - length) not in free_blocks
+            assert set(free_space.heaps[length]) >= free_blocks
+
+
+def test_free_space_heaps_stay_compact_under_churn():
+    database = Database()
+    organization = Organization("Churn")
+    database.add_organization(organization)
+    generator = random.Random(0)
+    for _ in range(5000):
+        block = database.allocate(organization, generator.randint(16, 32))
+        if generator.random() < 0.7:
+            organization.remove_ip_address_block(block)
+    free_space = database._free_space
+    for heap, free_blocks in zip(free_space.heaps, free_space.free_blocks):
+        assert len(heap) <= max(64, 2 * len(free_blocks))
+
+
+def test_free_space_is_only_built_by_allocate():
+    database = Database()
+    organization = Organization("Lazy", [IPAddressBlock("10.0.0.0/8"), IPAddressBlock("0.0.0.0/8")])
+    database.add_organization(organization)
+    assert database._free_space is None
+    assert database.allocate(organization, 8).first == 1 << 24
+    organization.remove_ip_address_block(IPAddressBlock("0.0.0.0/8"))
+    assert database.allocate(organization, 8).first == 0
+    assert database.allocate(organization, 7).first == 2 << 24
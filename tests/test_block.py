@@ -0,0 +1,58 @@
+# Indexing, slicing and iteration of IPAddressBlock against a list of its addresses
+import random
+
+import numpy as np
+import pytest
+
+from model import IPAddressBlock
+
+
+@pytest.mark.parametrize("subnet_mask_length", [32, 31, 30, 28, 24, 20])
+def test_indexing_and_slicing_match_a_list(subnet_mask_length):
+    generator = random.Random(subnet_mask_length)
+    first = generator.getrandbits(32) & ~(2 ** (32 - subnet_mask_length) - 1)
+    block = IPAddressBlock._from_int(first, subnet_mask_length)
+    addresses = list(range(first, first + 2 ** (32 - subnet_mask_length)))  # the brute-force list
+    count = len(addresses)
+    assert list(block.addresses()) == addresses
+    assert list(block.hosts()) == addresses[1:-1]
+    assert [ip_address.ip_address for ip_address in block] == addresses[1:-1]
+    assert all(ip_address.subnet_mask_length == subnet_mask_length for ip_address in block)
+    for index in list(range(-count, count)) if count <= 256 else generator.sample(range(-count, count), 256):
+        assert block[index] == addresses[index]
+    for index in [count, count + 1, -count - 1, 2 ** 40]:
+        with pytest.raises(IndexError):
+            block[index]
+    bounds = [None, 0, 1, -1, count // 2, count, count + 5, -count - 5]
+    for _ in range(200):
+        start, stop = generator.choice(bounds), generator.choice(bounds)
+        step = generator.choice([None, 1, 2, 3, 7, -1, -2, -5])
+        assert list(block[start:stop:step]) == addresses[start:stop:step]
+        assert block.to_numpy(start, stop, step).tolist() == addresses[start:stop:step]
+    with pytest.raises(ValueError):
+        block[::0]
+
+
+def test_numpy_views():
+    block = IPAddressBlock._from_int(0xFFFFF000, 20)  # ends at the last address, which must not overflow uint32
+    assert block.to_numpy().dtype == np.uint32
+    assert block.to_numpy().tolist() == list(range(0xFFFFF000, 2 ** 32))
+    chunks = list(block.iter_numpy(1000))
+    assert [len(chunk) for chunk in chunks] == [1000, 1000, 1000, 1000, 96]
+    assert np.concatenate(chunks).tolist() == list(range(0xFFFFF000, 2 ** 32))
+    assert block.to_numpy(-3).tolist() == [2 ** 32 - 3, 2 ** 32 - 2, 2 ** 32 - 1]
+    assert block.to_numpy(None, None, -1).tolist() == list(range(2 ** 32 - 1, 0xFFFFF000 - 1, -1))
+    assert IPAddressBlock._from_int(0, 24).to_numpy(None, None, -1).tolist() == list(range(255, -1, -1))  # stops below 0
+
+
+def test_large_blocks_stay_lazy():  # a /0 has 2^32 addresses, none of which may be materialized
+    block = IPAddressBlock._from_int(0, 0)
+    assert len(block.addresses()) == 2 ** 32
+    assert block[-1] == 2 ** 32 - 1
+    assert block[2 ** 31] == 2 ** 31
+    assert block[::2 ** 30] == range(0, 2 ** 32, 2 ** 30)
+    assert len(block[1::-1]) == 2
+    assert len(block.hosts()) == 2 ** 32 - 2
+    iterator, other = iter(block), iter(block)
+    assert next(iterator).ip_address == 1 and next(iterator).ip_address == 2
+    assert next(other).ip_address == 1  # every iterator starts over
@@ -0,0 +1,144 @@
+# Brute-force checks of CIDRSet against Python sets of addresses, inside a small window of the address space,
+# and of the conversions between address ranges and prefixes
+import random
+
+import pytest
+
+from cidr import CIDRSet, aggregate, prefixes_to_ranges, ranges_to_prefixes
+from model import IPAddress, IPAddressBlock, block_to_range, range_to_blocks, range_to_prefixes
+
+WINDOW = 10 << 24  # 10.0.0.0/20, 4096 addresses
+
+
+def _random_blocks(generator: random.Random) -> list[IPAddressBlock]:
+    blocks = []
+    for _ in range(generator.randint(0, 8)):
+        length = generator.randint(20, 32)
+        address = WINDOW | generator.getrandbits(12)
+        blocks.append(IPAddressBlock._from_int(address & ~(2 ** (32 - length) - 1), length))
+    return blocks
+
+
+def _addresses(blocks) -> set[int]:
+    return {address for block in blocks for address in range(block.first, block.last + 1)}
+
+
+def _set_addresses(cidr_set: CIDRSet) -> set[int]:
+    return {address for first, last in cidr_set.ranges() for address in range(first, last + 1)}
+
+
+def _check_minimal(cidr_set: CIDRSet, expected: set[int]) -> None:
+    assert _set_addresses(cidr_set) == expected
+    assert cidr_set.get_num_addresses() == len(expected)
+    ranges = cidr_set.ranges()
+    assert all(last + 1 < next_first for (_, last), (next_first, _) in zip(ranges, ranges[1:]))  # disjoint, never adjacent
+    blocks = cidr_set.to_blocks()
+    assert _addresses(blocks) == expected and sum(block.get_num_addresses() for block in blocks) == len(expected)
+    for block in blocks:  # minimal: no two neighbouring blocks are buddies that should have been one block
+        length = block.ip_address.subnet_mask_length
+        buddy = block.first ^ 1 << (32 - length) if length else None
+        assert not any(other.first == buddy and other.ip_address.subnet_mask_length == length for other in blocks)
+
+
+@pytest.mark.parametrize("seed", range(30))
+def test_set_operations_match_python_sets(seed):
+    generator = random.Random(seed)
+    a_blocks, b_blocks = _random_blocks(generator), _random_blocks(generator)
+    a, b = CIDRSet(a_blocks), CIDRSet(b_blocks)
+    a_addresses, b_addresses = _addresses(a_blocks), _addresses(b_blocks)
+    _check_minimal(a, a_addresses)
+    _check_minimal(a | b, a_addresses | b_addresses)
+    _check_minimal(a & b, a_addresses & b_addresses)
+    _check_minimal(a - b, a_addresses - b_addresses)
+    _check_minimal(a ^ b, a_addresses ^ b_addresses)
+    assert (~a).get_num_addresses() == 2 ** 32 - len(a_addresses)
+    assert ~~a == a
+    assert (~a & a) == CIDRSet()
+    for address in generator.sample(range(WINDOW - 16, WINDOW + 4096 + 16), 50):
+        assert (address in a) == (address in a_addresses)
+    for block in b_blocks:
+        assert a.contains(block) == (_addresses([block]) <= a_addresses)
+    assert _addresses(aggregate(a_blocks)) == a_addresses
+    assert CIDRSet(aggregate(a_blocks)) == a
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_from_ranges_and_prefixes_agree(seed):
+    generator = random.Random(seed)
+    firsts = [WINDOW + generator.randrange(4096) for _ in range(generator.randint(1, 6))]
+    lasts = [min(first + generator.randrange(600), WINDOW + 4095) for first in firsts]
+    from_ranges = CIDRSet.from_ranges(firsts, lasts)
+    _check_minimal(from_ranges, {address for first, last in zip(firsts, lasts) for address in range(first, last + 1)})
+    assert CIDRSet.from_prefixes(*from_ranges.to_prefixes()) == from_ranges
+
+
+def test_whole_space():
+    everything = CIDRSet(["0.0.0.0/0"])
+    assert everything.get_num_addresses() == 2 ** 32
+    assert ~everything == CIDRSet()
+    assert ~CIDRSet() == everything
+    assert [(block.first, block.ip_address.subnet_mask_length) for block in everything.to_blocks()] == [(0, 0)]
+    with pytest.raises(ValueError):
+        CIDRSet.from_ranges([5], [4])
+
+
+def _random_range(generator: random.Random) -> tuple[int, int]:  # short and long ranges, some touching either end of the space
+    first = generator.choice([0, generator.getrandbits(32), 2 ** 32 - 1 - generator.getrandbits(8)])
+    last = min(first + generator.choice([0, generator.getrandbits(8), generator.getrandbits(32)]), 2 ** 32 - 1)
+    return first, last
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_range_to_prefixes_is_exact_and_minimal(seed):
+    generator = random.Random(seed)
+    for first, last in [_random_range(generator) for _ in range(100)] + [(0, 2 ** 32 - 1), (1, 2 ** 32 - 2)]:
+        prefixes = range_to_prefixes(first, last)
+        stop = first
+        for network_address, subnet_mask_length in prefixes:  # consecutive aligned blocks from first to last
+            size = 2 ** (32 - subnet_mask_length)
+            assert network_address == stop and network_address % size == 0
+            stop += size
+            parent_size = size * 2  # minimal: the enclosing block of twice the size does not fit in the range
+            parent = network_address - network_address % parent_size
+            assert subnet_mask_length == 0 or not first <= parent <= parent + parent_size - 1 <= last
+        assert stop == last + 1
+        blocks = range_to_blocks(IPAddress(first), last)
+        assert [(block.first, block.ip_address.subnet_mask_length) for block in blocks] == prefixes
+        assert [block_to_range(block) for block in blocks] == [(block.first, block.last) for block in blocks]
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_block_and_range_round_trips(seed):
+    generator = random.Random(seed)
+    for _ in range(100):
+        length = generator.randint(0, 32)
+        address = generator.getrandbits(32)
+        network_address = address & ~(2 ** (32 - length) - 1)
+        first, last = block_to_range(str(IPAddress(address)) + f"/{length}")  # host bits are dropped
+        assert (first, last) == (network_address, network_address + 2 ** (32 - length) - 1)
+        assert range_to_prefixes(first, last) == [(network_address, length)]
+        firsts, lasts = prefixes_to_ranges([address], [length])
+        assert (firsts.tolist(), lasts.tolist()) == ([first], [last])
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_bulk_conversions_match_scalar_ones(seed):
+    generator = random.Random(seed)
+    ranges = [_random_range(generator) for _ in range(generator.randint(0, 50))]
+    network_addresses, subnet_mask_lengths, range_indices = ranges_to_prefixes([first for first, _ in ranges], [last for _, last in ranges])
+    expected = [(network_address, subnet_mask_length, range_index) for range_index, (first, last) in enumerate(ranges)
+                for network_address, subnet_mask_length in range_to_prefixes(first, last)]
+    assert list(zip(network_addresses.tolist(), subnet_mask_lengths.tolist(), range_indices.tolist())) == expected
+    firsts, lasts = prefixes_to_ranges(network_addresses, subnet_mask_lengths)
+    for range_index, (first, last) in enumerate(ranges):  # the prefixes of a range join back into it
+        covered = range_indices == range_index
+        assert (firsts[covered].min(), lasts[covered].max(), int((lasts[covered].astype(int) - firsts[covered] + 1).sum())) == \
+            (first, last, last - first + 1)
+
+
+@pytest.mark.parametrize("first, last", [(5, 4), (-1, 3), (0, 2 ** 32)])
+def test_invalid_ranges(first, last):
+    with pytest.raises(ValueError):
+        range_to_prefixes(first, last)
+    with pytest.raises(ValueError):
+        ranges_to_prefixes([first], [last])
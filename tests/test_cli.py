@@ -0,0 +1,108 @@
+# The command line against a temporary snapshot: import, lookup, stats and checkpoint
+import io
+import json
+import os
+import random
+
+import pytest
+
+from importer import import_file
+from ipv4db import lookup, main
+from journal import _has_records, journal_path_for, open_database
+from model import Database, IPAddress, IPAddressBlock, Organization
+from snapshot import Snapshot, load_snapshot
+
+SAMPLES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "samples")
+SAMPLE_FILES = [os.path.join(SAMPLES, "allocations-sample.csv"), os.path.join(SAMPLES, "delegated-extended-sample.txt")]
+
+
+def _expected(database: Database, query: str) -> dict:  # what lookup writes for one query
+    try:
+        ip_address = IPAddress(query)
+    except ValueError:
+        return None
+    owner, block = database.find_owner(ip_address)
+    return {"query": query, "organization": owner.name if owner else None,
+            "block": str(block.get_identity_address()) if block else None}
+
+
+def _imported(tmp_path, capsys) -> tuple[str, Database]:  # snapshot path after importing the samples, and the same imports in memory
+    path = str(tmp_path / "ipv4db.snapshot")
+    assert main(["--snapshot", path, "import"] + SAMPLE_FILES) == 1  # each sample has one invalid line
+    assert "Invalid address count: not-a-number" in capsys.readouterr().err
+    database = Database()
+    for sample in SAMPLE_FILES:
+        import_file(database, sample)
+    return path, database
+
+
+def test_import_and_lookup(tmp_path, capsys, state):
+    path, database = _imported(tmp_path, capsys)
+    assert not _has_records(journal_path_for(path))  # the import ends with a checkpoint
+    assert state(load_snapshot(path).to_database()) == state(database)
+
+    generator = random.Random(0)
+    queries = ["8.8.8.8", "1.0.130.1", "9.9.9.9", "9.9.9.10", " 1.1.1.1 ", "", "999.1.1.1", "1.0.0.1/24"]
+    queries += [str(IPAddress(generator.getrandbits(32) & 0x0100FFFF)) for _ in range(100)]
+    addresses = tmp_path / "addresses.txt"
+    addresses.write_text("\n".join(queries) + "\n")
+    assert main(["--snapshot", path, "lookup", str(addresses)]) == 1  # 999.1.1.1 is not an address
+    records = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    queries = [query.strip() for query in queries if query.strip()]  # blank lines are skipped, the rest stripped
+    assert [record["query"] for record in records] == queries
+    for query, record in zip(queries, records):
+        expected = _expected(database, query)
+        if expected is None:
+            assert "error" in record
+        else:
+            assert record == expected
+
+
+@pytest.mark.parametrize("batch_size", [1, 3, 1000])
+def test_lookup_batches(batch_size, random_database):  # the output does not depend on how the addresses are batched
+    generator = random.Random(batch_size)
+    database = random_database(generator)
+    snapshot = Snapshot.from_database(database)
+    queries = [str(IPAddress(generator.getrandbits(32))) for _ in range(50)]
+    queries += [str(IPAddress(block.first)) for organization in database.organizations
+                for block in organization.ip_address_blocks]
+    queries.insert(5, "nonsense")
+    output = io.StringIO()
+    assert lookup(snapshot, queries, output, batch_size) == 1
+    records = [json.loads(line) for line in output.getvalue().splitlines()]
+    assert len(records) == len(queries)
+    for query, record in zip(queries, records):
+        expected = _expected(database, query)
+        assert (record == expected) if expected is not None else ("error" in record)
+
+
+def test_stats(tmp_path, capsys):
+    path, database = _imported(tmp_path, capsys)
+    assert main(["--snapshot", path, "stats"]) == 0
+    stats = json.loads(capsys.readouterr().out)
+    blocks = [block for organization in database.organizations for block in organization.ip_address_blocks]
+    assert stats["organizations"] == len(database.organizations)
+    assert stats["blocks"] == len(blocks)
+    assert stats["allocated_addresses"] == database.total_allocated_ip_addresses()
+    assert stats["unallocated_addresses"] == 2 ** 32 - database.total_allocated_ip_addresses()
+    assert sum(stats["blocks_by_subnet_mask_length"].values()) == len(blocks)
+
+
+def test_journal_tail_and_checkpoint(tmp_path, capsys, state):
+    path, _ = _imported(tmp_path, capsys)
+    database = open_database(path)
+    database.add_organization(Organization("Added", [IPAddressBlock(IPAddress("203.0.113.0/24"))]))
+    database.journal.close()
+    checkpointed = state(load_snapshot(path).to_database())
+    assert _has_records(journal_path_for(path))
+
+    assert main(["--snapshot", path, "stats"]) == 0  # readers see the journal tail before it is checkpointed
+    assert json.loads(capsys.readouterr().out)["organizations"] == len(checkpointed) + 1
+    assert main(["--snapshot", path, "checkpoint"]) == 0
+    assert not _has_records(journal_path_for(path))
+    assert state(load_snapshot(path).to_database()) == checkpointed + [("Added", [(IPAddress("203.0.113.0").ip_address, 24)])]
+
+
+def test_missing_snapshot(tmp_path, capsys):
+    assert main(["--snapshot", str(tmp_path / "missing.snapshot"), "stats"]) == 2
+    assert capsys.readouterr().err.startswith("Error: ")
@@ -0,0 +1,122 @@
+# Point-in-time lookups of AllocationHistory against a copy of the allocations kept after every change
+import random
+from collections import Counter
+
+import pytest
+
+from history import AllocationHistory
+from model import ALLOW_OVERLAPS, Database, IPAddressBlock, Organization
+
+
+def _allocations(database: Database) -> Counter:  # (organization name, network address, subnet mask length) -> count
+    return Counter((organization.name, block.first, block.ip_address.subnet_mask_length)
+                   for organization in database.organizations for block in organization.ip_address_blocks)
+
+
+def _key(allocation) -> tuple:
+    return allocation.organization_name, allocation.ip_address_block.first, allocation.ip_address_block.ip_address.subnet_mask_length
+
+
+def _random_block(generator: random.Random) -> IPAddressBlock:  # few distinct prefixes, so they nest and repeat
+    length = generator.choice([8, 12, 16, 24, 32])
+    return IPAddressBlock._from_int((generator.randrange(4) << 24 | generator.getrandbits(24)) & ~(2 ** (32 - length) - 1), length)
+
+
+def _random_change(generator: random.Random, database: Database) -> None:
+    organizations = database.organizations
+    action = generator.random()
+    if not organizations or action < 0.2:
+        database.add_organization(Organization(f"Organization {generator.getrandbits(32)}",
+                                               [_random_block(generator) for _ in range(generator.randint(0, 3))]))
+    elif action < 0.3:
+        database.remove_organization(generator.choice(organizations))
+    elif action < 0.7 or not any(organization.ip_address_blocks for organization in organizations):
+        generator.choice(organizations).add_ip_address_blocks([_random_block(generator) for _ in range(generator.randint(1, 3))])
+    else:
+        organization = generator.choice([organization for organization in organizations if organization.ip_address_blocks])
+        organization.remove_ip_address_block(generator.choice(organization.ip_address_blocks))
+
+
+def _state_at(states: list, timestamp: float) -> Counter:  # states: (timestamp, allocations), latest last for equal timestamps
+    state = Counter()
+    for state_timestamp, allocations in states:
+        if state_timestamp <= timestamp:
+            state = allocations
+    return state
+
+
+def _longest_matches(state: Counter, address: int) -> set:  # (name, network address, length) of the most specific blocks containing it
+    containing = [key for key in state if key[1] <= address < key[1] + 2 ** (32 - key[2])]
+    if not containing:
+        return set()
+    length = max(key[2] for key in containing)
+    return {key for key in containing if key[2] == length}
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_history_matches_recorded_states(seed):
+    generator = random.Random(seed)
+    database = Database()
+    database.overlap_policy = ALLOW_OVERLAPS
+    now = [1000.0]
+    for _ in range(5):
+        _random_change(generator, database)
+    history = AllocationHistory(clock=lambda: now[0])
+    history.attach(database)
+    states = [(now[0], _allocations(database))]
+    intervals = []  # [name, network address, length, valid from, valid until] of every allocation, as the history should record them
+    open_intervals = {}  # key -> indices into intervals of the current allocations
+    for key, count in states[0][1].items():
+        for _ in range(count):
+            open_intervals.setdefault(key, []).append(len(intervals))
+            intervals.append(list(key) + [now[0], None])
+    for _ in range(150):
+        now[0] += generator.choice([0, 0, 1, 2.5])  # several changes at one time form one version
+        before = states[-1][1]
+        _random_change(generator, database)
+        after = _allocations(database)
+        for key, count in (before - after).items():
+            for _ in range(count):
+                intervals[open_intervals[key].pop()][4] = now[0]
+        for key, count in (after - before).items():
+            for _ in range(count):
+                open_intervals.setdefault(key, []).append(len(intervals))
+                intervals.append(list(key) + [now[0], None])
+        states.append((now[0], after))
+
+    timestamps = [states[0][0] - 1] + [timestamp + offset for timestamp, _ in states for offset in (0, 0.5)]
+    for timestamp in generator.sample(timestamps, 60):
+        state = _state_at(states, timestamp)
+        assert Counter(_key(allocation) for allocation in history.allocations_at(timestamp)) == state
+        assert all(allocation.is_valid_at(timestamp) for allocation in history.allocations_at(timestamp))
+        for _ in range(20):
+            address = generator.choice([generator.getrandbits(26), generator.choice(list(state) or [(None, 0)])[1]])
+            owner = history.find_owner_at(address, timestamp)
+            expected = _longest_matches(state, address)
+            assert (_key(owner) in expected) if owner is not None else not expected
+
+    for _ in range(50):
+        address = generator.choice([generator.getrandbits(26)] + [interval[1] for interval in intervals])
+        timeline = history.timeline(address)
+        assert [allocation.valid_from for allocation in timeline] == sorted(allocation.valid_from for allocation in timeline)
+        assert Counter(_key(allocation) + (allocation.valid_from, allocation.valid_until) for allocation in timeline) == \
+            Counter(tuple(interval) for interval in intervals if interval[1] <= address < interval[1] + 2 ** (32 - interval[2]))
+
+
+def test_record_state_stores_differences():
+    first, second = IPAddressBlock._from_int(0x0A000000, 8), IPAddressBlock._from_int(0x0A010000, 16)
+    history = AllocationHistory()
+    history.record_state([("A", first), ("B", second)], 10)
+    history.record_state([("A", first), ("B", second)], 20)  # unchanged, no new version
+    history.record_state([("A", first), ("C", second)], 30)
+    assert history.timestamps == [10, 30]
+    assert [_key(allocation) for allocation in history.allocations_at(25)] == [("A", 0x0A000000, 8), ("B", 0x0A010000, 16)]
+    assert [_key(allocation) for allocation in history.allocations_at(30)] == [("A", 0x0A000000, 8), ("C", 0x0A010000, 16)]
+    assert history.find_owner_at(0x0A010203, 29).organization_name == "B"
+    assert history.find_owner_at(0x0A010203, 30).organization_name == "C"
+    assert history.find_owner_at(0x0A020203, 30).organization_name == "A"
+    assert history.find_owner_at(0x0A010203, 9) is None
+    assert [(allocation.organization_name, allocation.valid_from, allocation.valid_until) for allocation in history.timeline(0x0A010203)] == \
+        [("A", 10, None), ("B", 10, 30), ("C", 30, None)]
+    with pytest.raises(ValueError):
+        history.record_state([], 29)
@@ -0,0 +1,144 @@
+# Imports of the bundled samples, malformed rows, and random delegated files against the ranges they describe
+import os
+import random
+
+import pytest
+
+from importer import MAX_REPORTED_ERRORS, import_allocation_csv, import_delegated, import_file
+from model import Database, IPAddress
+
+SAMPLES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "samples")
+
+
+def _address(text: str) -> int:
+    return IPAddress(text).ip_address
+
+
+def _ranges(database: Database) -> dict:  # name -> merged inclusive (first, last) ranges covered by its blocks
+    ranges = {}
+    for organization in database.organizations:
+        merged = []
+        for block in sorted(organization.ip_address_blocks, key=lambda block: block.first):
+            first, last = block.first, block.first + block.get_num_addresses() - 1
+            if merged and merged[-1][1] + 1 == first:
+                merged[-1] = (merged[-1][0], last)
+            else:
+                merged.append((first, last))
+        ranges[organization.name] = merged
+    return ranges
+
+
+def test_allocation_csv_sample(state):
+    database = Database()
+    result = import_file(database, os.path.join(SAMPLES, "allocations-sample.csv"))
+    assert state(database) == [
+        ("Google", [(_address("8.8.8.0"), 24), (_address("8.8.4.0"), 24), (_address("142.250.0.0"), 15)]),
+        ("Cloudflare", [(_address("1.1.1.0"), 24), (_address("104.16.0.0"), 13)]),
+        ("Quad9", [(_address("9.9.9.9"), 32)]),
+        ("Example Corp", [(_address("192.0.2.0"), 24)]),
+    ]
+    assert (result.lines, result.blocks, result.organizations, result.error_count) == (9, 7, 4, 1)
+    assert [line_number for line_number, _ in result.errors] == [9]
+
+
+def test_delegated_sample():
+    database = Database()
+    result = import_file(database, os.path.join(SAMPLES, "delegated-extended-sample.txt"))
+    assert _ranges(database) == {
+        "A91872ED": [(_address("1.0.0.0"), _address("1.0.0.255"))],
+        "A92E1062": [(_address("1.0.1.0"), _address("1.0.3.255")), (_address("1.0.8.0"), _address("1.0.15.255")),
+                     (_address("1.0.32.0"), _address("1.0.63.255"))],
+        "A92319D5": [(_address("1.0.4.0"), _address("1.0.7.255"))],
+        "A92D9378": [(_address("1.0.16.0"), _address("1.0.31.255")), (_address("1.1.0.0"), _address("1.1.2.255"))],
+        "A9192210": [(_address("1.0.64.0"), _address("1.0.127.255"))],
+        "A91E5FB3": [(_address("1.0.128.0"), _address("1.0.223.255"))],
+    }
+    assert (result.lines, result.organizations, result.error_count) == (19, 6, 1)
+    assert result.errors == [(19, "Invalid address count: not-a-number")]
+
+
+def test_delegated_rejects_ranges_past_the_last_address():
+    lines = ["apnic|XX|ipv4|255.255.255.0|256|20110412|allocated|Last\n",  # ends exactly at 255.255.255.255
+             "apnic|XX|ipv4|255.255.254.0|513|20110412|allocated|Past\n",  # one address too many
+             "apnic|XX|ipv4|0.0.0.0|4294967297|20110412|allocated|Everything\n",
+             "apnic|XX|ipv4|10.0.0.0|0|20110412|allocated|Empty\n",
+             "apnic|XX|ipv4|10.0.0.0|-1|20110412|allocated|Negative\n"]
+    database = Database()
+    result = import_delegated(database, lines)
+    assert _ranges(database) == {"Last": [(_address("255.255.255.0"), 2 ** 32 - 1)]}
+    assert result.errors == [(2, "Invalid address count: 513"), (3, "Invalid address count: 4294967297"),
+                             (4, "Invalid address count: 0"), (5, "Invalid address count: -1")]
+
+
+def test_delegated_skips_other_records():
+    lines = ["2|apnic|20240101|14|19830101|20231231|+1000\n",
+             "apnic|*|ipv4|*|10|summary\n",
+             "# comment\n",
+             "\n",
+             "apnic|AU|ipv6|2001:200::|35|19990813|allocated|A\n",
+             "apnic|ZZ|ipv4|1.0.224.0|8192||available|\n",
+             "apnic|ZZ|ipv4|1.0.224.0|8192||reserved|\n",
+             "apnic|AU|ipv4|1.0.0.0\n",  # too short to be a record
+             "apnic|AU|ipv4|1.0.0.0|256|20110811|assigned\n"]  # no opaque id, named after registry and country
+    database = Database()
+    result = import_delegated(database, lines)
+    assert _ranges(database) == {"apnic AU": [(_address("1.0.0.0"), _address("1.0.0.255"))]}
+    assert result.error_count == 0
+
+
+def test_allocation_csv_malformed_rows(state):
+    rows = ["name,network\n",  # header, only skipped on the first line
+            "A,10.0.0.0/8\n",
+            "B\n",
+            "C,10.0.0.0/33\n",
+            "D,10.0.0.9-10.0.0.2\n",
+            "E,10.0.0.1-nonsense\n",
+            "name,network\n",
+            ",\n",  # blank
+            "\n",
+            "F,11.0.0.1-11.0.0.4\n",
+            "G,10.1.0.0/16\n"]  # inside A, rejected by the default overlap policy
+    database = Database()
+    result = import_allocation_csv(database, rows)
+    assert [line_number for line_number, _ in result.errors] == [3, 4, 5, 6, 7, 11]
+    assert result.errors[0] == (3, "Expected organization,prefix")
+    assert state(database) == [("A", [(_address("10.0.0.0"), 8)]),
+                               ("F", [(_address("11.0.0.1"), 32), (_address("11.0.0.2"), 31), (_address("11.0.0.4"), 32)]),
+                               ("G", [])]
+    assert result.blocks == 4
+
+
+def test_error_list_is_capped():
+    rows = ["Org,not-a-prefix\n"] * (MAX_REPORTED_ERRORS + 50)
+    result = import_allocation_csv(Database(), rows)
+    assert result.error_count == MAX_REPORTED_ERRORS + 50
+    assert len(result.errors) == MAX_REPORTED_ERRORS
+    assert result.errors[-1][0] == MAX_REPORTED_ERRORS
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_delegated_random_ranges(seed, state):  # every batch size gives the blocks covering exactly the ranges read
+    generator = random.Random(seed)
+    bounds = sorted(generator.sample(range(2 ** 32 + 1), 2 * generator.randint(1, 200)))
+    expected = {}
+    lines = []
+    for first, end in zip(bounds[::2], bounds[1::2]):
+        name = f"Organization {generator.randrange(10)}"
+        expected.setdefault(name, []).append((first, end - 1))
+        lines.append(f"ripencc|NL|ipv4|{IPAddress(first)}|{end - first}|20240101|allocated|{name}\n")
+    for name, ranges in expected.items():  # adjacent ranges of one organization merge
+        merged = [ranges[0]]
+        for first, last in ranges[1:]:
+            if merged[-1][1] + 1 == first:
+                merged[-1] = (merged[-1][0], last)
+            else:
+                merged.append((first, last))
+        expected[name] = merged
+    databases = []
+    for batch_size in [1, 7, 10_000]:
+        database = Database()
+        result = import_delegated(database, lines, batch_size=batch_size)
+        assert result.error_count == 0
+        assert _ranges(database) == expected
+        databases.append(database)
+    assert state(databases[0]) == state(databases[1]) == state(databases[2])
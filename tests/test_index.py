@@ -0,0 +1,163 @@
+# Brute-force checks of the prefix tries and the name index against plain lists
+import random
+
+import pytest
+
+from index import NameIndex, PersistentPrefixTrie, PrefixTrie
+
+_MASKS = [(2 ** 32 - 1) ^ (2 ** (32 - length) - 1) for length in range(33)]
+
+
+def _random_prefix(generator: random.Random) -> tuple[int, int]:  # mostly inside 10.0.0.0/20 so prefixes nest and collide often
+    length = generator.choice([0, 1, 8, 12] + list(range(16, 33)) * 3)
+    address = (10 << 24 | generator.getrandbits(12) << 8 | generator.getrandbits(8)) if generator.random() < 0.9 else generator.getrandbits(32)
+    return address & _MASKS[length], length
+
+
+def _contains(prefix: int, length: int, address: int) -> bool:
+    return (address ^ prefix) & _MASKS[length] == 0
+
+
+def _longest_match(entries: list, address: int):  # most recently added value of the most specific prefix containing address
+    best = None
+    for prefix, length, value in entries:
+        if _contains(prefix, length, address) and (best is None or length >= best[1]):
+            best = (prefix, length, value)
+    return best[2] if best else None
+
+
+def _probe_addresses(generator: random.Random, entries: list) -> list[int]:
+    addresses = [generator.getrandbits(32) for _ in range(20)]
+    for prefix, length, _ in generator.sample(entries, min(len(entries), 20)):
+        addresses += [prefix, prefix | (2 ** (32 - length) - 1), prefix - 1 & 0xFFFFFFFF]
+    return addresses
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_prefix_trie_matches_brute_force(seed):
+    generator = random.Random(seed)
+    trie = PrefixTrie()
+    entries = []  # (prefix, length, value) in insertion order
+    for step in range(300):
+        if entries and generator.random() < 0.35:
+            prefix, length, value = entries.pop(generator.randrange(len(entries)))
+            trie.remove(prefix, length, value)
+        else:
+            prefix, length = _random_prefix(generator)
+            value = (prefix, length, step)
+            trie.insert(prefix, length, value)
+            entries.append((prefix, length, value))
+        assert len(trie) == len(entries)
+        if step % 10:
+            continue
+        for address in _probe_addresses(generator, entries):
+            assert trie.longest_match(address) == _longest_match(entries, address)
+        prefix, length = _random_prefix(generator)
+        assert trie.get(prefix, length) == [value for p, l, value in entries if (p, l) == (prefix, length)]
+        overlapping = [value for p, l, value in entries if _contains(p, l, prefix) or _contains(prefix, length, p) and l >= length]
+        assert sorted(trie.overlapping(prefix, length)) == sorted(overlapping)
+        uncovered = trie.uncovered(prefix, length)
+        assert sum(2 ** (32 - l) for _, l in uncovered) == 2 ** (32 - length) - _covered_count(entries, prefix, length)
+        for gap_prefix, gap_length in uncovered:
+            assert _contains(prefix, length, gap_prefix) and gap_length >= length
+            assert not any(_contains(p, l, gap_prefix) or _contains(gap_prefix, gap_length, p) for p, l, _ in entries)
+
+
+def _covered_count(entries: list, prefix: int, length: int) -> int:  # addresses of the prefix inside at least one entry
+    ranges = []
+    for p, l, _ in entries:
+        first, last = max(p, prefix), min(p + 2 ** (32 - l) - 1, prefix + 2 ** (32 - length) - 1)
+        if first <= last:
+            ranges.append((first, last))
+    count, end = 0, -1
+    for first, last in sorted(ranges):
+        if last > end:
+            count += last - max(first, end + 1) + 1
+            end = last
+    return count
+
+
+def test_prefix_trie_remove_missing_value_raises():
+    trie = PrefixTrie()
+    trie.insert(10 << 24, 8, "a")
+    with pytest.raises(ValueError):
+        trie.remove(10 << 24, 8, "b")
+    with pytest.raises(ValueError):
+        trie.remove(10 << 24, 16, "a")
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_persistent_prefix_trie_keeps_every_version(seed):
+    generator = random.Random(seed)
+    versions = [(PersistentPrefixTrie(), [])]  # each trie with the entries it should hold
+    for step in range(200):
+        trie, entries = versions[-1]
+        entries = list(entries)
+        if entries and generator.random() < 0.35:
+            prefix, length, value = entries.pop(generator.randrange(len(entries)))
+            trie = trie.remove(prefix, length, value)
+        else:
+            prefix, length = _random_prefix(generator)
+            value = (prefix, length, step)
+            trie = trie.insert(prefix, length, value)
+            entries.append((prefix, length, value))
+        versions.append((trie, entries))
+    for trie, entries in generator.sample(versions, 25):  # older versions are unchanged by the later ones
+        assert len(trie) == len(entries)
+        assert sorted(trie.values()) == sorted(value for _, _, value in entries)
+        for address in _probe_addresses(generator, entries):
+            assert trie.longest_match(address) == _longest_match(entries, address)
+
+
+def _search(entries: list, query: str, limit: int = None) -> list:  # the ranking NameIndex.search documents
+    query = query.lower()
+    if not query:
+        return [value for _, value in entries][:limit]
+    ranked = []
+    for sequence_number, (name, value) in enumerate(entries):
+        name = name.lower()
+        if query in name:
+            ranked.append((0 if name == query else 1 if name.startswith(query) else 2, len(name), sequence_number, value))
+    ranked.sort(key=lambda match: match[:3])
+    return [match[3] for match in ranked[:limit]]
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_name_index_search_matches_brute_force(seed):
+    generator = random.Random(seed)
+    index = NameIndex()
+    entries = []  # (name, value) in insertion order
+    for step in range(300):
+        if entries and generator.random() < 0.2:
+            name, value = entries.pop(generator.randrange(len(entries)))
+            index.remove(name, value)
+        elif generator.random() < 0.6:
+            name = "".join(generator.choice("abAB-") for _ in range(generator.randint(0, 8)))
+            value = object()
+            index.add(name, value)
+            entries.append((name, value))
+        else:
+            query = "".join(generator.choice("abAB") for _ in range(generator.randint(0, 4)))
+            limit = generator.choice([None, 1, 3, 10])
+            assert index.search(query, limit) == _search(entries, query, limit)
+        assert len(index) == len(entries)
+    for name, value in entries:
+        assert index.get(name) is next(v for n, v in entries if n == name)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_name_index_short_queries_match_brute_force(seed):  # common and rare 1-2 character queries take different paths
+    generator = random.Random(seed)
+    index = NameIndex()
+    entries = []
+    for _ in range(2000):
+        name = "".join(generator.choice("aaaabcz") for _ in range(generator.randint(1, 10)))
+        value = object()
+        index.add(name, value)
+        entries.append((name, value))
+    for name, value in generator.sample(entries, 200):
+        index.remove(name, value)
+        entries.remove((name, value))
+    for query in ["a", "b", "z", "aa", "ab", "zz", "zc", "q", "A", "Cz"]:
+        for limit in [None, 1, 10, 100]:
+            assert index.search(query, limit) == _search(entries, query, limit)
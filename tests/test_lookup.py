@@ -0,0 +1,57 @@
+# Batch lookups through the interval table against Database.find_owner, with equal blocks in several organizations
+import random
+
+import numpy as np
+import pytest
+
+from model import ALLOW_OVERLAPS, REPORT_OVERLAPS, Database, IPAddressBlock, Organization
+from snapshot import Snapshot, load_snapshot
+
+PREFIXES = [(10 << 24, 8), (10 << 24, 16), (10 << 24 | 1 << 16, 16), (10 << 24, 24), (10 << 24 | 5, 32), (11 << 24, 8)]
+
+
+def _random_changes(generator: random.Random, database: Database) -> None:  # the same few prefixes, added to any organization in any order
+    for index in range(6):
+        database.add_organization(Organization(f"Organization {index}"))
+    for _ in range(generator.randint(1, 60)):
+        organization = generator.choice(database.organizations)
+        if organization.ip_address_blocks and generator.random() < 0.25:
+            organization.remove_ip_address_block(generator.choice(organization.ip_address_blocks))
+        elif generator.random() < 0.05:
+            database.remove_organization(organization)
+            database.add_organization(Organization(organization.name + "'"))
+        else:
+            organization.add_ip_address_blocks([IPAddressBlock._from_int(*generator.choice(PREFIXES))])
+
+
+def _probe_addresses(generator: random.Random) -> list[int]:
+    addresses = [10 << 24, 10 << 24 | 5, 10 << 24 | 6, 10 << 24 | 1 << 16, 10 << 24 | 1 << 8, 11 << 24, 12 << 24, 0]
+    return addresses + [(generator.choice([10, 11]) << 24) | generator.getrandbits(generator.choice([8, 17, 24])) for _ in range(50)]
+
+
+@pytest.mark.parametrize("seed", range(30))
+def test_equal_blocks_resolve_like_find_owner(seed, tmp_path):
+    generator = random.Random(seed)
+    database = Database()
+    database.overlap_policy = generator.choice([ALLOW_OVERLAPS, REPORT_OVERLAPS])
+    _random_changes(generator, database)
+    addresses = _probe_addresses(generator)
+    organization_indices, block_indices = database.lookup_many(np.array(addresses, dtype=np.uint32))
+    snapshot = Snapshot.from_database(database)
+    snapshot_organization_indices, snapshot_block_indices = snapshot.lookup_many(np.array(addresses, dtype=np.uint32))
+    path = str(tmp_path / "ipv4db.snapshot")
+    snapshot.save(path)
+    saved = load_snapshot(path)
+    for position, address in enumerate(addresses):
+        owner, block = database.find_owner(address)
+        if owner is None:
+            assert organization_indices[position] == snapshot_organization_indices[position] == -1
+            assert snapshot.find_owner(address) == saved.find_owner(address) == (None, None)
+            continue
+        organization = database.organizations[organization_indices[position]]
+        assert organization is owner
+        assert organization.ip_address_blocks[block_indices[position]] == block
+        assert snapshot_organization_indices[position] == organization_indices[position]
+        assert database.organizations[snapshot_organization_indices[position]].ip_address_blocks[snapshot_block_indices[position]] == block
+        for name, snapshot_block in (snapshot.find_owner(address), saved.find_owner(address)):
+            assert name == owner.name and snapshot_block == block
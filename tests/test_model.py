@@ -0,0 +1,62 @@
+# Batch parsing and the lookup cache, checked against the one-at-a-time paths
+import random
+
+import pytest
+
+from cache import LookupCache
+from model import ALLOW_OVERLAPS, Database, IPAddress, IPAddressBlock, Organization, parse_many
+
+
+def test_parse_many_matches_ip_address():
+    generator = random.Random(0)
+    rows = [f"{generator.randrange(256)}.{generator.randrange(256)}.{generator.randrange(256)}.{generator.randrange(256)}"
+            + (f"/{generator.randrange(33)}" if generator.random() < 0.5 else "") for _ in range(500)]
+    rows += [" 10.0.0.1 ", "256.0.0.1", "1.2.3", "", "a.b.c.d", "1.2.3.4/33", 7, None, b"1.2.3.4"]
+    addresses, subnet_mask_lengths, errors = parse_many(rows)
+    errors = dict(errors)
+    assert len(addresses) == len(subnet_mask_lengths) == len(rows)
+    for row, text in enumerate(rows):
+        if not isinstance(text, str):
+            assert errors[row] == "Invalid IP address: not a string"
+            continue
+        try:
+            expected = IPAddress(text.strip())
+        except ValueError:
+            assert row in errors and (addresses[row], subnet_mask_lengths[row]) == (0, 0)
+        else:
+            assert row not in errors
+            assert (addresses[row], subnet_mask_lengths[row]) == (expected.ip_address, expected.subnet_mask_length)
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_cached_lookups_stay_exact(seed):
+    generator = random.Random(seed)
+    cached, uncached = Database(), Database()
+    cached.lookup_cache = LookupCache(generator.choice([1, 64, 4096]))
+    organizations = []
+    for database in (cached, uncached):
+        database.overlap_policy = ALLOW_OVERLAPS
+        organizations.append([Organization(f"Organization {index}") for index in range(3)])
+        for organization in organizations[-1]:
+            database.add_organization(organization)
+    held = []  # (organization index, block)
+    probes = [10 << 24 | generator.getrandbits(24) for _ in range(100)]  # a small pool, so the cache gets hits to invalidate
+    for _ in range(200):
+        if held and generator.random() < 0.3:
+            index, block = held.pop(generator.randrange(len(held)))
+            for database_organizations in organizations:
+                database_organizations[index].remove_ip_address_block(block)
+        else:
+            index, length = generator.randrange(3), generator.choice([8, 12, 16, 20, 24, 28, 32])
+            block = IPAddressBlock._from_int(10 << 24 | generator.getrandbits(24) & ~(2 ** (32 - length) - 1), length)
+            for database_organizations in organizations:
+                database_organizations[index].add_ip_address_block(block)
+            held.append((index, block))
+        for _ in range(20):
+            address = generator.choice(probes)
+            owner, block = cached.find_owner(address)
+            expected_owner, expected_block = uncached.find_owner(address)
+            assert (owner.name if owner else None) == (expected_owner.name if expected_owner else None)
+            assert block is expected_block or (block.first, block.last) == (expected_block.first, expected_block.last)
+    assert len(cached.lookup_cache) <= cached.lookup_cache.capacity
+    assert cached.lookup_cache.hits and cached.lookup_cache.invalidations
@@ -0,0 +1,48 @@
+# Adding and removing organizations keeps every index of the database consistent, including when an add is rejected
+import pytest
+
+from model import REJECT_OVERLAPS, Database, IPAddressBlock, OverlapError, Organization
+
+
+def _check_consistent(database: Database) -> None:
+    for organization in database.organizations:
+        assert organization.database is database
+        assert database.get_organization_by_name(organization.name) is not None
+        assert organization in database.stats.organization_addresses
+    assert len(database.name_index) == len(database.organizations) == len(database.stats.organization_addresses)
+    assert database.total_allocated_ip_addresses() == sum(
+        organization.total_ip_addresses() for organization in database.organizations)  # no overlaps in these tests
+
+
+@pytest.mark.parametrize("organization", [
+    Organization(None),
+    Organization(42, [IPAddressBlock("10.0.0.0/8")]),
+    Organization("Not blocks", ["10.0.0.0/8"]),
+    Organization("Overlapping", [IPAddressBlock("192.168.1.0/24")]),
+], ids=["no name", "number name", "string block", "overlap"])
+def test_rejected_add_leaves_no_trace(organization):
+    database = Database()
+    database.overlap_policy = REJECT_OVERLAPS
+    database.add_organization(Organization("Kept", [IPAddressBlock("192.168.0.0/16")]))
+    with pytest.raises((ValueError, OverlapError)):
+        database.add_organization(organization)
+    assert organization.database is None
+    assert [organization.name for organization in database.organizations] == ["Kept"]
+    assert database.search_organizations("") == database.organizations
+    _check_consistent(database)
+    database.add_organization(Organization("Added after", [IPAddressBlock("10.0.0.0/8")]))
+    _check_consistent(database)
+
+
+def test_organization_cannot_be_added_twice():
+    database, other = Database(), Database()
+    organization = Organization("Once", [IPAddressBlock("10.0.0.0/8")])
+    database.add_organization(organization)
+    for target in (database, other):
+        with pytest.raises(ValueError):
+            target.add_organization(organization)
+    assert database.organizations == [organization] and other.organizations == []
+    database.remove_organization(organization)
+    other.add_organization(organization)
+    _check_consistent(database)
+    _check_consistent(other)
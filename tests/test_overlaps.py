@@ -0,0 +1,93 @@
+# Overlap policies and the bulk conflict audit against a pairwise check of every block
+import random
+from collections import Counter
+
+import pytest
+
+from model import ALLOW_OVERLAPS, REJECT_OVERLAPS, REPORT_OVERLAPS, Database, IPAddressBlock, Organization, OverlapError
+
+
+def _overlaps(block: IPAddressBlock, other: IPAddressBlock) -> bool:
+    return block.first <= other.last and other.first <= block.last
+
+
+def _random_block(generator: random.Random) -> IPAddressBlock:  # inside 10.0.0.0/16, so blocks collide often
+    length = generator.randint(18, 32)
+    return IPAddressBlock._from_int((10 << 24 | generator.getrandbits(16)) & ~(2 ** (32 - length) - 1), length)
+
+
+def _pairs(database: Database) -> list:
+    return [(organization, block) for organization in database.organizations for block in organization.ip_address_blocks]
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_reject_overlaps_matches_pairwise_check(seed, state):
+    generator = random.Random(seed)
+    database = Database()
+    assert database.overlap_policy == REJECT_OVERLAPS
+    for index in range(5):
+        database.add_organization(Organization(f"Organization {index}"))
+    for _ in range(300):
+        organization = generator.choice(database.organizations)
+        if organization.ip_address_blocks and generator.random() < 0.2:
+            organization.remove_ip_address_block(generator.choice(organization.ip_address_blocks))
+            continue
+        blocks = [_random_block(generator) for _ in range(generator.randint(1, 3))]
+        existing = [(other_organization, other_block) for other_organization, other_block in _pairs(database)
+                    if any(_overlaps(block, other_block) for block in blocks)]
+        within_batch = any(_overlaps(block, other) for position, block in enumerate(blocks) for other in blocks[position + 1:])
+        before = state(database)
+        if existing or within_batch:
+            with pytest.raises(OverlapError) as error:
+                organization.add_ip_address_blocks(blocks)
+            assert state(database) == before
+            for _, block, other_organization, other_block in error.value.overlaps:
+                assert any(block is new_block for new_block in blocks) and _overlaps(block, other_block)
+            reported = {(id(other_organization), id(other_block)) for _, _, other_organization, other_block in error.value.overlaps}
+            assert {(id(other_organization), id(other_block)) for other_organization, other_block in existing} <= reported
+        else:
+            organization.add_ip_address_blocks(blocks)
+            assert state(database) != before
+        assert database.find_conflicts() == []
+    assert database.reported_overlaps == []
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_find_conflicts_matches_pairwise_check(seed):
+    generator = random.Random(seed)
+    database = Database()
+    database.overlap_policy = ALLOW_OVERLAPS
+    for index in range(8):
+        database.add_organization(Organization(f"Organization {index}", [_random_block(generator) for _ in range(generator.randint(0, 12))]))
+    pairs = _pairs(database)
+    conflicts = database.find_conflicts()
+    for organization, block, other_organization, other_block in conflicts:
+        assert block is not other_block
+        assert other_block.first <= block.first and block.last <= other_block.last  # prefixes only overlap by nesting
+    # Every block inside another one is reported once, except that of a group of equal blocks one is left as the enclosing one
+    expected = Counter()
+    for position, (_, block) in enumerate(pairs):
+        enclosed = any(other_block.first <= block.first and block.last <= other_block.last
+                       and (other_block.get_num_addresses() > block.get_num_addresses() or other_position < position)
+                       for other_position, (_, other_block) in enumerate(pairs) if other_position != position)
+        if enclosed:
+            expected[(block.first, block.last)] += 1
+    assert Counter((block.first, block.last) for _, block, _, _ in conflicts) == expected
+
+
+def test_report_overlaps_keeps_every_block():
+    generator = random.Random(0)
+    database = Database()
+    database.overlap_policy = REPORT_OVERLAPS
+    for index in range(4):
+        database.add_organization(Organization(f"Organization {index}"))
+    for _ in range(100):
+        organization = generator.choice(database.organizations)
+        blocks = [_random_block(generator) for _ in range(generator.randint(1, 3))]
+        existing = [other_block for _, other_block in _pairs(database) if any(_overlaps(block, other_block) for block in blocks)]
+        within_batch = any(_overlaps(block, other) for position, block in enumerate(blocks) for other in blocks[position + 1:])
+        reported = len(database.reported_overlaps)
+        organization.add_ip_address_blocks(blocks)
+        assert all(any(block is added for added in organization.ip_address_blocks) for block in blocks)
+        assert (len(database.reported_overlaps) > reported) == bool(existing or within_batch)
+    assert bool(database.reported_overlaps) == bool(database.find_conflicts())
@@ -0,0 +1,32 @@
+# Shared memory lookups on a process pool against the single process ones
+import random
+
+import numpy as np
+import pytest
+
+from model import Database
+from parallel import ParallelLookup
+from snapshot import Snapshot
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_parallel_lookup_matches_lookup_many(seed, random_database):
+    generator = random.Random(seed)
+    database = random_database(generator, organization_count=50)
+    snapshot = Snapshot.from_database(database)
+    blocks = [block for organization in database.organizations for block in organization.ip_address_blocks]
+    with ParallelLookup(snapshot if seed % 2 else database, processes=2, chunk_size=97) as parallel:
+        for count in [0, 1, 96, 97, 98, 1000]:  # around the chunk size, and several batches through the same pool
+            addresses = [generator.getrandbits(32) for _ in range(count)]
+            addresses[:count // 2] = [generator.choice(blocks).first for _ in range(count // 2)]
+            addresses = np.array(addresses, dtype=np.uint32)
+            organization_indices, block_positions = parallel.lookup_many(addresses)
+            expected_organization_indices, expected_block_positions = snapshot.lookup_many(addresses)
+            assert organization_indices.tolist() == expected_organization_indices.tolist()
+            assert block_positions.tolist() == expected_block_positions.tolist()
+
+
+def test_parallel_lookup_empty_database():
+    with ParallelLookup(Database(), processes=1) as parallel:
+        organization_indices, block_positions = parallel.lookup_many(np.array([0, 2 ** 32 - 1], dtype=np.uint32))
+    assert organization_indices.tolist() == block_positions.tolist() == [-1, -1]
@@ -0,0 +1,125 @@
+# The lookup service on an ephemeral localhost port, and snapshot swaps while requests are in flight
+import asyncio
+import json
+import random
+
+import pytest
+
+from model import ALLOW_OVERLAPS, Database, IPAddress, IPAddressBlock, Organization
+from server import THREAD_BATCH_SIZE, LookupServer
+from snapshot import Snapshot
+
+
+def _database() -> Database:
+    database = Database()
+    database.overlap_policy = ALLOW_OVERLAPS  # nested blocks, so lookups have to pick the most specific one
+    database.add_organization(Organization("Example", [IPAddressBlock(IPAddress("10.0.0.0/8")), IPAddressBlock(IPAddress("10.1.0.0/16"))]))
+    database.add_organization(Organization("Other", [IPAddressBlock(IPAddress("192.168.0.0/24"))]))
+    return database
+
+
+async def _request(port: int, method: str, path: str, body: bytes = b"", headers: str = None) -> tuple[int, object]:  # (status, decoded JSON)
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    try:
+        if headers is None:
+            headers = f"Content-Length: {len(body)}\r\n"
+        writer.write(f"{method} {path} HTTP/1.1\r\n{headers}Connection: close\r\n\r\n".encode("latin-1") + body)
+        await writer.drain()
+        response = await reader.read()
+    finally:
+        writer.close()
+    head, _, body = response.partition(b"\r\n\r\n")
+    return int(head.split()[1]), json.loads(body)
+
+
+def _serve(server: LookupServer, requests):  # runs the coroutine function requests(port) against the started server
+    async def main():
+        http_server = await server.start("127.0.0.1", 0)
+        try:
+            return await requests(http_server.sockets[0].getsockname()[1])
+        finally:
+            http_server.close()
+            await http_server.wait_closed()
+
+    return asyncio.run(main())
+
+
+def test_lookup():
+    async def requests(port):
+        assert await _request(port, "GET", "/lookup/10.1.2.3") == (200, {"query": "10.1.2.3", "organization": "Example", "block": "10.1.0.0/16"})
+        assert await _request(port, "GET", "/lookup/10.2.0.1") == (200, {"query": "10.2.0.1", "organization": "Example", "block": "10.0.0.0/8"})
+        assert await _request(port, "GET", "/lookup/8.8.8.8") == (200, {"query": "8.8.8.8", "organization": None, "block": None})
+
+    _serve(LookupServer(Snapshot.from_database(_database())), requests)
+
+
+def test_batch_lookup():
+    database = _database()
+    generator = random.Random(0)
+    queries = [str(IPAddress(generator.choice([0x0A000000, 0x0A010000, 0xC0A80000, 0x08080800]) + generator.getrandbits(8))) for _ in range(50)]
+    queries.insert(7, "not an address")
+
+    async def requests(port):
+        status, payload = await _request(port, "POST", "/lookup", json.dumps(queries).encode())
+        assert status == 200
+        results = payload["results"]
+        assert [result["query"] for result in results] == queries
+        assert "error" in results[7]
+        for query, result in zip(queries, results):
+            if query != "not an address":
+                owner, block = database.find_owner(IPAddress(query))
+                assert result["organization"] == (owner.name if owner else None)
+                assert result["block"] == (str(block.get_identity_address()) if block else None)
+        assert await _request(port, "POST", "/lookup", json.dumps({"addresses": queries[:3]}).encode()) == \
+            (200, {"results": results[:3]})
+
+    _serve(LookupServer(Snapshot.from_database(database)), requests)
+
+
+@pytest.mark.parametrize("method, path, body, headers", [
+    ("GET", "/lookup/999.0.0.1", b"", None),
+    ("POST", "/lookup", b"[1, 2]", None),
+    ("POST", "/lookup", b"{not json", None),
+    ("POST", "/lookup", b"", "Content-Length: -1\r\n"),
+])
+def test_bad_request(method, path, body, headers):
+    async def requests(port):
+        status, payload = await _request(port, method, path, body, headers)
+        assert status == 400
+        assert payload["error"]
+
+    server = LookupServer(Snapshot.from_database(_database()))
+    _serve(server, requests)
+    assert server.error_count == 1
+
+
+def test_swap_after_write():  # edits reach the service only through a new snapshot
+    database = _database()
+    server = LookupServer(Snapshot.from_database(database))
+
+    async def requests(port):
+        database.organizations[1].add_ip_address_block(IPAddressBlock(IPAddress("10.1.2.0/24")))
+        assert (await _request(port, "GET", "/lookup/10.1.2.3"))[1]["organization"] == "Example"
+        server.swap(Snapshot.from_database(database))
+        assert (await _request(port, "GET", "/lookup/10.1.2.3"))[1]["organization"] == "Other"
+
+    _serve(server, requests)
+
+
+def test_swap_during_batch():  # a batch resolved on a thread finishes on the snapshot it started with
+    database = _database()
+    server = LookupServer(Snapshot.from_database(database))
+    queries = ["10.1.2.3"] * THREAD_BATCH_SIZE
+    database.organizations[1].add_ip_address_block(IPAddressBlock(IPAddress("10.1.2.0/24")))
+
+    async def main():
+        task = asyncio.create_task(server.route("POST", "/lookup", json.dumps(queries).encode()))
+        await asyncio.sleep(0)  # the task runs until it waits for the thread
+        server.swap(Snapshot.from_database(database))
+        before = await task
+        after = await server.route("POST", "/lookup", json.dumps(queries).encode())
+        return before, after
+
+    before, after = asyncio.run(main())
+    assert {result["organization"] for result in before["results"]} == {"Example"}
+    assert {result["organization"] for result in after["results"]} == {"Other"}
@@ -0,0 +1,99 @@
+# Round trips through the snapshot file format
+import random
+import struct
+
+import numpy as np
+import pytest
+
+from model import ALLOW_OVERLAPS, REJECT_OVERLAPS, REPORT_OVERLAPS, Database
+from snapshot import Snapshot, load_snapshot, save_snapshot
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_round_trip_keeps_database_and_lookups(seed, tmp_path, random_database, state):
+    generator = random.Random(seed)
+    database = random_database(generator)
+    path = str(tmp_path / "ipv4db.snapshot")
+    Snapshot.from_database(database, journal_sequence=seed * 1000).save(path)
+    snapshot = load_snapshot(path)
+    try:
+        assert snapshot.journal_sequence == seed * 1000
+        assert snapshot.organization_count() == len(database.organizations)
+        restored = snapshot.to_database()
+        assert state(restored) == state(database)
+        assert restored.total_allocated_ip_addresses() == database.total_allocated_ip_addresses()
+        addresses = [generator.getrandbits(32) for _ in range(200)]
+        addresses += [block.first for organization in database.organizations for block in organization.ip_address_blocks]
+        for address in addresses:
+            owner, block = database.find_owner(address)
+            name, snapshot_block = snapshot.find_owner(address)
+            assert name == (owner.name if owner else None)
+            assert (snapshot_block.first, snapshot_block.last) == (block.first, block.last) if block else snapshot_block is None
+        organization_indices, rows = snapshot.lookup_many(np.array(addresses, dtype=np.uint32))
+        database_indices, database_rows = database.lookup_many(np.array(addresses, dtype=np.uint32))
+        assert organization_indices.tolist() == database_indices.tolist()
+    finally:
+        snapshot.close()
+
+
+@pytest.mark.parametrize("overlap_policy", [REJECT_OVERLAPS, REPORT_OVERLAPS, ALLOW_OVERLAPS])
+def test_round_trip_keeps_overlap_policy(overlap_policy, tmp_path, random_database):
+    database = random_database(random.Random(0), 3)
+    database.overlap_policy = overlap_policy
+    path = str(tmp_path / "ipv4db.snapshot")
+    save_snapshot(database, path)
+    snapshot = load_snapshot(path)
+    try:
+        assert snapshot.overlap_policy == overlap_policy
+        assert snapshot.to_database().overlap_policy == overlap_policy
+    finally:
+        snapshot.close()
+
+
+def test_empty_database(tmp_path):
+    path = str(tmp_path / "ipv4db.snapshot")
+    save_snapshot(Database(), path)
+    snapshot = load_snapshot(path)
+    try:
+        assert snapshot.to_database().organizations == []
+        assert snapshot.find_owner(0) == (None, None)
+    finally:
+        snapshot.close()
+
+
+def test_corrupt_files_are_rejected(tmp_path, random_database):
+    path = str(tmp_path / "ipv4db.snapshot")
+    save_snapshot(random_database(random.Random(1), 5), path)
+    with open(path, "rb") as file:
+        data = bytearray(file.read())
+    data[-1] ^= 0xFF
+    with open(path, "wb") as file:
+        file.write(data)
+    with pytest.raises(ValueError):
+        load_snapshot(path)
+    with open(path, "wb") as file:
+        file.write(data[:40])
+    with pytest.raises(ValueError):
+        load_snapshot(path)
+    data[:8] = b"NOTASNAP"
+    with open(path, "wb") as file:
+        file.write(data)
+    with pytest.raises(ValueError):
+        load_snapshot(path)
+
+
+def test_version_1_files_still_load(tmp_path, random_database, state):  # version 1 had no journal sequence or flags, both read as 0
+    database = random_database(random.Random(2), 5)
+    path = str(tmp_path / "ipv4db.snapshot")
+    Snapshot.from_database(database, journal_sequence=7).save(path)
+    with open(path, "r+b") as file:
+        file.seek(8)
+        file.write(struct.pack("<H", 1))
+        file.seek(32)  # flags and journal sequence, reserved bytes in version 1
+        file.write(bytes(12))
+    snapshot = load_snapshot(path)
+    try:
+        assert snapshot.journal_sequence == 0 and snapshot.overlap_policy == REJECT_OVERLAPS
+        assert state(snapshot.to_database()) == state(database)
+    finally:
+        snapshot.close()